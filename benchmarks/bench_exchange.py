@@ -0,0 +1,178 @@
+"""Benchmark of the advanced exchange mode.
+
+Reports as JSON:
+    tick: per start_motion tick CPU/wall time of the demo exchange (simulator + syringe widget)
+    switch_over: wall/CPU time of the device sequence of switch_state_during_exchange against mocked pump
+                 devices with simulated latency, the blocked part (wall - cpu) is the time spent waiting on devices
+    throughput: sustained exchange rate in mL/min of simulated time, with the switch-over count
+
+Usage:
+    python benchmarks/bench_exchange.py --latency 0.005 --ticks 3000 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import platform
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+from PyQt5.QtWidgets import QApplication
+from syringe_widget import syringe_widget
+from operationmode.operations import advancedRefillingOperationMode, set_error_pop_up
+from operationmode.simulator import SyringeSimulator
+from operationmode.rigs import Rig, LEGACY_RIG
+from operationmode.virtual_clock import VirtualClock
+from benchmarks.mock_devices import mock_server_devices
+
+#valve connections required by the advanced exchange mode (see check_connection_for_advanced_auto_refilling)
+PUMP_SETTINGS = {'S1_left':'resevoir', 'S1_up':'waste', 'S1_right':'cell_inlet', 'S1_mvp':'channel_1', 'S1_solution':'NaOH', 'S1_volume':250,
+                 'S2_left':'resevoir', 'S2_up':'waste', 'S2_right':'cell_inlet', 'S2_mvp':'channel_2', 'S2_solution':'NaOH', 'S2_volume':250,
+                 'S3_left':'cell_outlet', 'S3_up':'waste', 'S3_right':'not_used', 'S3_mvp':'not_used', 'S3_solution':'waste', 'S3_volume':None,
+                 'S4_left':'cell_outlet', 'S4_up':'waste', 'S4_right':'not_used', 'S4_mvp':'not_used', 'S4_solution':'waste', 'S4_volume':None}
+
+def make_widget():
+    widget = syringe_widget()
+    widget.pump_settings = dict(PUMP_SETTINGS)
+    widget.set_resevoir_volumes()
+    widget.resize(800, 600)
+    widget.cell_volume_in_total = 1000
+    widget.volume_of_electrolyte_in_cell = 0.5
+    #S1 pushes to the cell, S3 pulls from the cell, S2 refills from the resevoir, S4 empties to the waste
+    widget.volume_syringe_1, widget.volume_syringe_2, widget.volume_syringe_3, widget.volume_syringe_4 = 12.5, 0, 0, 12.5
+    widget.connect_valve_port = {1:'right', 2:'left', 3:'left', 4:'up'}
+    widget.filling_status_syringe_1, widget.filling_status_syringe_2 = False, True
+    widget.filling_status_syringe_3, widget.filling_status_syringe_4 = True, False
+    widget.connect_status = {1:'moving', 2:'moving', 3:'moving', 4:'moving', 'mvp':'ready'}
+    return widget
+
+def make_mode(server_devices, widget, clock, demo, exchange_speed, refill_speed, total_exchange_amount):
+    settings = {'premotion_speed_handle':lambda:refill_speed,
+                'total_exchange_amount_handle':lambda:total_exchange_amount,
+                'exchange_speed_handle':lambda:exchange_speed,
+                'pre_pressure_volume_handle':lambda:0.02,
+                'pre_pressure_speed_handle':lambda:0.02,
+                'leftover_volume_handle':lambda:0,
+                'refill_speed_handle':lambda:refill_speed,
+                'time_record_handle':lambda:None,
+                'volume_record_handle':lambda volume:None,
+                'extra_amount_timer':clock.timer(),
+                'extra_amount_handle':lambda:0,
+                'extra_amount_speed_handle':lambda:0,
+                'timer_prepressure_S1':clock.timer(),
+                'timer_prepressure_S2':clock.timer(),
+                'timer_droplet_adjustment_S1':clock.timer(),
+                'timer_droplet_adjustment_S2':clock.timer(),
+                'timer_droplet_adjustment_S3':clock.timer(),
+                'timer_droplet_adjustment_S4':clock.timer(),
+                'set_under_exchange_to_false':lambda:None}
+    mode = advancedRefillingOperationMode(server_devices, widget, None, clock.timer(), clock.timer(), 100, widget.pump_settings, settings = settings, demo = demo)
+    mode.now = clock.time
+    mode.schedule = clock.call_later
+    mode.total_exchange_amount = total_exchange_amount
+    mode.exchange_amount_already = 0
+    #the benchmarks start in the middle of the exchange, past the first motion of init_motion
+    mode.init_motion_stage = False
+    for i in [1,2,3,4]:
+        mode.set_status(i, 'moving')
+    return mode
+
+def timed(records, func):
+    #wrap func, appending (wall, cpu) of every call to records
+    def wrapper(*args, **kwargs):
+        w0, c0 = time.perf_counter(), time.process_time()
+        result = func(*args, **kwargs)
+        records.append((time.perf_counter() - w0, time.process_time() - c0))
+        return result
+    return wrapper
+
+def summary(values):
+    values = np.asarray(values, dtype = float)
+    if len(values)==0:
+        return {'n':0}
+    return {'n':int(len(values)),
+            'mean_ms':float(values.mean()*1000),
+            'p50_ms':float(np.percentile(values, 50)*1000),
+            'p95_ms':float(np.percentile(values, 95)*1000),
+            'max_ms':float(values.max()*1000)}
+
+def bench_ticks(ticks, exchange_speed, refill_speed, total_exchange_amount):
+    clock = VirtualClock()
+    widget = make_widget()
+    #demo devices of the legacy rig, like operationmode.headless
+    server_devices = Rig('rig1', **LEGACY_RIG).demo_devices(SyringeSimulator(num_rigs = 1, num_syringes = 4))
+    mode = make_mode(server_devices, widget, clock, True, exchange_speed, refill_speed, total_exchange_amount)
+    tick_records, switch_records = [], []
+    mode.start_motion = timed(tick_records, mode.start_motion)
+    #the switch-over itself runs in staged call_later steps, the settle delays show up in simulated time
+    mode.switch_state_during_exchange = timed(switch_records, mode.switch_state_during_exchange)
+    mode.timer_motion.timeout.disconnect()
+    mode.timer_motion.timeout.connect(mode.start_motion)
+    mode.timer_motion.start(mode.timeout)
+    w0 = time.perf_counter()
+    clock.run(max_events = ticks)
+    wall = time.perf_counter() - w0
+    simulated_min = clock.time()/60.
+    return {'tick_cpu': summary([each[1] for each in tick_records]),
+            'tick_wall': summary([each[0] for each in tick_records]),
+            'demo_switch_wall': summary([each[0] for each in switch_records]),
+            'throughput': {'exchanged_ml': float(mode.exchange_amount_already),
+                           'simulated_min': float(simulated_min),
+                           'ml_per_min': float(mode.exchange_amount_already/simulated_min) if simulated_min>0 else 0.,
+                           'switch_overs': len(switch_records),
+                           'wall_s': float(wall),
+                           'realtime_factor': float(clock.time()/wall) if wall>0 else 0.}}
+
+def bench_switch_over(switches, latency, jitter, exchange_speed, refill_speed):
+    clock = VirtualClock()
+    widget = make_widget()
+    server_devices = mock_server_devices(latency, jitter)
+    mode = make_mode(server_devices, widget, clock, False, exchange_speed, refill_speed, 1e6)
+    records = []
+    calls_before = server_devices['latency'].calls
+    for i in range(switches):
+        w0, c0 = time.perf_counter(), time.process_time()
+        #the device sequence runs in the background, its GUI part follows from the event loop
+        mode.switch_state_during_exchange(syringe_index_list = [1, 2, 3, 4]).result()
+        records.append((time.perf_counter() - w0, time.process_time() - c0))
+        QApplication.processEvents()
+    return {'latency_s': latency,
+            'jitter_s': jitter,
+            'wall': summary([each[0] for each in records]),
+            'cpu': summary([each[1] for each in records]),
+            'blocked': summary([each[0] - each[1] for each in records]),
+            'device_calls_per_switch': float(server_devices['latency'].calls - calls_before)/max(switches, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark exchange tick cost, switch-over latency and throughput')
+    parser.add_argument('--ticks', type = int, default = 3000, help = 'number of timer events in the demo tick benchmark')
+    parser.add_argument('--switches', type = int, default = 10, help = 'number of switch-overs against the mocked devices')
+    parser.add_argument('--latency', type = float, default = 0.005, help = 'simulated device round trip in s')
+    parser.add_argument('--jitter', type = float, default = 0.0, help = 'uniform extra device latency in s')
+    parser.add_argument('--exchange-speed', type = float, default = 0.1, help = 'mL/s')
+    parser.add_argument('--refill-speed', type = float, default = 0.5, help = 'mL/s')
+    parser.add_argument('--total', type = float, default = 1000, help = 'total exchange amount in mL')
+    parser.add_argument('--output', default = None, help = 'write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    set_error_pop_up(False)
+    report = {'timestamp': time.time(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'args': vars(args)}
+    #the modes print progress messages, keep stdout clean for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report.update(bench_ticks(args.ticks, args.exchange_speed, args.refill_speed, args.total))
+        report['switch_over'] = bench_switch_over(args.switches, args.latency, args.jitter, args.exchange_speed, args.refill_speed)
+    text = json.dumps(report, indent = 2)
+    if args.output == None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+from operationmode.transport import Latency, DeviceStatusItem as MockStatusItem, SimulatedSyringe, SimulatedValve as MockMVP, SimulatedExchangePair as MockExchangePair, SimulatedPumpClient
+
+class MockSyringe(SimulatedSyringe):
+    #the switch-over benchmark measures the command round trips only, join does not wait for the motion
+    def join(self):
+        self._latency.wait()
+
+class MockClient(SimulatedPumpClient):
+    #client around the given syringes, the exchange pairs are built in mock_server_devices
+    def __init__(self, syringes, latency):
+        self.latency = latency
+        self._syringes = syringes
+        self._valves = {}
+        self.operations = {}
+        self._configuration = {'psd_widget': {}}
+
+def mock_server_devices(latency = 0.0, jitter = 0.0, syringe_volumes = {1:12500, 2:0, 3:0, 4:12500}):
+    #server_devices dict shaped like the one built in MyMainWindow.init_server_devices
+    lat = Latency(latency, jitter)
+    syringes = {i: MockSyringe(i, lat, volume = syringe_volumes[i]) for i in [1,2,3,4]}
+    client = MockClient(syringes, lat)
+    return {'syringe': syringes,
+            'T_valve': syringes,
+            #no move time, like MockSyringe.join only the round trips are measured
+            'mvp_valve': MockMVP(lat, move_time = 0),
+            'exchange_pair': {'S1_S3': MockExchangePair(syringes[1], syringes[3], lat),
+                              'S2_S4': MockExchangePair(syringes[2], syringes[4], lat)},
+            'client': client,
+            'latency': lat}
@@ -0,0 +1,231 @@
+"""Latency harness of the cloud relay.
+
+Runs a main client and its paired viewer in one process against the same relay backend
+(default: the in-process mongomock server, or a local mongod with --backend local), each side
+with its own simulated link latency on every database call (cloudrelay.backend.LatencyDatabase).
+Both sides run a cloudrelay.relay.RelayService like psd_app: the main side publishes the device
+info and serves the queued commands, the viewer follows it (WidgetDeltaApplier repaints the
+widget) and sends command bursts.
+
+Reports as JSON:
+    propagation: device change on the main client (syringe volume set) to the repaint of the
+                 changed volume in the viewer widget; changes overwritten before they were painted
+                 are counted as coalesced
+    round_trip: command burst sent by the viewer to its ack read back by the viewer, with the
+                main client side queue_latency/exec_latency of the same bursts
+
+Usage:
+    python benchmarks/relay_latency.py --latency 0.04 --jitter 0.02 --duration 20
+    python benchmarks/relay_latency.py --backend local --uri mongodb://localhost:27017 --output relay.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import QApplication, QSpinBox
+from syringe_widget import syringe_widget
+from cloudrelay.backend import BACKENDS, open_client, LatencyDatabase
+from cloudrelay.publisher import device_info_fields
+from cloudrelay.subscriber import WidgetDeltaApplier
+from cloudrelay.relay import RelayService
+from cloudrelay.commands import CommandDispatcher, command, call
+from benchmarks.bench_exchange import summary, PUMP_SETTINGS
+
+MAIN_ID = 'bench_main'
+VIEWER_ID = 'bench_viewer'
+
+class StatusBar(object):
+    #the part of QStatusBar used by the relay
+    def __init__(self):
+        self.message = ''
+
+    def showMessage(self, message):
+        self.message = message
+
+    def currentMessage(self):
+        return self.message
+
+class RepaintRecorder(syringe_widget):
+    #viewer widget, records (time, S1 volume) of every paint
+    def __init__(self):
+        super().__init__()
+        self.pump_settings = dict(PUMP_SETTINGS)
+        self.set_resevoir_volumes()
+        self.paints = []
+
+    def paintEvent(self, e):
+        super().paintEvent(e)
+        self.paints.append((time.time(), self.volume_syringe_1))
+
+class MainClient(QtCore.QObject):
+    """Main client side: RelayService publishing and serving the viewer, commands executed in the GUI thread."""
+    def __init__(self, database, publish_interval):
+        super(MainClient, self).__init__()
+        self.widget_psd = syringe_widget()
+        self.statusbar = StatusBar()
+        #set_widget target of the benchmark bursts
+        self.spinBox_speed = QSpinBox()
+        self.spinBox_speed.setMaximum(10**9)
+        device_info = device_info_fields(self)
+        device_info['client_id'] = MAIN_ID
+        database.device_info.delete_one({'client_id': MAIN_ID})
+        database.device_info.insert_one(device_info)
+        self.relay = RelayService(database, MAIN_ID, publish_interval = publish_interval)
+        self.dispatcher = CommandDispatcher(self)
+        self.relay.bridge.exec_cmd.connect(self._exec_cmd)
+        #device info snapshots taken in the GUI thread, like psd_app
+        self.publish_interval = publish_interval
+        self.timer_push = QtCore.QTimer(self)
+        self.timer_push.timeout.connect(self.push_device_info)
+        #{change number: time.time() of the change}
+        self.changes = {}
+
+    def stop_all_motion(self):
+        pass
+
+    def change_device(self):
+        #a new S1 volume per change, the volume is the change number
+        number = len(self.changes) + 1
+        self.changes[number] = time.time()
+        self.widget_psd.volume_syringe_1 = float(number)
+
+    @QtCore.pyqtSlot(object)
+    def _exec_cmd(self, document):
+        started = time.time()
+        results = self.dispatcher.execute_report(document['commands'])
+        self.relay.ack(document, results, started, time.time())
+
+    def push_device_info(self):
+        self.relay.push_fields(device_info_fields(self))
+
+    def start(self):
+        self.relay.start()
+        self.push_device_info()
+        self.timer_push.start(int(self.publish_interval*1000))
+        self.relay.publish()
+        self.relay.serve(VIEWER_ID).result()
+
+    def stop(self):
+        self.timer_push.stop()
+        self.relay.stop()
+
+class ViewerClient(QtCore.QObject):
+    """Viewer side: RelayService following the main client, delta applier and repaints in the GUI thread."""
+    def __init__(self, database, poll_interval, ack_interval, max_fps):
+        super(ViewerClient, self).__init__()
+        self.widget_psd = RepaintRecorder()
+        self.widget_psd.resize(800, 600)
+        self.widget_psd.set_max_fps(max_fps)
+        self.widget_psd.show()
+        self.statusbar = StatusBar()
+        self.applier = WidgetDeltaApplier(self, max_fps = max_fps)
+        self.relay = RelayService(database, VIEWER_ID, poll_interval = poll_interval, ack_interval = ack_interval)
+        self.relay.bridge.delta_received.connect(self._merge)
+        self.relay.bridge.acks_received.connect(self._acks)
+        self.relay.bridge.message.connect(self.statusbar.showMessage)
+        self.acks = []
+        self.bursts = 0
+
+    @QtCore.pyqtSlot(str, object)
+    def _merge(self, client_id, delta):
+        self.applier.merge(delta)
+
+    @QtCore.pyqtSlot(str, object)
+    def _acks(self, client_id, acks):
+        self.acks.extend(acks)
+
+    def send_burst(self):
+        self.bursts += 1
+        self.relay.send(MAIN_ID, [command('set_widget', name = 'spinBox_speed', value = self.bursts), call('stop_all_motion')])
+
+    def start(self):
+        self.applier.start()
+        self.relay.start()
+        self.relay.follow(MAIN_ID).result()
+
+    def stop(self):
+        self.applier.stop()
+        self.relay.stop()
+
+def propagation(changes, paints):
+    #delay of the first paint showing each change, changes never painted are coalesced
+    delays = {}
+    for painted, volume in paints:
+        number = int(round(volume))
+        if number in changes and number not in delays:
+            delays[number] = painted - changes[number]
+    return delays
+
+def run_harness(args):
+    client = open_client(args.backend, args.uri)
+    client.drop_database(args.database)
+    database = client[args.database]
+    main = MainClient(LatencyDatabase(database, args.latency, args.jitter), args.publish_interval)
+    viewer = ViewerClient(LatencyDatabase(database, args.latency, args.jitter), args.poll_interval, args.ack_interval, args.max_fps)
+    timers = []
+    for interval, slot in [(args.change_interval, main.change_device), (args.cmd_interval, viewer.send_burst)]:
+        timer = QtCore.QTimer()
+        timer.timeout.connect(slot)
+        timers.append((timer, int(interval*1000)))
+    loop = QtCore.QEventLoop()
+    main.start()
+    viewer.start()
+    for timer, interval in timers:
+        timer.start(interval)
+    #stop changing and sending after duration, keep reading for drain s so the last ones arrive
+    QtCore.QTimer.singleShot(int(args.duration*1000), lambda: [timer.stop() for timer, _ in timers])
+    QtCore.QTimer.singleShot(int((args.duration + args.drain)*1000), loop.quit)
+    loop.exec_()
+    main.stop()
+    viewer.stop()
+    delays = propagation(main.changes, viewer.widget_psd.paints)
+    acked = [ack for ack in viewer.acks if ack.get('round_trip', None) != None]
+    return {'propagation': summary(list(delays.values())),
+            'changes': len(main.changes),
+            'coalesced': len(main.changes) - len(delays),
+            'round_trip': summary([ack['round_trip'] for ack in acked]),
+            'queue_latency': summary([ack['queue_latency'] for ack in acked]),
+            'exec_latency': summary([ack['exec_latency'] for ack in acked]),
+            'bursts_unacked': viewer.bursts - len(acked),
+            'failed': len([ack for ack in viewer.acks if not ack['ok']]),
+            'db_calls': {'main': main.relay.database.latency.calls, 'viewer': viewer.relay.database.latency.calls},
+            'relay_messages': viewer.statusbar.currentMessage()}
+
+def main():
+    parser = argparse.ArgumentParser(description = 'State propagation delay and command round trip of the cloud relay')
+    parser.add_argument('--backend', default = 'memory', choices = BACKENDS, help = 'relay backend, see cloudrelay.backend')
+    parser.add_argument('--uri', default = None, help = 'server uri, default of the backend if not given')
+    parser.add_argument('--database', default = 'relay_latency_bench', help = 'database used (dropped at start)')
+    parser.add_argument('--latency', type = float, default = 0.04, help = 'simulated round trip of every database call in s, per side')
+    parser.add_argument('--jitter', type = float, default = 0.01, help = 'uniform extra latency in s')
+    parser.add_argument('--duration', type = float, default = 10, help = 'seconds of changes and commands')
+    parser.add_argument('--drain', type = float, default = 2, help = 'seconds to wait for the last changes and acks')
+    parser.add_argument('--change-interval', type = float, default = 0.1, help = 's between two device changes on the main client')
+    parser.add_argument('--cmd-interval', type = float, default = 0.5, help = 's between two command bursts of the viewer')
+    parser.add_argument('--ack-interval', type = float, default = 0.2, help = 's between two ack reads of the viewer')
+    parser.add_argument('--publish-interval', type = float, default = 0.05, help = 'publish cycle of the main client in s')
+    parser.add_argument('--poll-interval', type = float, default = 0.2, help = 'poll interval of the viewer without change streams in s')
+    parser.add_argument('--max-fps', type = float, default = 20, help = 'repaint cap of the viewer')
+    parser.add_argument('--output', default = None, help = 'write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    report = {'timestamp': time.time(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'args': vars(args)}
+    report.update(run_harness(args))
+    text = json.dumps(report, indent = 2)
+    if args.output == None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Startup time report of psd_app.
+
+Reports:
+    imports: `python -X importtime -c "import psd_app"` grouped by top level package, cumulative
+             import time of each package in ms, sorted (slowest first)
+    ui: time to build the main window and the dialogs from the .ui files, cold (compiled ui cache
+        removed, includes compiling) and warm (cached modules)
+
+Each measurement runs in a fresh interpreter with the offscreen Qt platform, nothing is imported
+in this process.
+
+Usage:
+    python benchmarks/startup_report.py --top 15
+    python benchmarks/startup_report.py --json --output startup.json
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import subprocess
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from uiloader import CACHE_DIR
+
+UI_FILES = ['psd_gui.ui', 'config_pump_dialog.ui', 'refill_cell_dialog2.ui', 'cleaner_dialog.ui',
+            'reset_resevoir_waste_dialog.ui', 'start_mongo_server.ui', 'start_pump_client.ui']
+
+#built in the child process: time of import psd_app, QApplication and load_ui of every .ui file
+UI_SCRIPT = '''
+import os, sys, time, json
+t0 = time.perf_counter()
+import psd_app
+t1 = time.perf_counter()
+from PyQt5.QtWidgets import QApplication, QMainWindow, QDialog
+app = QApplication(sys.argv)
+t2 = time.perf_counter()
+from uiloader import load_ui
+result = {'import_psd_app': t1 - t0, 'qapplication': t2 - t1, 'ui': {}}
+for name in json.loads(sys.argv[1]):
+    t = time.perf_counter()
+    load_ui(os.path.join(psd_app.script_path, name), QMainWindow() if name == 'psd_gui.ui' else QDialog())
+    result['ui'][name] = time.perf_counter() - t
+print(json.dumps(result))
+'''
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+def import_times():
+    #list of (cumulative us, nesting level, module) from -X importtime
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import psd_app'], cwd = ROOT, env = child_env(),
+                          stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+    entries = []
+    for line in proc.stderr.splitlines():
+        #import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        level = (len(name) - len(name.lstrip()) - 1)//2
+        entries.append((int(cumulative), level, name.strip()))
+    if proc.returncode != 0:
+        raise RuntimeError('import psd_app failed:\n{}'.format(proc.stderr.splitlines()[-1] if proc.stderr else ''))
+    return entries
+
+def group_by_package(entries):
+    #cumulative time of the outermost import of each top level package, in ms
+    totals = {}
+    for cumulative, level, name in entries:
+        if level != 0:
+            continue
+        package = name.split('.')[0]
+        totals[package] = totals.get(package, 0) + cumulative/1000.
+    return sorted(totals.items(), key = lambda item: -item[1])
+
+def ui_times(cold):
+    if cold:
+        shutil.rmtree(os.path.join(ROOT, CACHE_DIR), ignore_errors = True)
+    proc = subprocess.run([sys.executable, '-c', UI_SCRIPT, json.dumps(UI_FILES)], cwd = ROOT, env = child_env(),
+                          stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+    if proc.returncode != 0:
+        raise RuntimeError('ui load failed:\n{}'.format(proc.stderr))
+    return json.loads(proc.stdout.splitlines()[-1])
+
+def print_report(report, top):
+    print('{:<28}{:>12}'.format('package', 'import [ms]'))
+    for package, ms in report['imports'][:top]:
+        print('{:<28}{:>12.1f}'.format(package, ms))
+    print('{:<28}{:>12.1f}'.format('total', report['import_total']))
+    print()
+    print('{:<32}{:>12}{:>12}'.format('startup step', 'cold [ms]', 'warm [ms]'))
+    cold, warm = report['ui']['cold'], report['ui']['warm']
+    for key in ['import_psd_app', 'qapplication']:
+        print('{:<32}{:>12.1f}{:>12.1f}'.format(key, cold[key]*1000, warm[key]*1000))
+    for name in UI_FILES:
+        print('{:<32}{:>12.1f}{:>12.1f}'.format(name, cold['ui'][name]*1000, warm['ui'][name]*1000))
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Import time and ui load time breakdown of psd_app')
+    parser.add_argument('--top', type = int, default = 20, help = 'number of packages listed in the table')
+    parser.add_argument('--json', action = 'store_true', help = 'print the report as JSON')
+    parser.add_argument('--output', default = None, help = 'also write the JSON report to this file')
+    args = parser.parse_args()
+    entries = import_times()
+    packages = group_by_package(entries)
+    report = {'python': sys.version.split()[0],
+              'imports': packages,
+              'import_total': sum(ms for _, ms in packages),
+              'ui': {'cold': ui_times(cold = True), 'warm': ui_times(cold = False)}}
+    if args.json:
+        print(json.dumps(report, indent = 1))
+    else:
+        print_report(report, args.top)
+    if args.output != None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 1)
+
+if __name__ == '__main__':
+    main()
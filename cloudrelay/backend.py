@@ -0,0 +1,68 @@
+"""MongoDB backends of the cloud relay.
+
+    atlas   the hosted cluster, logged in with the user name and password of the dialog
+    local   a mongod on this machine or the lab network (default mongodb://localhost:27017)
+    memory  an in-process mongomock server, shared by every client opened in the process, so a
+            main client and a viewer can be paired without any server (tests, benchmarks)
+
+pymongo and mongomock are only imported when a backend is opened. LatencyDatabase wraps a
+database and adds a simulated round trip to every collection call, to see how the relay behaves
+on a slow link while running against the local or memory backend.
+"""
+from urllib.parse import quote_plus
+from operationmode.transport import Latency
+
+BACKENDS = ['atlas', 'local', 'memory']
+ATLAS_URI = 'mongodb+srv://{}:{}@cluster0.sjw9m.mongodb.net/<dbname>?retryWrites=true&w=majority'
+LOCAL_URI = 'mongodb://localhost:27017'
+
+#the in-process server of the memory backend
+_memory_client = None
+
+def open_client(backend = 'atlas', uri = None, login_name = '', password = '', **kwargs):
+    #uri overrides the default of the backend (ignored by memory), kwargs go to MongoClient
+    global _memory_client
+    if backend == 'atlas':
+        from pymongo import MongoClient
+        return MongoClient(uri or ATLAS_URI.format(quote_plus(login_name), quote_plus(password)), **kwargs)
+    elif backend == 'local':
+        from pymongo import MongoClient
+        return MongoClient(uri or LOCAL_URI, **kwargs)
+    elif backend == 'memory':
+        import mongomock
+        if _memory_client == None:
+            _memory_client = mongomock.MongoClient()
+        return _memory_client
+    else:
+        raise ValueError('unknown relay backend {}, use one of {}'.format(backend, BACKENDS))
+
+class LatencyCollection(object):
+    #collection proxy, every method call waits one simulated round trip first
+    def __init__(self, collection, latency):
+        self._collection = collection
+        self._latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            self._latency.wait()
+            return attr(*args, **kwargs)
+        return call
+
+class LatencyDatabase(object):
+    """Database proxy adding latency + uniform(0, jitter) s to every collection call."""
+    def __init__(self, database, latency = 0.0, jitter = 0.0):
+        self._database = database
+        self.latency = Latency(latency, jitter)
+
+    def __getitem__(self, name):
+        return LatencyCollection(self._database[name], self.latency)
+
+    def __getattr__(self, name):
+        #database.device_info style access returns a collection, wrap it like database['device_info']
+        attr = getattr(self._database, name)
+        if hasattr(attr, 'find_one'):
+            return LatencyCollection(attr, self.latency)
+        return attr
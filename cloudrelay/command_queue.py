@@ -0,0 +1,134 @@
+import queue
+import time
+
+#collection names in the session database
+QUEUE_COLLECTION = 'cmd_queue'
+ACK_COLLECTION = 'cmd_ack'
+COUNTER_COLLECTION = 'counters'
+
+def ensure_indexes(database):
+    #one document per (sender, seq), acks are looked up by receiver of the ack and seq
+    database[QUEUE_COLLECTION].create_index([('client_id', 1), ('seq', 1)], unique = True)
+    database[ACK_COLLECTION].create_index([('target_id', 1), ('seq', 1)])
+
+class CommandSender(object):
+    """Viewer side of the command queue.
+
+    send() appends a burst of typed commands (cloudrelay.commands) to the append-only cmd_queue
+    collection under the next sequence number of this client and returns at once; any number of
+    bursts can be in flight. The server stamps the burst with its own clock (queued). poll_acks() picks up the ack documents written by the main client
+    and adds the round trip seen from this client (send to ack read, same clock).
+    """
+    def __init__(self, database, client_id, target_id):
+        self.database = database
+        self.client_id = client_id
+        self.target_id = target_id
+        #{seq: time.time() at send} of the bursts without ack yet
+        self.in_flight = {}
+        self._last_ack = self._max_acked_seq()
+
+    def _max_acked_seq(self):
+        last = self.database[ACK_COLLECTION].find_one({'target_id': self.client_id}, sort = [('seq', -1)])
+        return 0 if last == None else last['seq']
+
+    def next_seq(self):
+        #atomic per sender counter, survives restarts of the viewer
+        from pymongo import ReturnDocument
+        counter = self.database[COUNTER_COLLECTION].find_one_and_update({'_id': 'cmd_seq_{}'.format(self.client_id)}, {'$inc': {'seq': 1}},
+                                                                        upsert = True, return_document = ReturnDocument.AFTER)
+        return counter['seq']
+
+    def send(self, commands):
+        seq = self.next_seq()
+        sent = time.time()
+        #seq is new, so this inserts; queued is the server time, sent the time of this client
+        self.database[QUEUE_COLLECTION].update_one({'client_id': self.client_id, 'seq': seq},
+                                                   {'$setOnInsert': {'target_id': self.target_id, 'commands': commands, 'sent': sent},
+                                                    '$currentDate': {'queued': True}}, upsert = True)
+        self.in_flight[seq] = sent
+        return seq
+
+    def poll_acks(self):
+        #new ack documents in seq order, with 'round_trip' in s added for bursts sent by this session
+        acks = list(self.database[ACK_COLLECTION].find({'target_id': self.client_id, 'seq': {'$gt': self._last_ack}}, sort = [('seq', 1)]))
+        now = time.time()
+        for ack in acks:
+            sent = self.in_flight.pop(ack['seq'], None)
+            ack['round_trip'] = None if sent == None else now - sent
+            self._last_ack = max(self._last_ack, ack['seq'])
+        return acks
+
+class CommandReceiver(object):
+    """Main client side of the command queue.
+
+    fetch() reads all bursts queued for this client after the last fetched sequence number in
+    one query, so a burst of spin box updates plus a start command arrives together and runs in
+    order. ack() only queues the ack document, flush_acks() writes the queued acks with one
+    insert_many, from the thread doing the database traffic. After a restart fetching resumes
+    after the last acked burst, nothing is run twice; bursts queued more than max_age s ago (eg.
+    while the main client was down) are acked as expired instead of being run. Their age is taken
+    on the server clock, the clocks of the viewer and of this client may differ.
+    """
+    def __init__(self, database, client_id, sender_id, max_age = 300):
+        self.database = database
+        self.client_id = client_id
+        self.sender_id = sender_id
+        self.max_age = max_age
+        self._acks = queue.Queue()
+        last = self.database[ACK_COLLECTION].find_one({'client_id': self.client_id, 'target_id': self.sender_id}, sort = [('seq', -1)])
+        self.last_seq = 0 if last == None else last['seq']
+
+    def fetch(self):
+        documents = list(self.database[QUEUE_COLLECTION].find({'client_id': self.sender_id, 'target_id': self.client_id, 'seq': {'$gt': self.last_seq}},
+                                                              sort = [('seq', 1)]))
+        if len(documents)==0:
+            return []
+        received = time.time()
+        now = self.server_time()
+        fresh = []
+        for document in documents:
+            document['received'] = received
+            self.last_seq = max(self.last_seq, document['seq'])
+            #bursts queued before the server stamp was added are not expired
+            queued = document.get('queued', None)
+            if queued != None and (now - queued).total_seconds() > self.max_age:
+                self.ack(document, [{'ok': False, 'error': 'expired', 'ms': 0.}], received, received)
+            else:
+                fresh.append(document)
+        return fresh
+
+    def server_time(self):
+        #current time of the database server, one round trip
+        from pymongo import ReturnDocument
+        clock = self.database[COUNTER_COLLECTION].find_one_and_update({'_id': 'clock_{}'.format(self.client_id)}, {'$currentDate': {'now': True}},
+                                                                      upsert = True, return_document = ReturnDocument.AFTER)
+        return clock['now']
+
+    def ack(self, document, results, started, finished):
+        #results: per command report of CommandDispatcher.execute_report
+        self._acks.put({'client_id': self.client_id, 'target_id': self.sender_id, 'seq': document['seq'],
+                        'ok': all([each['ok'] for each in results]), 'results': results,
+                        #main client clock: time waiting in the GUI queue and executing
+                        'queue_latency': started - document['received'], 'exec_latency': finished - started})
+
+    def flush_acks(self):
+        acks = []
+        while True:
+            try:
+                acks.append(self._acks.get_nowait())
+            except queue.Empty:
+                break
+        if len(acks) != 0:
+            self.database[ACK_COLLECTION].insert_many(acks)
+        return len(acks)
+
+def describe_ack(ack):
+    #one line per burst: seq, status, latencies in ms and the failed commands
+    text = 'cmd #{} {}'.format(ack['seq'], 'done' if ack['ok'] else 'failed')
+    if ack.get('round_trip', None) != None:
+        text += ', round trip {:.0f} ms'.format(ack['round_trip']*1000)
+    text += ', queued {:.0f} ms, executed {:.1f} ms'.format(ack['queue_latency']*1000, ack['exec_latency']*1000)
+    errors = ['{}: {}'.format(i, each['error']) for i, each in enumerate(ack['results']) if not each['ok']]
+    if len(errors) != 0:
+        text += ' ({})'.format('; '.join(errors))
+    return text
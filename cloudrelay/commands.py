@@ -0,0 +1,221 @@
+"""Typed remote commands sent from the viewer client to the main client.
+
+A command is a BSON-native subdocument {'op': name, 'args': {...}} and a burst is a list of
+them, queued as one cmd_queue document (see cloudrelay.command_queue), eg.
+
+    [{'op': 'set_widget', 'args': {'name': 'spinBox_speed', 'value': 50}},
+     {'op': 'call', 'args': {'name': 'start_exchange_advance', 'args': [True]}}]
+
+The main client runs a burst with CommandDispatcher: every command is checked against the
+whitelists below first (op, widget/attribute/method name and argument types), then all of them
+are executed in one pass. Nothing is compiled or evaluated, anything not whitelisted is refused
+and a burst with one bad command is refused as a whole.
+"""
+import time
+
+class CommandError(ValueError):
+    pass
+
+#widget name -> how its state is set and read
+WIDGET_KINDS = {'doubleSpinBox':'value',
+                'doubleSpinBox_exchange_amount':'value',
+                'spinBox_speed':'value',
+                'lineEdit_default_speed':'text',
+                'comboBox_exchange_mode':'current_text',
+                'spinBox_amount':'value',
+                'doubleSpinBox_prepresure_vol':'value',
+                'doubleSpinBox_prepressure_rate':'value',
+                'doubleSpinBox_leftover_vol':'value',
+                'checkBox_auto':'checked'}
+#widgets of one syringe, named <prefix>_<syringe index>; the index must be a syringe of the rig shown
+SYRINGE_WIDGET_KINDS = {'doubleSpinBox_speed_normal_mode':'value',
+                        'doubleSpinBox_stroke_factor':'value',
+                        'comboBox_valve_port':'current_text'}
+
+#kind -> (setter, getter, accepted value types)
+WIDGET_ACCESS = {'value': ('setValue', 'value', (int, float)),
+                 'text': ('setText', 'text', (str,)),
+                 'current_text': ('setCurrentText', 'currentText', (str,)),
+                 'checked': ('setChecked', 'isChecked', (bool,))}
+
+#buttons the remote client may click, per syringe as above
+CLICKABLE = []
+SYRINGE_CLICKABLE = ['pushButton_fill_syringe']
+
+#syringe widget attribute -> value types (fill cell mode parameters)
+PSD_ATTRIBUTES = {'actived_syringe_fill_cell_mode': (int,),
+                  'refill_times_fill_cell_mode': (int,),
+                  'refill_speed_fill_cell_mode': (int, float),
+                  'disposal_speed_fill_cell_mode': (int, float),
+                  'vol_to_cell_fill_cell_mode': (int, float),
+                  'vol_to_waste_fill_cell_mode': (int, float)}
+
+#main window method -> argument types
+CALLS = {'init_start_advance': [],
+         'init_start_simple': [],
+         'start_exchange_advance': [bool],
+         'start_exchange_simple': [bool],
+         '_pickup_init_mode': [],
+         '_dispense_init_mode': [],
+         '_fill_syringe': [int],
+         '_dispense_syringe': [int],
+         'start_fill_cell': [],
+         'stop_all_motion': [],
+         #rig shown by the main window, by name (see operationmode.rigs)
+         'select_rig': [str]}
+
+def _check_type(value, types, what):
+    #bool is an int subclass, only accept it where bool is asked for
+    if isinstance(value, bool) and bool not in types:
+        raise CommandError('{}: bool not accepted'.format(what))
+    if not isinstance(value, types):
+        raise CommandError('{}: {} not accepted'.format(what, type(value).__name__))
+
+def _syringe_widget(name, prefixes):
+    #(prefix, syringe index) of a per syringe widget name, None for any other name
+    if not isinstance(name, str):
+        return None
+    prefix, _, index = name.rpartition('_')
+    if prefix in prefixes and index.isdigit():
+        return prefix, int(index)
+    return None
+
+def _widget_kind(name):
+    if name in WIDGET_KINDS:
+        return WIDGET_KINDS[name]
+    syringe_widget = _syringe_widget(name, SYRINGE_WIDGET_KINDS)
+    if syringe_widget != None:
+        return SYRINGE_WIDGET_KINDS[syringe_widget[0]]
+    return None
+
+def _check_syringe(target, name, prefixes):
+    #a per syringe widget of a syringe the rig shown by target does not have
+    syringe_widget = _syringe_widget(name, prefixes)
+    rig = getattr(target, 'rig', None)
+    if syringe_widget != None and rig != None and syringe_widget[1] not in rig.syringe_indices:
+        raise CommandError('rig {} has no syringe {}'.format(rig.name, syringe_widget[1]))
+
+def _check_set_widget(args):
+    if _widget_kind(args.get('name', None)) == None:
+        raise CommandError('widget {} is not remote controllable'.format(args.get('name', None)))
+    _check_type(args.get('value', None), WIDGET_ACCESS[_widget_kind(args['name'])][2], args['name'])
+
+def _check_click(args):
+    name = args.get('name', None)
+    if name not in CLICKABLE and _syringe_widget(name, SYRINGE_CLICKABLE) == None:
+        raise CommandError('button {} is not remote controllable'.format(name))
+
+def _check_set_psd(args):
+    if args.get('name', None) not in PSD_ATTRIBUTES:
+        raise CommandError('attribute {} is not remote controllable'.format(args.get('name', None)))
+    _check_type(args.get('value', None), PSD_ATTRIBUTES[args['name']], args['name'])
+
+def _check_set_resume(args):
+    _check_type(args.get('value', None), (bool,), 'resume')
+
+def _check_call(args):
+    name = args.get('name', None)
+    if name not in CALLS:
+        raise CommandError('method {} is not remote callable'.format(name))
+    call_args = args.get('args', [])
+    if not isinstance(call_args, list) or len(call_args) != len(CALLS[name]):
+        raise CommandError('{} takes {} argument(s)'.format(name, len(CALLS[name])))
+    for value, arg_type in zip(call_args, CALLS[name]):
+        _check_type(value, (arg_type,), name)
+
+def _set_widget(target, args):
+    _check_syringe(target, args['name'], SYRINGE_WIDGET_KINDS)
+    getattr(getattr(target, args['name']), WIDGET_ACCESS[_widget_kind(args['name'])][0])(args['value'])
+
+def _click(target, args):
+    _check_syringe(target, args['name'], SYRINGE_CLICKABLE)
+    getattr(target, args['name']).click()
+
+def _set_psd(target, args):
+    setattr(target.widget_psd, args['name'], args['value'])
+
+def _set_resume(target, args):
+    target.advanced_exchange_operation.resume = args['value']
+
+def _call(target, args):
+    return getattr(target, args['name'])(*args.get('args', []))
+
+#op -> (validator, handler)
+HANDLERS = {'set_widget': (_check_set_widget, _set_widget),
+            'click': (_check_click, _click),
+            'set_psd': (_check_set_psd, _set_psd),
+            'set_resume': (_check_set_resume, _set_resume),
+            'call': (_check_call, _call)}
+
+def validate(commands):
+    if not isinstance(commands, list):
+        #the legacy clients sent python source strings, these are never executed
+        raise CommandError('a command burst must be a list of commands, got {}'.format(type(commands).__name__))
+    for command in commands:
+        if not isinstance(command, dict) or command.get('op', None) not in HANDLERS:
+            raise CommandError('unknown command {}'.format(command))
+        if not isinstance(command.get('args', {}), dict):
+            raise CommandError('args of {} must be a document'.format(command['op']))
+        HANDLERS[command['op']][0](command.get('args', {}))
+    return commands
+
+class CommandDispatcher(object):
+    """Validate and run command bursts on target (the main window)."""
+    def __init__(self, target):
+        self.target = target
+
+    def execute(self, commands):
+        #all commands are checked before the first one runs
+        validate(commands)
+        return [HANDLERS[command['op']][1](self.target, command.get('args', {})) for command in commands]
+
+    def execute_report(self, commands):
+        #run a burst and report per command {'ok', 'error', 'ms'}; after a failed command the rest is skipped
+        try:
+            validate(commands)
+        except CommandError as e:
+            return [{'ok': False, 'error': 'refused: {}'.format(e), 'ms': 0.}]
+        report = []
+        failed = False
+        for command in commands:
+            if failed:
+                report.append({'ok': False, 'error': 'skipped', 'ms': 0.})
+                continue
+            t0 = time.perf_counter()
+            try:
+                HANDLERS[command['op']][1](self.target, command.get('args', {}))
+                report.append({'ok': True, 'error': None, 'ms': (time.perf_counter() - t0)*1000})
+            except Exception as e:
+                failed = True
+                report.append({'ok': False, 'error': str(e), 'ms': (time.perf_counter() - t0)*1000})
+        return report
+
+#command builders used by the viewer client
+def command(op, **args):
+    return {'op': op, 'args': args}
+
+def call(name, *args):
+    return command('call', name = name, args = list(args))
+
+def widget_commands(target, names):
+    #set_widget commands carrying the current state of the named widgets of target
+    commands = []
+    for name in names:
+        value = getattr(getattr(target, name), WIDGET_ACCESS[_widget_kind(name)][1])()
+        commands.append(command('set_widget', name = name, value = value))
+    return commands
+
+def describe(commands):
+    #short text of a burst for the response field and the GUI
+    if not isinstance(commands, list):
+        return str(commands)
+    text = []
+    for each in commands:
+        args = each.get('args', {}) if isinstance(each, dict) else {}
+        if isinstance(each, dict) and each.get('op', None) == 'call':
+            text.append('{}({})'.format(args.get('name', ''), ', '.join([str(arg) for arg in args.get('args', [])])))
+        elif isinstance(each, dict):
+            text.append('{} {}={}'.format(each.get('op', None), args.get('name', ''), args.get('value', '')))
+        else:
+            text.append(str(each))
+    return '; '.join(text)
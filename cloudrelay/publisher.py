@@ -0,0 +1,91 @@
+import time
+from pymongo import UpdateOne
+
+#default publish interval in seconds (the legacy loop published every 50 ms)
+PUBLISH_INTERVAL = 0.05
+
+def device_info_fields(parent):
+    #flat dict of the device info shown to the remote operator, values are BSON-native:
+    #numbers as floats/ints and the per syringe dicts as subdocuments (BSON keys are strings)
+    widget = parent.widget_psd
+    return {'S1_vol': float(widget.volume_syringe_1),
+            'valve_pos': {str(key): value for key, value in widget.connect_valve_port.items()},
+            'S2_vol': float(widget.volume_syringe_2),
+            'S3_vol': float(widget.volume_syringe_3),
+            'S4_vol': float(widget.volume_syringe_4),
+            'cell_vol': float(widget.volume_of_electrolyte_in_cell),
+            'mvp_valve': int(widget.mvp_channel),
+            'resevoir_vol': float(widget.resevoir_volumn),
+            'waste_vol': float(widget.waste_volumn),
+            'connect_status': {str(key): value for key, value in widget.connect_status.items()},
+            'operation_mode': widget.operation_mode,
+            'statusbar': parent.statusbar.currentMessage()}
+
+class DeviceInfoPublisher(object):
+    """Publish device info documents to the device_info collection.
+
+    Keeps the last published values per client_id and only sends the fields that changed,
+    as one $set per document. Nothing is written when nothing changed. publish_many() sends
+    the documents of several rigs in a single bulk_write round trip.
+    """
+    def __init__(self, collection, publish_interval = PUBLISH_INTERVAL):
+        self.collection = collection
+        #seconds between two publish cycles
+        self.publish_interval = publish_interval
+        #{client_id: {field: value}} as last seen by the database
+        self._published = {}
+        self._last_publish = 0
+        self.write_count = 0
+
+    def set_publish_rate(self, rate):
+        #rate in Hz
+        self.publish_interval = 1./rate
+
+    def due(self):
+        return (time.time() - self._last_publish) >= self.publish_interval
+
+    def wait(self):
+        #sleep until the next publish cycle is due
+        time.sleep(max(0, self.publish_interval - (time.time() - self._last_publish)))
+
+    def diff(self, client_id, fields):
+        published = self._published.get(client_id, {})
+        return {key: value for key, value in fields.items() if published.get(key, None) != value}
+
+    def _mark_published(self, client_id, changed):
+        self._published.setdefault(client_id, {}).update(changed)
+
+    def publish(self, client_id, fields):
+        self._last_publish = time.time()
+        changed = self.diff(client_id, fields)
+        if len(changed)==0:
+            return 0
+        self.collection.update_one({'client_id':client_id},{'$set':changed})
+        self._mark_published(client_id, changed)
+        self.write_count += 1
+        return len(changed)
+
+    def publish_many(self, fields_by_client):
+        #fields_by_client: {client_id: fields}, one bulk_write for all rigs with changes
+        self._last_publish = time.time()
+        requests = []
+        changes = {}
+        for client_id, fields in fields_by_client.items():
+            changed = self.diff(client_id, fields)
+            if len(changed)!=0:
+                requests.append(UpdateOne({'client_id':client_id},{'$set':changed}))
+                changes[client_id] = changed
+        if len(requests)==0:
+            return 0
+        self.collection.bulk_write(requests, ordered = False)
+        for client_id, changed in changes.items():
+            self._mark_published(client_id, changed)
+        self.write_count += 1
+        return sum([len(each) for each in changes.values()])
+
+    def reset(self, client_id = None):
+        #forget what was published, the next cycle sends the full document again
+        if client_id == None:
+            self._published = {}
+        else:
+            self._published.pop(client_id, None)
@@ -0,0 +1,287 @@
+"""Cloud relay service: all database traffic of a client runs as asyncio tasks in one thread.
+
+A RelayService belongs to one client (client_id) and runs an event loop in its own thread:
+
+    publish()          main client: publish the device info handed over last with push_fields(fields),
+                       the fields are built in the GUI thread, the relay thread never reads Qt
+    serve(viewer_id)   main client: fetch the command bursts queued by viewer_id, emit them and
+                       write the acks; one task per viewer, any number of viewers can be served
+    follow(main_id)    viewer: follow the device info of main_id (change stream, polling as
+                       fallback) and read the acks of the bursts sent with send(main_id, ...)
+    heartbeat          always: the client's last_seen is written to the heartbeat collection and
+                       the heartbeats of all served/followed peers are read back
+
+The tasks only talk to Qt through the signals of RelayBridge, emitted from the relay thread and
+delivered queued to the slots of GUI objects. stop() cancels the tasks cooperatively, writes the
+pending acks and an offline heartbeat, and joins the thread.
+
+The database calls use the blocking pymongo (or mongomock) API of the cloudrelay classes and run
+on a small thread pool of the loop, the same way motor wraps pymongo, so the atlas, local and
+memory backends all work without another driver.
+"""
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5 import QtCore
+from pymongo.errors import PyMongoError
+from cloudrelay.publisher import DeviceInfoPublisher, PUBLISH_INTERVAL
+from cloudrelay.subscriber import parse_device_info, changed_fields, watch_pipeline
+from cloudrelay.command_queue import CommandSender, CommandReceiver, ensure_indexes
+
+HEARTBEAT_COLLECTION = 'heartbeat'
+
+class RelayBridge(QtCore.QObject):
+    #cmd_queue document with a burst of typed commands, to be executed and acked (main client)
+    exec_cmd = QtCore.pyqtSignal(object)
+    #main client id, parsed device info delta (viewer)
+    delta_received = QtCore.pyqtSignal(str, object)
+    #main client id, new acks of the bursts sent to it (viewer)
+    acks_received = QtCore.pyqtSignal(str, object)
+    #peer id, s since its last heartbeat changed
+    peer_alive = QtCore.pyqtSignal(str, float)
+    peer_lost = QtCore.pyqtSignal(str, float)
+    message = QtCore.pyqtSignal(str)
+    stopped = QtCore.pyqtSignal()
+
+class RelayService(object):
+    def __init__(self, database, client_id, publish_interval = PUBLISH_INTERVAL, fetch_interval = 0.05, poll_interval = 0.2,
+                 ack_interval = 0.2, heartbeat_interval = 2., heartbeat_timeout = 10., workers = 4):
+        self.database = database
+        self.client_id = client_id
+        #created in the calling (GUI) thread, the signals are emitted from the relay thread
+        self.bridge = RelayBridge()
+        self.publisher = DeviceInfoPublisher(database.device_info, publish_interval = publish_interval)
+        #seconds between two command fetches (main), device info polls and ack reads (viewer)
+        self.fetch_interval = fetch_interval
+        self.poll_interval = poll_interval
+        self.ack_interval = ack_interval
+        self.heartbeat_interval = heartbeat_interval
+        #a peer whose heartbeat did not change for heartbeat_timeout s is reported lost
+        self.heartbeat_timeout = heartbeat_timeout
+        self.workers = workers
+        self.receivers = {}
+        self.senders = {}
+        #{peer id: [last_seen value read, local time it was read first, lost]}
+        self.peers = {}
+        #device info pushed last from the GUI thread, only set in the relay thread
+        self._fields = None
+        self.loop = None
+        self._thread = None
+        self._executor = None
+        self._tasks = {}
+
+    @property
+    def running(self):
+        return self._thread != None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers = self.workers, thread_name_prefix = 'relay_io')
+        self._tasks = {}
+        self._fields = None
+        self._thread = threading.Thread(target = self._run, name = 'relay_{}'.format(self.client_id), daemon = True)
+        self._thread.start()
+        self._submit(self._start())
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+
+    def stop(self, timeout = 5.):
+        #cooperative shutdown, returns when the thread is gone (or after timeout s)
+        if not self.running:
+            return
+        try:
+            self._submit(self._shutdown()).result(timeout)
+        except Exception as e:
+            print('Relay of {} did not shut down cleanly: {}'.format(self.client_id, e))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._executor.shutdown(wait = False)
+        self.bridge.stopped.emit()
+
+    #thread safe entry points, each returns a concurrent.futures.Future
+    def publish(self):
+        #publish the device info pushed last every publish cycle, nothing before the first push_fields
+        return self._submit(self._spawn('publish', self._repeat('publish device info', self.publisher.publish_interval, self._publish)))
+
+    def push_fields(self, fields):
+        #fields: device info dict of this client, a snapshot taken in the GUI thread (device_info_fields)
+        if self.running:
+            self.loop.call_soon_threadsafe(self._set_fields, dict(fields))
+
+    def serve(self, viewer_id):
+        return self._submit(self._serve(viewer_id))
+
+    def follow(self, main_id):
+        return self._submit(self._follow(main_id))
+
+    def drop(self, peer_id):
+        #stop serving/following peer_id
+        return self._submit(self._drop(peer_id))
+
+    def send(self, main_id, commands):
+        #queue a validated burst for main_id, the future gives its seq number
+        return self._submit(self._send(main_id, commands))
+
+    def ack(self, document, results, started, finished):
+        #called from the GUI thread after running a burst, written by the serve task of its sender
+        self.receivers[document['client_id']].ack(document, results, started, finished)
+
+    def _submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def _io(self, func, *args, **kwargs):
+        #blocking database call on the thread pool of the loop
+        return await self.loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _spawn(self, name, coroutine):
+        if name in self._tasks:
+            self._tasks.pop(name).cancel()
+        self._tasks[name] = self.loop.create_task(coroutine)
+
+    async def _repeat(self, what, interval, step):
+        #await step() every interval s until cancelled, a failed step is reported and tried again next cycle
+        while True:
+            t0 = time.time()
+            try:
+                await step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.bridge.message.emit('Relay: fail to {}: {}'.format(what, e))
+            await asyncio.sleep(max(0, interval - (time.time() - t0)))
+
+    def _set_fields(self, fields):
+        self._fields = fields
+
+    async def _publish(self):
+        if self._fields != None:
+            await self._io(self.publisher.publish, self.client_id, self._fields)
+
+    async def _send(self, main_id, commands):
+        try:
+            return await self._io(self.senders[main_id].send, commands)
+        except Exception as e:
+            self.bridge.message.emit('Relay: fail to send the command burst to {}: {!r}'.format(main_id, e))
+
+    async def _start(self):
+        try:
+            await self._io(ensure_indexes, self.database)
+        except PyMongoError as e:
+            self.bridge.message.emit('Relay: fail to create the indexes: {}'.format(e))
+        await self._spawn('heartbeat', self._repeat('exchange heartbeats', self.heartbeat_interval, self._heartbeat))
+
+    async def _shutdown(self):
+        tasks = list(self._tasks.values())
+        self._tasks = {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+        try:
+            for receiver in self.receivers.values():
+                await self._io(receiver.flush_acks)
+            await self._io(self.database[HEARTBEAT_COLLECTION].update_one, {'_id': self.client_id},
+                           {'$set': {'last_seen': time.time(), 'online': False}}, upsert = True)
+        except PyMongoError as e:
+            print('Relay: fail to write the last acks/heartbeat: {}'.format(e))
+
+    def _watch_peer(self, peer_id):
+        self.peers.setdefault(peer_id, [None, time.time(), False])
+
+    async def _drop(self, peer_id):
+        for name in ['serve {}'.format(peer_id), 'follow {}'.format(peer_id), 'acks {}'.format(peer_id)]:
+            if name in self._tasks:
+                self._tasks.pop(name).cancel()
+        self.peers.pop(peer_id, None)
+
+    async def _heartbeat(self):
+        collection = self.database[HEARTBEAT_COLLECTION]
+        await self._io(collection.update_one, {'_id': self.client_id},
+                       {'$set': {'last_seen': time.time(), 'online': True}}, upsert = True)
+        if len(self.peers)==0:
+            return
+        documents = await self._io(lambda: list(collection.find({'_id': {'$in': list(self.peers)}})))
+        beats = {document['_id']: document for document in documents}
+        now = time.time()
+        for peer_id, state in self.peers.items():
+            document = beats.get(peer_id, {})
+            #age by the local clock since the peer's last_seen last changed, the two clocks may differ
+            if document.get('last_seen', None) != state[0]:
+                state[0], state[1] = document.get('last_seen', None), now
+            age = now - state[1]
+            #a peer stopped cleanly is lost at once, one not started yet gets heartbeat_timeout s
+            if document.get('online', True) and age < self.heartbeat_timeout:
+                if len(document)!=0:
+                    state[2] = False
+                    self.bridge.peer_alive.emit(peer_id, age)
+            elif not state[2]:
+                state[2] = True
+                self.bridge.peer_lost.emit(peer_id, age)
+
+    async def _serve(self, viewer_id):
+        receiver = await self._io(CommandReceiver, self.database, self.client_id, viewer_id)
+        self.receivers[viewer_id] = receiver
+        self._watch_peer(viewer_id)
+        async def step():
+            #every burst queued since the last cycle, executed in seq order by the GUI thread
+            for document in await self._io(receiver.fetch):
+                self.bridge.exec_cmd.emit(document)
+            #acks of the bursts executed meanwhile, one write
+            await self._io(receiver.flush_acks)
+        await self._spawn('serve {}'.format(viewer_id), self._repeat('serve {}'.format(viewer_id), self.fetch_interval, step))
+
+    async def _follow(self, main_id):
+        self.senders[main_id] = await self._io(CommandSender, self.database, self.client_id, main_id)
+        self._watch_peer(main_id)
+        async def acks():
+            new = await self._io(self.senders[main_id].poll_acks)
+            if len(new)!=0:
+                self.bridge.acks_received.emit(main_id, new)
+        await self._spawn('acks {}'.format(main_id), self._repeat('read the acks of {}'.format(main_id), self.ack_interval, acks))
+        await self._spawn('follow {}'.format(main_id), self._device_info(main_id))
+
+    async def _device_info(self, main_id):
+        collection = self.database.device_info
+        last = {}
+        def emit(fields):
+            changed = changed_fields(last, fields)
+            if len(changed)==0:
+                return
+            try:
+                self.bridge.delta_received.emit(main_id, parse_device_info(changed))
+            except (ValueError, SyntaxError, AttributeError) as e:
+                self.bridge.message.emit('Bad device info from cloud: {}'.format(str(e)))
+        async def poll():
+            document = await self._io(collection.find_one, {'client_id': main_id})
+            if document != None:
+                emit(document)
+        try:
+            #updateLookup so that the client_id match also works for update events
+            stream = await self._io(collection.watch, watch_pipeline(main_id), full_document = 'updateLookup', max_await_time_ms = 500)
+        except (PyMongoError, NotImplementedError) as e:
+            self.bridge.message.emit('Change stream not available, polling instead: {}'.format(str(e)))
+            await self._repeat('read device info of {}'.format(main_id), self.poll_interval, poll)
+            return
+        try:
+            #sync after the stream is open so no change slips in between
+            await poll()
+            while True:
+                #returns after at most max_await_time_ms, cancelling never waits longer on the pool
+                change = await self._io(stream.try_next)
+                if change == None:
+                    continue
+                if change['operationType'] == 'update':
+                    emit(change['updateDescription']['updatedFields'])
+                else:
+                    emit(change['fullDocument'])
+        except PyMongoError as e:
+            self.bridge.message.emit('Change stream of {} broken, polling instead: {}'.format(main_id, str(e)))
+            await self._repeat('read device info of {}'.format(main_id), self.poll_interval, poll)
+        finally:
+            self._executor.submit(stream.close)
@@ -0,0 +1,163 @@
+import ast
+import time
+from PyQt5 import QtCore
+from pymongo.errors import PyMongoError
+
+def syringe_dict(value):
+    #subdocument {'1': ..., 'mvp': ...} back to the widget keys {1: ..., 'mvp': ...}
+    #documents written by older clients hold the repr string of the dict
+    if isinstance(value, str):
+        value = ast.literal_eval(value)
+    return {int(key) if str(key).isdigit() else key: each for key, each in value.items()}
+
+#device_info field -> (widget attribute, parser); statusbar is handled separately
+FIELD_PARSERS = {'S1_vol': ('volume_syringe_1', float),
+                 'S2_vol': ('volume_syringe_2', float),
+                 'S3_vol': ('volume_syringe_3', float),
+                 'S4_vol': ('volume_syringe_4', float),
+                 'cell_vol': ('volume_of_electrolyte_in_cell', float),
+                 'valve_pos': ('connect_valve_port', syringe_dict),
+                 'connect_status': ('connect_status', syringe_dict),
+                 'mvp_valve': ('mvp_channel', int),
+                 'resevoir_vol': ('resevoir_volumn', float),
+                 'waste_vol': ('waste_volumn', float),
+                 'operation_mode': ('operation_mode', str)}
+
+def parse_device_info(fields):
+    #turn raw device_info fields into {widget_attr: value}, unknown fields are dropped
+    parsed = {}
+    for key, value in fields.items():
+        if key == 'statusbar':
+            parsed['statusbar'] = value
+        elif key in FIELD_PARSERS:
+            attr, parser = FIELD_PARSERS[key]
+            parsed[attr] = parser(value)
+    return parsed
+
+def changed_fields(last, fields):
+    #fields of a device_info document (or update) differing from last, last is updated in place
+    changed = {key: value for key, value in fields.items() if key not in ['_id', 'client_id'] and last.get(key, None) != value}
+    last.update(changed)
+    return changed
+
+def watch_pipeline(client_id = None):
+    #change stream pipeline of the device_info documents of client_id (all clients if None)
+    pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace']}}}]
+    if client_id != None:
+        pipeline[0]['$match']['fullDocument.client_id'] = client_id
+    return pipeline
+
+class DeviceInfoSubscriber(QtCore.QObject):
+    """Follow the device_info document of the main client and emit only what changed.
+
+    A MongoDB change stream is used when the server supports it (replica set/Atlas). A
+    standalone mongod or a mongomock stand-in has no change streams, then the document is
+    polled every poll_interval seconds and diffed locally. Either way delta_received carries
+    already parsed {widget_attr: value} dicts and is meant to be connected to a receiver
+    living in the GUI thread.
+    """
+    delta_received = QtCore.pyqtSignal(object)
+    subscribe_failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, collection, client_id = None, poll_interval = 0.2):
+        super(DeviceInfoSubscriber, self).__init__()
+        self.collection = collection
+        self.client_id = client_id
+        #seconds between two reads in polling mode
+        self.poll_interval = poll_interval
+        self.running = False
+        self.use_change_stream = True
+        self._last = {}
+
+    def _filter(self):
+        if self.client_id == None:
+            return {}
+        return {'client_id': self.client_id}
+
+    def _emit_changes(self, fields):
+        changed = changed_fields(self._last, fields)
+        if len(changed)==0:
+            return
+        try:
+            self.delta_received.emit(parse_device_info(changed))
+        except (ValueError, SyntaxError, AttributeError) as e:
+            self.subscribe_failed.emit('Bad device info from cloud: {}'.format(str(e)))
+
+    def _initial_sync(self):
+        document = self.collection.find_one(self._filter())
+        if document != None:
+            self._emit_changes(document)
+
+    def _watch(self):
+        #updateLookup so that the client_id match also works for update events
+        with self.collection.watch(watch_pipeline(self.client_id), full_document = 'updateLookup', max_await_time_ms = 500) as stream:
+            #sync after the stream is open so no change slips in between
+            self._initial_sync()
+            while self.running:
+                change = stream.try_next()
+                if change == None:
+                    continue
+                if change['operationType'] == 'update':
+                    self._emit_changes(change['updateDescription']['updatedFields'])
+                else:
+                    self._emit_changes(change['fullDocument'])
+
+    def _poll(self):
+        while self.running:
+            t0 = time.time()
+            self._initial_sync()
+            time.sleep(max(0, self.poll_interval - (time.time() - t0)))
+
+    def run(self):
+        self.running = True
+        if self.use_change_stream:
+            try:
+                self._watch()
+                return
+            except (PyMongoError, NotImplementedError) as e:
+                #no change streams on this server, fall back to polling
+                self.use_change_stream = False
+                self.subscribe_failed.emit('Change stream not available, polling instead: {}'.format(str(e)))
+        self._poll()
+
+    def stop(self):
+        self.running = False
+
+class WidgetDeltaApplier(QtCore.QObject):
+    """Apply device info deltas to the psd widget from the GUI thread at a capped frame rate.
+
+    Deltas are merged as they arrive and flushed by a QTimer at most max_fps times per
+    second, with one widget repaint per flush.
+    """
+    def __init__(self, parent, max_fps = 20):
+        super(WidgetDeltaApplier, self).__init__()
+        self.parent = parent
+        self._pending = {}
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.apply)
+        self.set_max_fps(max_fps)
+
+    def set_max_fps(self, max_fps):
+        self.max_fps = max_fps
+        self.timer.setInterval(int(1000/max_fps))
+
+    def start(self):
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    @QtCore.pyqtSlot(object)
+    def merge(self, delta):
+        self._pending.update(delta)
+
+    def apply(self):
+        if len(self._pending)==0:
+            return
+        pending, self._pending = self._pending, {}
+        statusbar = pending.pop('statusbar', None)
+        if statusbar != None:
+            self.parent.statusbar.showMessage(statusbar)
+        for attr, value in pending.items():
+            setattr(self.parent.widget_psd, attr, value)
+        self.parent.widget_psd.update()
@@ -0,0 +1,213 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from operationmode.transport import CONNECTION_ERRORS
+
+#one session (client connection) per role, so a slow configuration read never waits behind a valve move
+ROLES = ['motion', 'status', 'config']
+
+class DeviceQueue(object):
+    """FIFO command queue of one device, executed by its own worker thread.
+
+    Commands for the same device run in submission order, commands for different devices run in
+    parallel. submit() returns a concurrent.futures.Future at once, so a caller can pipeline
+    several requests and only wait for the results it needs.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target = self._run, name = 'psd_queue_{}'.format(name), daemon = True)
+        self._worker.start()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item == None:
+                break
+            future, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def close(self):
+        self._queue.put(None)
+
+class ClientPool(object):
+    """Persistent pump client sessions per role with per-device command queues.
+
+    factory() opens a new client (eg. lambda: psd.connect(device_name)); each role in roles gets
+    its own session, opened on first use and kept for the lifetime of the pool. submit(role,
+    device, func, *args) queues func(client, *args) on the queue of device and returns a Future.
+    When a command fails with one of connection_errors (by default the socket/serial errors of
+    operationmode.transport, any other error is passed to the caller untouched) the session of the role is opened again
+    with exponential backoff (backoff, 2*backoff, ... up to max_backoff s, at most retries
+    attempts). Commands of roles in retry_roles (reads and configuration writes) are then run
+    once more; motion commands are never repeated, their error is passed to the caller.
+    Callbacks added with on_connect(role, callback) are called with the new client after every
+    (re)connect, eg. to rebuild the device proxies derived from the session. Failed connection
+    attempts are passed to report(message), from the queue threads (by default to the log).
+    """
+    def __init__(self, factory, roles = ROLES, retries = 5, backoff = 0.5, max_backoff = 10, retry_roles = ['status', 'config'], connection_errors = CONNECTION_ERRORS, report = None):
+        self.factory = factory
+        self.roles = list(roles)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_roles = list(retry_roles)
+        self.connection_errors = connection_errors
+        self._sessions = {}
+        self._session_locks = {role: threading.Lock() for role in self.roles}
+        self._queues = {}
+        self._queues_lock = threading.Lock()
+        self._callbacks = {role: [] for role in self.roles}
+        self.reconnects = 0
+        self.report = logging.getLogger().warning if report == None else report
+
+    def _connect(self, role):
+        #open a session for role, waiting backoff, 2*backoff, ... between failed attempts
+        delay = self.backoff
+        for attempt in range(self.retries):
+            try:
+                client = self.factory()
+            except self.connection_errors as e:
+                if attempt == self.retries - 1:
+                    raise
+                self.report('Fail to open the {} session (attempt {}), retry in {} s: {}'.format(role, attempt + 1, delay, e))
+                time.sleep(delay)
+                delay = min(self.max_backoff, delay*2)
+                continue
+            self._sessions[role] = client
+            for callback in self._callbacks[role]:
+                callback(client)
+            return client
+
+    def session(self, role):
+        with self._session_locks[role]:
+            if role not in self._sessions:
+                self._connect(role)
+            return self._sessions[role]
+
+    def reconnect(self, role, broken = None):
+        #drop the session (only if it is still the broken one, other commands may have reconnected already)
+        with self._session_locks[role]:
+            if broken == None or self._sessions.get(role, None) is broken:
+                self._sessions.pop(role, None)
+                self.reconnects += 1
+                self._connect(role)
+            return self._sessions[role]
+
+    def on_connect(self, role, callback):
+        self._callbacks[role].append(callback)
+        if role in self._sessions:
+            callback(self._sessions[role])
+
+    def queue(self, device):
+        with self._queues_lock:
+            if device not in self._queues:
+                self._queues[device] = DeviceQueue(device)
+            return self._queues[device]
+
+    def _execute(self, role, func, args, kwargs):
+        client = self.session(role)
+        try:
+            return func(client, *args, **kwargs)
+        except self.connection_errors:
+            client = self.reconnect(role, broken = client)
+            if role not in self.retry_roles:
+                raise
+            return func(client, *args, **kwargs)
+
+    def submit(self, role, device, func, *args, **kwargs):
+        return self.queue(device).submit(self._execute, role, func, args, kwargs)
+
+    def call(self, role, device, func, *args, **kwargs):
+        #blocking submit, for callers that need the result right away
+        return self.submit(role, device, func, *args, **kwargs).result()
+
+    def pending(self):
+        return {device: each.pending() for device, each in self._queues.items()}
+
+    def close(self):
+        with self._queues_lock:
+            for each in self._queues.values():
+                each.close()
+            self._queues = {}
+        #the sessions are not reused, a closed pool opens new ones on the next use
+        closed = []
+        for role in self.roles:
+            with self._session_locks[role]:
+                client = self._sessions.pop(role, None)
+            #a factory may hand out one client to several roles
+            close = getattr(client, 'close', None)
+            if close != None and not any([client is each for each in closed]):
+                closed.append(client)
+                try:
+                    close()
+                except Exception as e:
+                    self.report('Fail to close the {} session: {}'.format(role, e))
+
+class PooledDevice(object):
+    """Device proxy whose attribute reads, writes and method calls run on the queue of a ClientPool.
+
+    resolve(client) returns the device in a session of role (eg. lambda client: client.getSyringe(4)),
+    it is resolved again after a reconnect and setup(device) is then run on it first (eg. the valve
+    position names). Every access waits for the commands submitted before on the queue name, so
+    the motions of one device keep their order and a broken session is reconnected by the pool.
+    Attributes holding other devices (eg. pushSyr/pullSyr of an exchange pair) are listed in
+    devices as name -> wrap(device), run on the queue, returning the PooledDevice of that device.
+    """
+    def __init__(self, pool, role, name, resolve, setup = None, devices = {}):
+        #plain attributes of the proxy itself, __setattr__ is forwarded to the device
+        self.__dict__.update({'_pool': pool, '_role': role, '_name': name, '_resolve': resolve, '_setup': setup,
+                              '_devices': dict(devices), '_resolved': (None, None)})
+
+    def _device(self, client):
+        #runs in the queue thread of the device
+        if self._resolved[0] is not client:
+            device = self._resolve(client)
+            if self._setup != None:
+                self._setup(device)
+            self.__dict__['_resolved'] = (client, device)
+        return self._resolved[1]
+
+    def _call(self, func):
+        return self._pool.call(self._role, self._name, lambda client: func(self._device(client)))
+
+    def _method(self, name):
+        def method(*args, **kwargs):
+            return self._call(lambda device: getattr(device, name)(*args, **kwargs))
+        return method
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name in self._devices:
+            #read on the queue, the device may change (eg. swap of an exchange pair)
+            return self._call(lambda device: self._devices[name](getattr(device, name)))
+        #methods of the device class are known without a round trip, anything else is read on the queue
+        if callable(getattr(type(self._resolved[1]), name, None)):
+            return self._method(name)
+        value = self._call(lambda device: getattr(device, name))
+        if callable(value):
+            #eg. commands resolved dynamically by the device proxy
+            return self._method(name)
+        return value
+
+    def __setattr__(self, name, value):
+        self._call(lambda device: setattr(device, name, value))
+
+    def __repr__(self):
+        return 'PooledDevice({}, {})'.format(self._role, self._name)
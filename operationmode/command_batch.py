@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from PyQt5 import QtCore
+
+#shared by all batches, created on first use
+_EXECUTOR = None
+MAX_WORKERS = 8
+#command sequences run in the background (run_in_background), apart from the batch workers they wait for
+_SEQUENCE_EXECUTOR = None
+_POSTER = None
+
+def _executor():
+    global _EXECUTOR
+    if _EXECUTOR == None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers = MAX_WORKERS, thread_name_prefix = 'psd_cmd')
+    return _EXECUTOR
+
+class CommandBatch(object):
+    """Collect independent device commands and run them at the same time.
+
+    add() queues a blocking device call (eg. a valve move followed by join()), run() submits all
+    of them to a thread pool and waits for all together, so the batch takes as long as the
+    slowest command instead of the sum. Callbacks registered with on_done() are run afterwards
+    in the calling thread (the GUI thread), in the order they were added.
+    Only put commands in one batch that do not depend on each other.
+    """
+    def __init__(self):
+        self._commands = []
+        self._callbacks = []
+
+    def __len__(self):
+        return len(self._commands)
+
+    def add(self, func, *args, **kwargs):
+        self._commands.append((func, args, kwargs))
+
+    def on_done(self, callback):
+        self._callbacks.append(callback)
+
+    def run(self, timeout = None):
+        #return the results in the order of add(), the first exception raised by a command is re-raised
+        results = self.run_commands(timeout)
+        self.run_callbacks()
+        return results
+
+    def run_commands(self, timeout = None):
+        #the commands only, eg in a background sequence whose callbacks run later in the GUI thread
+        commands, self._commands = self._commands, []
+        if len(commands)==1:
+            func, args, kwargs = commands[0]
+            return [func(*args, **kwargs)]
+        futures = [_executor().submit(func, *args, **kwargs) for func, args, kwargs in commands]
+        wait(futures, timeout = timeout)
+        return [future.result(timeout = 0) for future in futures]
+
+    def run_callbacks(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+class _Poster(QtCore.QObject):
+    #runs the callables emitted from any thread in the thread it was created in (the GUI thread), queued
+    posted = QtCore.pyqtSignal(object)
+
+    def __init__(self):
+        super(_Poster, self).__init__()
+        self.posted.connect(self._run)
+
+    @QtCore.pyqtSlot(object)
+    def _run(self, callback):
+        callback()
+
+def run_in_background(func, done, failed):
+    """Run func() (a blocking sequence of device commands) off the GUI thread.
+
+    done(result) or failed(exception) is then called in the calling (GUI) thread from its event loop.
+    Returns the Future of func.
+    """
+    global _SEQUENCE_EXECUTOR, _POSTER
+    if _SEQUENCE_EXECUTOR == None:
+        _SEQUENCE_EXECUTOR = ThreadPoolExecutor(max_workers = MAX_WORKERS, thread_name_prefix = 'psd_sequence')
+        _POSTER = _Poster()
+    poster = _POSTER
+    def finished(future):
+        if future.exception() != None:
+            poster.posted.emit(lambda: failed(future.exception()))
+        else:
+            poster.posted.emit(lambda: done(future.result()))
+    future = _SEQUENCE_EXECUTOR.submit(func)
+    future.add_done_callback(finished)
+    return future
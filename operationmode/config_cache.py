@@ -0,0 +1,124 @@
+import copy
+import logging
+from collections import deque
+from PyQt5.QtCore import QTimer
+
+class ConfigurationWriteCache(object):
+    """Write-behind cache for one section of client.configuration (psd_widget by default).
+
+    Attribute updates are merged into a pending dict and only the keys whose values differ
+    from what the pump server already holds are kept. The pending changes are pushed in a
+    single read-modify-write after a short debounce, or right away on barrier().
+    Reads go through get() so the GUI always sees its own pending writes.
+    With a ClientPool the reads and writes run on its 'config' session and queue, a debounced
+    flush then returns at once and only barrier() waits for the write to reach the server.
+    The changes of a failed queued write are pending again and go out with the next flush.
+    """
+    def __init__(self, client, section = 'psd_widget', debounce = 200, pool = None):
+        self.client = client
+        self.pool = pool
+        self.section = section
+        #debounce time in ms
+        self.debounce = debounce
+        self._pending = {}
+        #last known server side values of the section, fetched lazily
+        self._pushed = None
+        self.flush_count = 0
+        #Future of the last queued write (pool only)
+        self._last_write = None
+        #changes of the failed queued writes, appended in the config queue thread
+        self._failed = deque()
+        self._timer = QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+
+    def _read_section(self, client):
+        #the psd_widget_<rig> sections of further rigs only exist once written
+        return copy.deepcopy(client.configuration.get(self.section, {}))
+
+    def _write_section(self, client, changes):
+        config = client.configuration
+        config.setdefault(self.section, {}).update(changes)
+        client.configuration = config
+        return config[self.section]
+
+    def _write_done(self, future, changes):
+        #runs in the config queue thread, the next read fetches the server values again
+        if future.exception() != None:
+            logging.getLogger().warning('Fail to write the pump configuration, retried with the next flush: {}'.format(future.exception()))
+            self._failed.append(changes)
+            self._pushed = None
+
+    def _requeue_failed(self):
+        #the changes of failed writes are pending again, unless newer values are pending already
+        while len(self._failed) != 0:
+            for key, value in self._failed.popleft().items():
+                self._pending.setdefault(key, value)
+
+    def _server_values(self):
+        if self._pushed == None:
+            if self.pool != None:
+                self._pushed = self.pool.call('config', 'configuration', self._read_section)
+            else:
+                self._pushed = self._read_section(self.client)
+        return self._pushed
+
+    def read(self):
+        #fresh server values of the section, pending writes are pushed first
+        self.barrier()
+        self.refresh()
+        return self._server_values()
+
+    def update(self, attrs):
+        self._requeue_failed()
+        server_values = self._server_values()
+        for key, value in attrs.items():
+            if key in server_values and server_values[key] == value:
+                #back to what the server holds, nothing left to push for this key
+                self._pending.pop(key, None)
+            else:
+                #copy, the widget passes its own dicts (eg connect_status) which keep changing
+                self._pending[key] = copy.deepcopy(value)
+        if len(self._pending)>0 and not self._timer.isActive():
+            self._timer.start(self.debounce)
+
+    def get(self, key, default = None):
+        self._requeue_failed()
+        if key in self._pending:
+            return self._pending[key]
+        return self._server_values().get(key, default)
+
+    def pending(self):
+        self._requeue_failed()
+        return dict(self._pending)
+
+    def flush(self, wait = False):
+        self._timer.stop()
+        self._requeue_failed()
+        if len(self._pending)==0:
+            if wait and self._last_write != None:
+                self._last_write.result()
+            return 0
+        if self.pool != None:
+            changes = self._pending
+            server_values = self._server_values()
+            #the server holds these values once the queued write is done
+            server_values.update(copy.deepcopy(changes))
+            self._last_write = self.pool.submit('config', 'configuration', self._write_section, changes)
+            self._last_write.add_done_callback(lambda future, changes = changes: self._write_done(future, changes))
+            if wait:
+                self._last_write.result()
+        else:
+            self._pushed = copy.deepcopy(self._write_section(self.client, self._pending))
+        num_keys = len(self._pending)
+        self._pending = {}
+        self.flush_count += 1
+        return num_keys
+
+    #explicit flush point, eg at state switches or before stopping the devices
+    def barrier(self):
+        return self.flush(wait = True)
+
+    #drop the cached server view, the next read fetches the configuration again
+    def refresh(self):
+        self._pushed = None
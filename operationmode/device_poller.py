@@ -0,0 +1,221 @@
+import time
+import threading
+from collections import deque
+from PyQt5 import QtCore
+from operationmode.transport import busy_interval as transport_busy_interval
+
+class DeviceSnapshotCache(object):
+    """Latest-value cache of device states published by DevicePoller.
+
+    The poller builds a brand-new snapshot dict every cycle and swaps the reference in one
+    assignment (atomic under the GIL), so readers never need a lock and never see a half
+    written snapshot. Readers must treat the snapshot as read-only.
+    """
+    def __init__(self):
+        self._snapshot = None
+
+    def publish(self, snapshot):
+        self._snapshot = snapshot
+
+    def latest(self):
+        return self._snapshot
+
+    def ready(self):
+        return self._snapshot != None
+
+    def age(self):
+        #seconds since the latest snapshot was taken, None if nothing published yet
+        snapshot = self._snapshot
+        if snapshot == None:
+            return None
+        return time.time() - snapshot['timestamp']
+
+    def syringe(self, index):
+        return self._snapshot['syringe'][index]
+
+    def syringe_volume(self, index):
+        #volume in uL as reported by the device
+        return self._snapshot['syringe'][index]['volume']
+
+    def syringe_busy(self, index):
+        return self._snapshot['syringe'][index]['busy']
+
+    def syringe_valve(self, index):
+        return self._snapshot['syringe'][index]['valve']
+
+    def mvp(self):
+        return self._snapshot['mvp']
+
+class DevicePoller(QtCore.QObject):
+    """Read volume/busy/valve/status of all syringes and the MVP in one batch per cycle.
+
+    Move the poller to a QThread and connect QThread.started to run(). Each snapshot is
+    published to the DeviceSnapshotCache and announced with snapshot_ready, so device latency
+    on the serial bus/Tango link never blocks the GUI event loop. Between two snapshots only the
+    busy flags are read (every busy_interval ms, by default the one of the pump client); busy
+    flag edges are announced with motion_started/motion_finished. If every device offers a
+    completion event (onMotionFinished, see operationmode.transport), the busy flags are read
+    when an event comes in instead of every busy_interval.
+    """
+    snapshot_ready = QtCore.pyqtSignal(object)
+    poll_failed = QtCore.pyqtSignal(str)
+    #busy flag edges, the argument is the syringe index or 'mvp'
+    motion_started = QtCore.pyqtSignal(object)
+    motion_finished = QtCore.pyqtSignal(object)
+
+    def __init__(self, server_devices, cache, interval = 100, syringe_index = None, busy_interval = None, reconnect = None):
+        super(DevicePoller, self).__init__()
+        self.server_devices = server_devices
+        #called in the poller thread after a failed poll, eg ClientPool.reconnect of the status session
+        self.reconnect = reconnect
+        self.cache = cache
+        #polling interval in ms of the full snapshot
+        self.interval = interval
+        #polling interval in ms of the busy flags only, used for edge detection between two snapshots
+        #(None: the busy_interval of the pump client)
+        self.busy_interval = busy_interval
+        self._syringe_index = syringe_index
+        self.running = False
+        #last seen busy flag per device
+        self._busy = {}
+        #set by the device completion events, True if all the devices have one
+        self._wake = threading.Event()
+        self._events = False
+        #(device, time) of the completion events not handled yet, appended from the backend threads
+        self._finished_events = deque()
+        #time a motion_finished was emitted last, per device
+        self._finished_at = {}
+
+    @property
+    def syringe_index(self):
+        #read at every cycle, server_devices may be filled in after a (re)connect
+        if self._syringe_index != None:
+            return list(self._syringe_index)
+        return sorted(self.server_devices.get('syringe', {}))
+
+    def _read_syringe(self, index):
+        syringe = self.server_devices['syringe'][index]
+        status = syringe.status
+        return {'volume': syringe.volume,
+                'busy': syringe.busy,
+                'valve': syringe.valve,
+                'syringe_status_code': status['syringe'].statuscode,
+                'valve_status_code': status['valve'].statuscode,
+                'syringe_status': status['syringe'].__str__()}
+
+    def _read_mvp(self):
+        mvp = self.server_devices['mvp_valve']
+        status = mvp.status
+        return {'busy': mvp.busy,
+                'valve_status_code': status['valve'].statuscode,
+                'valve_status': status['valve'].__str__()}
+
+    def _detect_edges(self, busy):
+        #busy: {device: bool}, return the devices that went busy -> not busy and not busy -> busy
+        finished, started = [], []
+        for device, value in busy.items():
+            before = self._busy.get(device, None)
+            if before == True and not value:
+                finished.append(device)
+            elif before == False and value:
+                started.append(device)
+        self._busy.update(busy)
+        return finished, started
+
+    def _reported_finished(self, busy, finished):
+        #motions the devices reported finished (completion events) without a busy -> ready edge seen,
+        #eg too short to be seen busy between two polls
+        devices = []
+        while len(self._finished_events) != 0:
+            device, t = self._finished_events.popleft()
+            if device in busy and not busy[device] and device not in finished + devices and t > self._finished_at.get(device, 0):
+                devices.append(device)
+        return devices
+
+    def _emit_edges(self, finished, started):
+        for device in started:
+            self.motion_started.emit(device)
+        for device in finished:
+            self._finished_at[device] = time.time()
+            self.motion_finished.emit(device)
+
+    def poll_once(self):
+        snapshot = {'timestamp': time.time(),
+                    'syringe': {index: self._read_syringe(index) for index in self.syringe_index},
+                    'mvp': self._read_mvp()}
+        self.cache.publish(snapshot)
+        self.snapshot_ready.emit(snapshot)
+        busy = {index: each['busy'] for index, each in snapshot['syringe'].items()}
+        busy['mvp'] = snapshot['mvp']['busy']
+        finished, started = self._detect_edges(busy)
+        self._emit_edges(finished + self._reported_finished(busy, finished), started)
+        return snapshot
+
+    def poll_busy(self):
+        #cheap poll of the busy flags only; on an edge a full snapshot is taken first,
+        #so the cache is already up to date when the listeners react to the edge
+        busy = {index: self.server_devices['syringe'][index].busy for index in self.syringe_index}
+        busy['mvp'] = self.server_devices['mvp_valve'].busy
+        finished, started = self._detect_edges(busy)
+        finished = finished + self._reported_finished(busy, finished)
+        if len(finished)+len(started)!=0:
+            self.poll_once()
+            self._emit_edges(finished, started)
+            return True
+        return False
+
+    def _on_motion_finished(self, device):
+        #completion event of a device, called from the backend
+        self._finished_events.append((device, time.time()))
+        self._wake.set()
+
+    def _subscribe(self):
+        #wake up on the completion events of the devices where the backend offers them
+        devices = {index: self.server_devices['syringe'][index] for index in self.syringe_index}
+        devices['mvp'] = self.server_devices['mvp_valve']
+        events = True
+        for key, device in devices.items():
+            try:
+                events = device.onMotionFinished(lambda key = key: self._on_motion_finished(key)) == True and events
+            except AttributeError:
+                events = False
+        self._events = events
+
+    def run(self):
+        self.running = True
+        if self.busy_interval == None:
+            self.busy_interval = transport_busy_interval(self.server_devices.get('client', None))
+        try:
+            self._subscribe()
+        except Exception as e:
+            self.poll_failed.emit(str(e))
+        last_full = 0
+        while self.running:
+            t0 = time.time()
+            try:
+                if (t0 - last_full)*1000 >= self.interval:
+                    self.poll_once()
+                    last_full = t0
+                elif self.poll_busy():
+                    last_full = t0
+            except Exception as e:
+                self.poll_failed.emit(str(e))
+                if self.reconnect != None:
+                    try:
+                        self.reconnect()
+                        #the devices of the new session
+                        self._subscribe()
+                    except Exception as e:
+                        self.poll_failed.emit('reconnect failed: {}'.format(e))
+            #keep a steady cadence independent of how long the device reads took; with completion events
+            #only the full snapshots are timed, an event wakes the poller up at once
+            if self._events:
+                timeout = self.interval/1000 - (time.time() - last_full)
+            else:
+                timeout = self.busy_interval/1000 - (time.time() - t0)
+            self._wake.wait(max(0, timeout))
+            self._wake.clear()
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
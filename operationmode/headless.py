@@ -0,0 +1,143 @@
+from operationmode.operations import advancedRefillingOperationMode, simpleRefillingOperationMode, cleanOperationMode, fillCellOperationMode, initOperationMode, set_error_pop_up
+from operationmode.simulator import SyringeSimulator
+from operationmode.virtual_clock import VirtualClock
+from operationmode.rigs import RigRegistry
+from syringe_widget import syringe_state
+
+class HeadlessSyringeState(syringe_state):
+    #pump diagram state without a widget, stands in for widget_psd in headless runs
+    def __init__(self, pump_settings):
+        self.init_state()
+        self.pump_settings = pump_settings
+        self.set_resevoir_volumes()
+
+class HeadlessRunner(object):
+    """Build the operation modes in demo mode on a VirtualClock, no Qt event loop needed.
+
+    All mode timers are VirtualTimers, the motions go through the vectorized SyringeSimulator
+    and the clock fast-forwards the motion timer from one event to the next, so a multi-hour
+    exchange protocol simulates in seconds. Units follow the GUI: volumes in mL, speeds in mL/s.
+    The fast-forward hook follows the last built mode.
+
+    Runners sharing a clock run their rigs in parallel (for_rigs). The clock has one fast-forward
+    hook, so it is only used with a single rig.
+
+    Example:
+        runner = HeadlessRunner(pump_settings)
+        mode = runner.advanced_exchange(total_exchange_amount = 500, exchange_speed = 0.1, refill_speed = 0.5)
+        mode.start_premotion_timer()
+        runner.run()
+    """
+    def __init__(self, pump_settings, timeout = 100, fast_forward = True, rig = None, clock = None):
+        set_error_pop_up(False)
+        self.pump_settings = pump_settings
+        #timer interval in ms, the GUI uses 100
+        self.timeout = timeout
+        self.fast_forward = fast_forward
+        self.clock = clock or VirtualClock()
+        self.state = HeadlessSyringeState(pump_settings)
+        self.simulator = SyringeSimulator(num_rigs = 1, num_syringes = 4, syringe_size = self.state.syringe_size)
+        #syringe indices and pair labels, the legacy four syringe rig by default
+        self.rig = rig or RigRegistry.legacy().default
+        self.server_devices = self.rig.demo_devices(self.simulator)
+        self.state.syringe_indices = self.rig.syringe_indices
+        self.under_exchange = False
+        #last exchanged volume reported by the mode (uL)
+        self.volume_record = 0
+        self.modes = []
+
+    @classmethod
+    def for_rigs(cls, pump_settings, registry, timeout = 100):
+        #one runner per rig of registry, all on one VirtualClock: {rig name: runner}
+        clock = VirtualClock()
+        return dict([(rig.name, cls(pump_settings, timeout, len(registry)==1, rig, clock)) for rig in registry])
+
+    def timer(self):
+        return self.clock.timer()
+
+    def _build(self, mode_class, settings, premotion_timer = True):
+        timer_premotion = self.timer() if premotion_timer else None
+        mode = mode_class(self.server_devices, self.state, None, timer_premotion, self.timer(), self.timeout, self.pump_settings, settings = settings, demo = True)
+        mode.now = self.clock.time
+        mode.schedule = self.clock.call_later
+        if self.fast_forward:
+            self.clock.set_fast_forward(mode.fast_forward_horizon, mode.fast_forward)
+        self.modes.append(mode)
+        return mode
+
+    def _record_volume(self, volume):
+        self.volume_record = volume
+
+    def _exchange_finished(self):
+        self.under_exchange = False
+
+    def advanced_exchange(self, total_exchange_amount, exchange_speed, refill_speed, pre_pressure_volume = 0.02, pre_pressure_speed = 0.02, leftover_volume = 0, extra_amount = 0, extra_amount_speed = 0):
+        settings = {'premotion_speed_handle':lambda:refill_speed,
+                    'total_exchange_amount_handle':lambda:total_exchange_amount,
+                    'exchange_speed_handle':lambda:exchange_speed,
+                    'pre_pressure_volume_handle':lambda:pre_pressure_volume,
+                    'pre_pressure_speed_handle':lambda:pre_pressure_speed,
+                    'leftover_volume_handle':lambda:leftover_volume,
+                    'refill_speed_handle':lambda:refill_speed,
+                    'time_record_handle':lambda:None,
+                    'volume_record_handle':self._record_volume,
+                    'extra_amount_timer':self.timer(),
+                    'extra_amount_handle':lambda:extra_amount,
+                    'extra_amount_speed_handle':lambda:extra_amount_speed,
+                    'timer_prepressure_S1':self.timer(),
+                    'timer_prepressure_S2':self.timer(),
+                    'timer_droplet_adjustment_S1':self.timer(),
+                    'timer_droplet_adjustment_S2':self.timer(),
+                    'timer_droplet_adjustment_S3':self.timer(),
+                    'timer_droplet_adjustment_S4':self.timer(),
+                    'set_under_exchange_to_false':self._exchange_finished}
+        self.under_exchange = True
+        return self._build(advancedRefillingOperationMode, settings)
+
+    def simple_exchange(self, pull_syringe, push_syringe, total_exchange_amount, exchange_speed, refill_speed, pre_pressure_volume = 0.02, pre_pressure_speed = 0.02, leftover_volume = 0):
+        settings = {'pull_syringe_handle':lambda:pull_syringe,
+                    'push_syringe_handle':lambda:push_syringe,
+                    'total_exchange_amount_handle':lambda:total_exchange_amount,
+                    'pre_pressure_volume_handle':lambda:pre_pressure_volume,
+                    'pre_pressure_speed_handle':lambda:pre_pressure_speed,
+                    'leftover_volume_handle':lambda:leftover_volume,
+                    'refill_speed_handle':lambda:refill_speed,
+                    'volume_record_handle':self._record_volume,
+                    'timer_prepressure':self.timer(),
+                    'set_under_exchange_to_false':self._exchange_finished,
+                    'exchange_speed_handle':lambda:exchange_speed}
+        self.under_exchange = True
+        return self._build(simpleRefillingOperationMode, settings)
+
+    def clean(self, syringe, refill_speed, refill_times, holding_time = 0, inlet_port = 'left', outlet_port = 'up'):
+        settings = {'syringe_handle':lambda:syringe,
+                    'refill_speed_handle':lambda:refill_speed,
+                    'refill_times_handle':lambda:refill_times,
+                    'holding_time_handle':lambda:holding_time,
+                    'inlet_port_handle':lambda:inlet_port,
+                    'outlet_port_handle':lambda:outlet_port}
+        return self._build(cleanOperationMode, settings, premotion_timer = False)
+
+    def fill_cell(self, push_syringe, refill_speed, refill_times, waste_disposal_vol, waste_disposal_speed, cell_dispense_vol):
+        settings = {'push_syringe_handle':lambda:push_syringe,
+                    'refill_speed_handle':lambda:refill_speed,
+                    'refill_times_handle':lambda:refill_times,
+                    'waste_disposal_vol_handle':lambda:waste_disposal_vol,
+                    'waste_disposal_speed_handle':lambda:waste_disposal_speed,
+                    'cell_dispense_vol_handle':lambda:cell_dispense_vol}
+        return self._build(fillCellOperationMode, settings, premotion_timer = False)
+
+    def init(self, pull_syringe, push_syringe, volume, speed):
+        settings = {'pull_syringe_handle':lambda:pull_syringe,
+                    'push_syringe_handle':lambda:push_syringe,
+                    'vol_handle':lambda:volume,
+                    'speed_handle':lambda:speed}
+        return self._build(initOperationMode, settings, premotion_timer = False)
+
+    def run(self, duration = None, until = None, max_events = None):
+        #run until no timer is active (or the limits are hit), duration in ms of simulated time
+        return self.clock.run(duration = duration, until = until, max_events = max_events)
+
+    def elapsed(self):
+        #simulated time in seconds
+        return self.clock.time()
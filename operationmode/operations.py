@@ -4,19 +4,24 @@ import logging
 import time
 import threading
 from PyQt5.QtWidgets import QMessageBox
-
-
-#valve postion mapping between GUI and server side, key is GUI and value is based on server
-VALVE_POSITION_T = {'left':1,'up':2, 'right':3}
-
-#syringe pump id mapping between GUI and server side, key is from GUI and value is based on server
-DEVICE_ID_MAP = {1:1, 2:2, 3:3, 4:4}
+from operationmode.simulator import CELL_INLET
+from operationmode.command_batch import CommandBatch, run_in_background
+from operationmode.rigs import Rig, LEGACY_RIG, pair_label
 
 
 0
 
+#show errors in a message box, switched off for headless runs (errors are logged instead)
+ERROR_POP_UP = True
+
+def set_error_pop_up(enabled):
+    global ERROR_POP_UP
+    ERROR_POP_UP = enabled
 
 def error_pop_up(msg_text = 'error', window_title = ['Error','Information','Warning'][0]):
+    if not ERROR_POP_UP:
+        logging.getLogger(__name__).error('{}: {}'.format(window_title, msg_text))
+        return
     msg = QMessageBox()
     if window_title == 'Error':
         msg.setIcon(QMessageBox.Critical)
@@ -66,8 +71,26 @@ class baseOperationMode(object):
         self.settings = settings
         self.exchange_amount_already = 0
         self.total_exchange_amount = 0
+        #latest-value cache filled by the DevicePoller thread, None in demo mode
+        self.device_cache = psd_server.get('device_cache', None)
+        #time at which a syringe was first seen in moving status, used to skip snapshots taken before the motion command
+        self._moving_since = {}
+        #write-behind cache for client.configuration, None in demo mode
+        self.config_cache = psd_server.get('config_cache', None)
+        #vectorized demo engine, when set it drives the demo motions instead of single_syringe_motion_demo
+        self.simulator = psd_server.get('simulator', None)
+        #syringes moved by the last simulator step, None if the last motion did not go through the simulator
+        self._simulated_index = None
+        #time source, replaced by VirtualClock.time in headless runs
+        self.now = time.time
         #a handle supposed to update the valve position in the main gui widget
         self.valve_handle = None
+        #motion timer slot of the mode, run right away on a device motion_finished event
+        self.motion_tick = None
+        #scheduler of delayed (staged) steps, replaced by VirtualClock.call_later in headless runs
+        self.schedule = QTimer.singleShot
+        #bumped by cancel_pending, steps scheduled before are dropped
+        self._generation = 0
         #set redirection of error message to embeted text browser widget
         # logTextBox = QTextEditLogger(error_widget)
         # You can format what is printed to text box
@@ -96,14 +119,100 @@ class baseOperationMode(object):
         self.mvp_detachment_status = False
 
     def syn_server_and_gui_init(self,attrs):
+        if self.config_cache!=None:
+            #coalesced and diffed, pushed after a short debounce or at the next barrier
+            self.config_cache.update(attrs)
+            return
         config = self.server_devices['client'].configuration
+        section = config.setdefault(self.rig.config_section, {})
         for key, value in attrs.items():
-            config['psd_widget'][key] = value
+            section[key] = value
         self.server_devices['client'].configuration = config
+
+    @property
+    def rig(self):
+        #syringe index -> device mapping and pair labels of the devices, the legacy rig if server_devices has none
+        if 'rig' not in self.server_devices:
+            self.server_devices['rig'] = Rig('rig1', **LEGACY_RIG)
+        return self.server_devices['rig']
+
+    @property
+    def syringe_indices(self):
+        return self.rig.syringe_indices
+
+    #read a psd_widget entry of the client configuration, including writes not yet flushed
+    def _config_value(self, key):
+        if self.config_cache!=None:
+            return self.config_cache.get(key)
+        return self.server_devices['client'].configuration.get(self.rig.config_section, {}).get(key, None)
+
+    #push all pending configuration changes now (state switches)
+    def _config_barrier(self):
+        if self.config_cache!=None:
+            self.config_cache.barrier()
         
+    #read device states from the poller cache if there is one, otherwise from the device directly
+    def _cache_ready(self):
+        return self.device_cache!=None and self.device_cache.ready()
+
+    def _device_syringe_volume(self, index):
+        if self._cache_ready():
+            return self.device_cache.syringe_volume(index)
+        return self.server_devices['syringe'][index].volume
+
+    def _device_syringe_busy(self, index):
+        if self._cache_ready():
+            #a snapshot older than the moving status may predate the motion command, so still count it as busy
+            #(set by set_status, dropped when the syringe is set ready)
+            since = self._moving_since.get(index, None)
+            if since != None and self.settings.get('syringe{}_status'.format(index))=='moving' and self.device_cache.latest()['timestamp'] <= since:
+                return True
+            return self.device_cache.syringe_busy(index)
+        return self.server_devices['syringe'][index].busy
+
+    def _device_mvp_busy(self):
+        if self._cache_ready():
+            return self.device_cache.mvp()['busy']
+        return self.server_devices['mvp_valve'].busy
+
+    def call_later(self, msec, callback):
+        #run callback once after msec without blocking the GUI thread (unless cancel_pending is called before)
+        generation = self._generation
+        def _step():
+            if generation == self._generation:
+                callback()
+        self.schedule(msec, _step)
+
+    def cancel_pending(self):
+        #drop all the steps scheduled with call_later, eg when all motions are stopped
+        self._generation += 1
+
+    def notify_event(self, event):
+        #report an exchange event (switch_over, prepressure_done, exchange_done) to settings['event_handle'] if given
+        handle = self.settings.get('event_handle', None)
+        if handle != None:
+            handle(event, {'mode':self.__class__.__name__,
+                           'exchange_amount':self.exchange_amount_already,
+                           'total_exchange_amount':self.total_exchange_amount})
+
+    def on_device_motion_finished(self, device):
+        #slot for DevicePoller.motion_finished (busy -> not busy edge), called in the GUI thread
+        #the finished syringe is marked ready and the motion state machine runs right away instead of
+        #waiting for the next timer tick
+        if self.demo or self.motion_tick == None or not self.timer_motion.isActive():
+            return
+        if device in self.server_devices['syringe']:
+            self.set_status(device, 'ready')
+            if self.psd_widget.connect_status[device] != 'ready':
+                self.psd_widget.connect_status[device] = 'ready'
+        self.motion_tick()
+        #the regular tick restarts from here
+        if self.timer_motion.isActive():
+            self.timer_motion.start(self.timeout)
+
     def update_syringe_volume_from_device(self):
-        for index in [1,2,3,4]:
-            device_reading = self.server_devices['syringe'][index].volume/1000
+        for index in self.syringe_indices:
+            device_reading = self._device_syringe_volume(index)/1000
             setattr(self.psd_widget, 'volume_syringe_{}'.format(index), device_reading)
         self.psd_widget.update()
 
@@ -111,7 +220,7 @@ class baseOperationMode(object):
     #update the syringe volumes from server to GUI
     #syringe are indexed from left to righ as 1, 2, 3 and 4, respectively in the GUI
     def syn_server_to_gui(self):
-        for index in [1,2,3,4]:
+        for index in self.syringe_indices:
             try:
                 #impliment this func in the PumpInterface to get the volume (in ml) of solution in syringe with id of index
                 vol_temp = self.psd_server.getSyringeVol(deviceId = index)
@@ -143,15 +252,100 @@ class baseOperationMode(object):
     def get_status(self,index):
         print(self.settings['syringe{}_status'.format(index)])
 
-    def set_status(self,index, status):
+    def set_status(self,index, status, new_motion = True):
+        #a syringe set moving by a new motion command: device snapshots taken before now may predate the command
+        #(new_motion = False when the status only follows a device reading, the motion keeps its start time)
+        if status == 'moving':
+            if new_motion or index not in self._moving_since:
+                self._moving_since[index] = time.time()
+        else:
+            self._moving_since.pop(index, None)
         self.settings['syringe{}_status'.format(index)] = status
 
     def single_syringe_motion(self,index, speed_tag = 'speed', continual_exchange = True, use_limits_for_exchange = True, demo = True):
-        if demo:
+        if demo and self.simulator != None:
+            self.multi_syringe_motion_simulator([index], [speed_tag], continual_exchange, use_limits_for_exchange)
+        elif demo:
             self.single_syringe_motion_demo(index, speed_tag, continual_exchange, use_limits_for_exchange)
         else:
             self.single_syringe_motion_server(index, continual_exchange, use_limits_for_exchange)
 
+    def multi_syringe_motion(self, index_list, speed_tags = 'speed', continual_exchange = True, use_limits_for_exchange = True, demo = True):
+        #move several syringes in one go, speed_tags is either one tag for all or one tag per syringe
+        if type(speed_tags) != list:
+            speed_tags = [speed_tags]*len(index_list)
+        if demo and self.simulator != None:
+            self.multi_syringe_motion_simulator(index_list, speed_tags, continual_exchange, use_limits_for_exchange)
+        else:
+            for index, speed_tag in zip(index_list, speed_tags):
+                self.single_syringe_motion(index, speed_tag, continual_exchange, use_limits_for_exchange, demo)
+
+    def multi_syringe_motion_simulator(self, index_list, speed_tags, continual_exchange = True, use_limits_for_exchange = True):
+        #demo motion of all syringes in index_list through one vectorized simulator step (rig 0)
+        simulator = self.simulator
+        simulator.load_from_widget(self.psd_widget)
+        simulator.stop()
+        for index, speed_tag in zip(index_list, speed_tags):
+            speed = self.settings.get(speed_tag)
+            if type(speed)!=float:
+                speed = self._device_speed_to_gui_speed(speed())
+            direction_sign = [-1,1][int(getattr(self.psd_widget,'filling_status_syringe_{}'.format(index)))]
+            connection = self.pump_settings['S{}_{}'.format(index, self.psd_widget.connect_valve_port[int(index)])]
+            if continual_exchange and use_limits_for_exchange:
+                vmin, vmax = 0, self.psd_widget.syringe_size
+            else:
+                vmin, vmax = self.settings['syringe_{}_min'.format(index)], self.settings['syringe_{}_max'.format(index)]
+            simulator.set_motion(0, index-1, speed, direction_sign, connection, vmin, vmax)
+        if simulator.invalid_connections()[0].any():
+            error_pop_up('Pump setting Error:YOU ARE ONLY allowed to dispense solution to WASTE or CELL_INLET and withdraw solution from RESEVOIR, CELL_OUTLET or NOT_USED')
+        self._simulated_index = list(index_list)
+        self._apply_simulator_step(index_list)
+
+    def _apply_simulator_step(self, index_list, ticks = 1):
+        simulator = self.simulator
+        exchanged = simulator.step(ticks)
+        self.exchange_amount_already = self.exchange_amount_already + float(exchanged[0])
+        simulator.store_to_widget(self.psd_widget, index_list = index_list)
+        for index in index_list:
+            if self.pump_settings['S{}_{}'.format(index, self.psd_widget.connect_valve_port[int(index)])] == 'resevoir':
+                self.psd_widget.resevoir_volumn = getattr(self.psd_widget, 'resevoir_volumn_S{}'.format(index))
+                self.psd_widget.label_resevoir = self.pump_settings['S{}_solution'.format(index)]
+            status = ['moving', 'ready'][int(not simulator.active[0, index-1])]
+            self.set_status(index, status)
+            if self.psd_widget.connect_status[index] != status:
+                self.psd_widget.connect_status[index] = status
+        #overshooting in cell, resevior or waste, stop the timers like in single_syringe_motion_demo
+        if simulator.container_limited[0].any():
+            if self.timer_motion.isActive():
+                self.timer_motion.stop()
+            if self.timer_premotion!= None:
+                if self.timer_premotion.isActive():
+                    self.timer_premotion.stop()
+        self.psd_widget.update()
+
+    def fast_forward_horizon(self):
+        #number of motion timeouts that can be skipped before the next event (a syringe reaching its limit
+        #or the total exchange amount being reached), used by the VirtualClock in headless runs
+        if self.simulator == None or self._simulated_index == None:
+            return 0
+        next_event = self.simulator.ticks_to_next_event()
+        if next_event == None:
+            return 0
+        horizon = next_event - 1
+        if self.total_exchange_amount > self.exchange_amount_already:
+            simulator = self.simulator
+            to_cell = simulator.active[0] & (simulator.connection[0] == CELL_INLET) & (simulator.direction[0] < 0)
+            rate = simulator.speed[0][to_cell].sum()
+            if rate > 0:
+                horizon = min(horizon, int((self.total_exchange_amount - self.exchange_amount_already)/rate) - 1)
+        return max(horizon, 0)
+
+    def fast_forward(self, ticks):
+        #integrate ticks motion timeouts of the last simulated motion in one go
+        if self._simulated_index == None:
+            return
+        self._apply_simulator_step(self._simulated_index, ticks)
+
     def stop_all_devices(self):
         self.server_devices['client'].stop()
 
@@ -169,7 +363,7 @@ class baseOperationMode(object):
             return
         
         value_before_motion = getattr(self.psd_widget, type_name_in_widget)
-        value_after_motion = self.server_devices['syringe'][index].volume/1000 # get volume from server, convert to value in ml
+        value_after_motion = self._device_syringe_volume(index)/1000 # get volume from server, convert to value in ml
         #update the volume in the syringe widget
         setattr(self.psd_widget, type_name_in_widget, value_after_motion)
 
@@ -220,12 +414,12 @@ class baseOperationMode(object):
             elif connection == 'not_used':#if not used, just sucking from air, nothing need to be updated
                 pass
         setattr(self.psd_widget, type_name_in_widget, value_after_motion)
-        if not self.server_devices['syringe'][index].busy:
+        if not self._device_syringe_busy(index):
             self.set_status(index,'ready')
             if self.psd_widget.connect_status[index] != 'ready':
                 self.psd_widget.connect_status[index] = 'ready'
         else:
-            self.set_status(index,'moving')
+            self.set_status(index,'moving', new_motion = False)
             if self.psd_widget.connect_status[index] != 'moving':
                 self.psd_widget.connect_status[index] = 'moving'
 
@@ -395,18 +589,28 @@ class baseOperationMode(object):
     def simulated_data_receiver(self):
         return True
 
-    def turn_valve_from_server(self, index, position):
+    def _move_valve_device(self, index, position):
+        #blocking, safe to run in a CommandBatch worker thread
         self.server_devices['T_valve'][index].valve = position
         self.server_devices['T_valve'][index].join()
+
+    def turn_valve_from_server(self, index, position, batch = None):
+        #with a batch, the move is only queued; it runs (in parallel with the other moves) in batch.run()
+        if batch != None:
+            batch.add(self._move_valve_device, index, position)
+            if self.valve_handle!=None:
+                batch.on_done(lambda:self.valve_handle(index, position))
+            return
+        self._move_valve_device(index, position)
         if self.valve_handle!=None:
             self.valve_handle(index, position)
 
-    def turn_valve(self, index, to_position = None):
+    def turn_valve(self, index, to_position = None, batch = None):
         if to_position in ['up','left','right']:
             if index in self.psd_widget.connect_valve_port:
                 self.psd_widget.connect_valve_port[index] = to_position
                 if not self.demo:
-                    self.turn_valve_from_server(index, to_position)
+                    self.turn_valve_from_server(index, to_position, batch)
             else:
                 error_pop_up('The syringe index {} is not registered.'.format(index))
         elif to_position == None:#switch the vale to the other possible position
@@ -420,7 +624,7 @@ class baseOperationMode(object):
                         #note 0-->-1, 1-->0, in both cases the index-1 will be refering to the other one in a two member index list
                         self.psd_widget.connect_valve_port[index] = possible_valve_positions[possible_valve_positions.index(current_valve_position)-1]
                         if not self.demo:
-                            self.turn_valve_from_server(index, possible_valve_positions[possible_valve_positions.index(current_valve_position)-1])
+                            self.turn_valve_from_server(index, possible_valve_positions[possible_valve_positions.index(current_valve_position)-1], batch)
                     else:
                         error_pop_up('The syringe index {} is not registered.'.format(index))
             else:
@@ -440,6 +644,7 @@ class simpleRefillingOperationMode(baseOperationMode):
         self.timer_prepressure.timeout.connect(self.update_widget_prepressure)
         self.timer_motion.timeout.connect(self.exchange_motion)
         self.timer_premotion.timeout.connect(self.premotion)
+        self.motion_tick = self.exchange_motion
         self.check_settings()
         if 'valve_handle' in self.settings:
             self.valve_handle = self.settings['valve_handle']
@@ -478,8 +683,8 @@ class simpleRefillingOperationMode(baseOperationMode):
         self.psd_widget.actived_right_syringe_simple_exchange_mode = int(pull_syringe_index)
         exec('self.psd_widget.filling_status_syringe_{} = True'.format(push_syringe_index)) # refill the pushing syringe
         exec('self.psd_widget.filling_status_syringe_{} = False'.format(pull_syringe_index)) # empty the pulling syringe
-        self.settings['syringe{}_status'.format(push_syringe_index)] ='moving'
-        self.settings['syringe{}_status'.format(pull_syringe_index)] ='moving'
+        self.set_status(push_syringe_index,'moving')
+        self.set_status(pull_syringe_index,'moving')
         self.turn_valve(pull_syringe_index, 'up')
         self.turn_valve(push_syringe_index, 'left')
         if not self.demo:
@@ -505,8 +710,7 @@ class simpleRefillingOperationMode(baseOperationMode):
                 self.valve_before_prepressure = self.pre_pressure(syringe_index = push_syringe_index, volume = self.settings['pre_pressure_volume_handle']()*1000, speed = self.settings['pre_pressure_speed_handle']()*1000)
                 self.timer_prepressure.start(self.timeout)
         else:
-            for i in [pull_syringe_index, push_syringe_index]:
-                self.single_syringe_motion(i, speed_tag = None, continual_exchange = False, demo = self.demo)
+            self.multi_syringe_motion([pull_syringe_index, push_syringe_index], speed_tags = None, continual_exchange = False, demo = self.demo)
 
     def check_synchronization_premotion(self):
         for i in [int(self.settings['pull_syringe_handle']()),int(self.settings['push_syringe_handle']())]:
@@ -534,8 +738,9 @@ class simpleRefillingOperationMode(baseOperationMode):
         # if not self.server_devices["client"].getSyringe(syringe_no).busy:#if the device stop, then the prepressure is completed
         if self.psd_widget.connect_status[syringe_no]=='ready':
             self.timer_prepressure.stop()
+            self.notify_event('prepressure_done')
             # self.turn_valve(syringe_no,self.valve_before_prepressure)#turn valve back to its original pos
-            label = f"S{syringe_no}_S{pull_syringe_index}"
+            label = pair_label(syringe_no, pull_syringe_index)
             self.turn_valve(syringe_no,'right')#turn valve back to its original pos
             self.turn_valve(pull_syringe_index,'left')#turn valve back to its original pos
             setattr(self.psd_widget, 'filling_status_syringe_{}'.format(syringe_no), False)#update the filling status to False (means connect to cell)
@@ -552,8 +757,8 @@ class simpleRefillingOperationMode(baseOperationMode):
                 #whichever is smaller will be the amount of electrolyte to be exchanged
                 exchange_amount_final = min([to_exchange_amount, max_exchange_amount_from_device_limit])
                 self.server_devices['exchange_pair'][label].exchange(volume = exchange_amount_final,rate = float(self.settings['exchange_speed_handle']())*1000)
-                time.sleep(0.1)
-                self.timer_motion.start(self.timeout)
+                #give the devices 100 ms to start moving before the first motion tick
+                self.call_later(100, lambda:self.timer_motion.start(self.timeout))
 
     def init_motion(self):
         self.total_exchange_amount = float(self.settings['total_exchange_amount_handle']())
@@ -562,8 +767,8 @@ class simpleRefillingOperationMode(baseOperationMode):
         push_syringe_index = int(self.settings['push_syringe_handle']())
         exec('self.psd_widget.filling_status_syringe_{} = False'.format(push_syringe_index)) 
         exec('self.psd_widget.filling_status_syringe_{} = True'.format(pull_syringe_index)) 
-        self.settings['syringe{}_status'.format(push_syringe_index)] ='moving'
-        self.settings['syringe{}_status'.format(pull_syringe_index)] ='moving'
+        self.set_status(push_syringe_index,'moving')
+        self.set_status(pull_syringe_index,'moving')
         self.turn_valve(pull_syringe_index, 'left')
         self.turn_valve(push_syringe_index, 'right')
         #set mvp channel
@@ -579,18 +784,14 @@ class simpleRefillingOperationMode(baseOperationMode):
             #launch electrolyte exchange
             # at the beginning, S1 and S4 are connected to resevoir and waste, respectively
             # while, S2 and S3 are connected to cell for exchangeing
-            if f'S{push_syringe_index}_S{pull_syringe_index}' not in ['S1_S3','S2_S4']:
-                # error_pop_up(f'Syringe pair S{push_syringe_index}_S{pull_syringe_index} not implemented! Please use combo of S1_S3 or S2_S4!')
-                error_pop_up(f'Syringe pair S{push_syringe_index}_S{pull_syringe_index} not implemented! Please use combo of S1_S3 or S2_S4!') 
+            label = pair_label(push_syringe_index, pull_syringe_index)
+            if label not in self.server_devices['exchange_pair']:
+                error_pop_up(f'Syringe pair S{push_syringe_index}_S{pull_syringe_index} not implemented! Please use one of {", ".join(self.server_devices["exchange_pair"])}!')
                 return False
             else:
-                label = f"S{push_syringe_index}_S{pull_syringe_index}"
-                if label == 'S1_S3':
-                    if self.server_devices['exchange_pair'][label].pushSyr.deviceId!=4:
-                        self.server_devices['exchange_pair'][label].swap()
-                if label == 'S2_S4':
-                    if self.server_devices['exchange_pair'][label].pushSyr.deviceId!=2:
-                        self.server_devices['exchange_pair'][label].swap() 
+                #the pushing syringe of the device pair must be the one pushing in the GUI
+                if self.server_devices['exchange_pair'][label].pushSyr.deviceId!=self.rig.device_id(push_syringe_index):
+                    self.server_devices['exchange_pair'][label].swap()
                 to_exchange_amount = (self.total_exchange_amount - self.exchange_amount_already)*1000 #from mL to uL 
                 max_exchange_amount_from_device_limit = self.server_devices['exchange_pair'][label].exchangeableVolume-float(self.settings['leftover_volume_handle']())*1000
                 #whichever is smaller will be the amount of electrolyte to be exchanged
@@ -610,6 +811,7 @@ class simpleRefillingOperationMode(baseOperationMode):
                 self.server_devices['client'].stop()
                 self.timer_motion.stop()
                 self.settings['set_under_exchange_to_false']()
+                self.notify_event('exchange_done')
                 return
             if self.onetime:
                 self.server_devices['client'].stop()
@@ -626,16 +828,14 @@ class simpleRefillingOperationMode(baseOperationMode):
                 speed_tag = 'exchange_speed'
             else:
                 speed_tag = 'refill_speed'
-            for i in [int(self.settings['pull_syringe_handle']()),int(self.settings['push_syringe_handle']())]:
-                self.single_syringe_motion(i, speed_tag = speed_tag, continual_exchange = True, demo = self.demo)
+            self.multi_syringe_motion([int(self.settings['pull_syringe_handle']()),int(self.settings['push_syringe_handle']())], speed_tags = speed_tag, continual_exchange = True, demo = self.demo)
         else:
             exchange_tag = self.check_refill_or_exchange()
             if exchange_tag:
                 speed_tag = 'exchange_speed'
             else:
                 speed_tag = 'refill_speed'
-            for i in [int(self.settings['pull_syringe_handle']()),int(self.settings['push_syringe_handle']())]:
-                self.single_syringe_motion(i, speed_tag = speed_tag, continual_exchange = True, demo = self.demo)
+            self.multi_syringe_motion([int(self.settings['pull_syringe_handle']()),int(self.settings['push_syringe_handle']())], speed_tags = speed_tag, continual_exchange = True, demo = self.demo)
 
     def check_synchronization(self):
         gui_ready = False
@@ -682,13 +882,13 @@ class simpleRefillingOperationMode(baseOperationMode):
         #ensure the valve info is appended
         self.append_valve_info(pull_syringe_index, pushing_syringe = False)
         self.append_valve_info(push_syringe_index, pushing_syringe = True)
-        label = "S{}_S{}".format(push_syringe_index,pull_syringe_index)
-        assert label in ['S1_S3','S2_S4'], 'Error: you can only choose S1_S3 pair or S2_S4 pair'
+        label = pair_label(push_syringe_index, pull_syringe_index)
+        assert label in self.server_devices['exchange_pair'], 'Error: you can only choose one of the pairs {}'.format(', '.join(self.server_devices['exchange_pair']))
         for syringe_index in syringe_index_list:
             self.turn_valve(syringe_index)
             setattr(self.psd_widget, 'filling_status_syringe_{}'.format(syringe_index), not getattr(self.psd_widget, 'filling_status_syringe_{}'.format(syringe_index)))
         if not self.demo:
-            self.server_devices['exchange_pair'][f'S{push_syringe_index}_S{pull_syringe_index}'].swap()
+            self.server_devices['exchange_pair'][label].swap()
             self.set_status_to_moving()
             if self.check_refill_or_exchange():
                 to_exchange_amount = (self.total_exchange_amount - self.exchange_amount_already)*1000 #from mL to uL 
@@ -699,15 +899,16 @@ class simpleRefillingOperationMode(baseOperationMode):
             else:
                 self.server_devices['exchange_pair'][label].pushSyr.drain(rate = float(self.settings['refill_speed_handle']())*1000)
                 self.server_devices['exchange_pair'][label].pullSyr.fill(rate = float(self.settings['refill_speed_handle']())*1000)
+        self.notify_event('switch_over')
 
     def set_status_to_moving(self):
         for i in [int(self.settings['pull_syringe_handle']()),int(self.settings['push_syringe_handle']())]:
-            self.settings['syringe{}_status'.format(i)] = 'moving'
+            self.set_status(i,'moving')
             self.psd_widget.connect_status[i] = 'moving'
 
     def set_status_to_ready(self):
         for i in [int(self.settings['pull_syringe_handle']()),int(self.settings['push_syringe_handle']())]:
-            self.settings['syringe{}_status'.format(i)] = 'ready'
+            self.set_status(i,'ready')
             self.psd_widget.connect_status[i] = 'ready'
 
 class advancedRefillingOperationMode(baseOperationMode):
@@ -719,6 +920,7 @@ class advancedRefillingOperationMode(baseOperationMode):
         self.onetime = False
         self.timer_premotion.timeout.connect(self.premotion)
         self.timer_motion.timeout.connect(self.start_motion)
+        self.motion_tick = self.start_motion
         #timer to do prepressure for syringe 1, dispense air column
         self.timer_prepressure_S1 = self.settings['timer_prepressure_S1']
         self.timer_prepressure_S1.timeout.connect(lambda:self.update_widget_prepressure(1))
@@ -754,10 +956,7 @@ class advancedRefillingOperationMode(baseOperationMode):
     def syn_server_and_gui_init(self,attrs):
         if self.demo:
             return
-        config = self.server_devices['client'].configuration
-        for key, value in attrs.items():
-            config['psd_widget'][key] = value
-        self.server_devices['client'].configuration = config
+        super().syn_server_and_gui_init(attrs)
 
     def append_valve_info(self):
         self.settings['possible_connection_valves_syringe_1'] = ['left', 'right']
@@ -772,6 +971,9 @@ class advancedRefillingOperationMode(baseOperationMode):
                 missed.append(each)
         if len(missed)>0:
             error_pop_up('Missing the following keys in this autorefilling_mode settings:{}'.format(','.join(missed)))
+        #the two pair protocol needs S1 and S2 in two different exchange pairs of the rig
+        if None in [self.rig.pair_of(1), self.rig.pair_of(2)] or self.rig.pair_of(1) == self.rig.pair_of(2):
+            error_pop_up('Rig {} has no two exchange pairs for S1 and S2 (pairs: {}), the advanced exchange mode can not run on it!'.format(self.rig.name, ', '.join(self.rig.pairs)))
 
     def init_premotion(self):
         self.psd_widget.operation_mode = 'pre_auto_refilling'
@@ -781,7 +983,7 @@ class advancedRefillingOperationMode(baseOperationMode):
         self.exchange_amount_already = 0
         self.settings['speed'] = speed
 
-        for i in [1,2,3,4]:
+        for i in self.syringe_indices:
             if i in [1,2]:#fill syringe 1 and syringe 2
                 self.turn_valve(i,'left')
                 setattr(self.psd_widget, 'filling_status_syringe_{}'.format(i), True)
@@ -797,24 +999,23 @@ class advancedRefillingOperationMode(baseOperationMode):
                 self.settings['syringe_{}_max'.format(i)] = getattr(self.psd_widget,'volume_syringe_{}'.format(i))
                 if not self.demo:
                     self.server_devices['syringe'][i].drain(rate = speed*(1000/self.timeout)*1000)
-            self.settings['syringe{}_status'.format(i)] ='moving'
+            self.set_status(i,'moving')
             self.psd_widget.connect_status[i] = 'moving'
 
     def premotion(self):
         if self.check_synchronization_premotion():
             if self.timer_premotion.isActive():
                 self.timer_premotion.stop()
-                self.exchange_t0 = time.time()
+                self.exchange_t0 = self.now()
                 self.waste_volume_t0 = self.psd_widget.waste_volumn
         else:
-            for i in range(1,5):
-                #the speed_tag doesn't matter, if the oepration not in demo mode, since the speed is set in init_premotion step
-                #this will simply update the GUI widget for the pump graphical diagram
-                self.single_syringe_motion(i, speed_tag = 'speed', continual_exchange = False, demo = self.demo)
+            #the speed_tag doesn't matter, if the oepration not in demo mode, since the speed is set in init_premotion step
+            #this will simply update the GUI widget for the pump graphical diagram
+            self.multi_syringe_motion(self.syringe_indices, speed_tags = 'speed', continual_exchange = False, demo = self.demo)
 
     def check_synchronization_premotion(self):
         #whichever is not ready, the premotion is not ready
-        for i in [1,2,3,4]:
+        for i in self.syringe_indices:
             if self.settings['syringe{}_status'.format(i)]!='ready':
                 return False
         return True
@@ -825,14 +1026,14 @@ class advancedRefillingOperationMode(baseOperationMode):
         self.timer_premotion.start(self.timeout)#slot func is premotion(), which update GUI widgets and meta data (eg. exchange volume) during exchange
 
     def set_status_to_moving(self):
-        for i in [1,2,3,4]:
-            self.settings['syringe{}_status'.format(i)] = 'moving'
+        for i in self.syringe_indices:
+            self.set_status(i,'moving')
             self.psd_widget.connect_status[i] = 'moving'
             self.psd_widget.update()
 
     def set_status_to_ready(self):
-        for i in [1,2,3,4]:
-            self.settings['syringe{}_status'.format(i)] = 'ready'
+        for i in self.syringe_indices:
+            self.set_status(i,'ready')
             self.psd_widget.connect_status[i] = 'ready'
             self.psd_widget.update()
 
@@ -854,30 +1055,30 @@ class advancedRefillingOperationMode(baseOperationMode):
         if not self.demo:
             #launch electrolyte exchange
             #set status to moving
-            for i in range(1,5):
-                self.settings['syringe{}_status'.format(i)] ='moving'
+            for i in self.syringe_indices:
+                self.set_status(i,'moving')
                 self.psd_widget.connect_status[i] = 'moving'
             if 1 in self.psd_widget.get_exchange_syringes_advance_exchange_mode():#exchange pair of S1_S3
-                if not self.server_devices['client'].configuration['psd_widget']['prepressure_S2_ready']:
+                if not self._config_value('prepressure_S2_ready'):
                     self.times_prepresssure_S2 = 0
                     self.syn_server_and_gui_init(attrs={'times_prepresssure_S2':0})
-                    self.server_devices['exchange_pair']['S2_S4'].pushSyr.drain(rate = float(self.settings['refill_speed_handle']())*1000)
-                    self.server_devices['exchange_pair']['S2_S4'].pullSyr.fill(rate = float(self.settings['refill_speed_handle']())*1000)
+                    self._pair(2).pushSyr.drain(rate = float(self.settings['refill_speed_handle']())*1000)
+                    self._pair(2).pullSyr.fill(rate = float(self.settings['refill_speed_handle']())*1000)
                 to_exchange_amount = (self.total_exchange_amount - self.exchange_amount_already)*1000 #from mL to uL 
-                max_exchange_amount_from_device_limit = self.server_devices['exchange_pair']['S1_S3'].exchangeableVolume-float(self.settings['leftover_volume_handle']())*1000
+                max_exchange_amount_from_device_limit = self._pair(1).exchangeableVolume-float(self.settings['leftover_volume_handle']())*1000
                 #whichever is smaller will be the amount of electrolyte to be exchanged
                 exchange_amount_final = min([to_exchange_amount, max_exchange_amount_from_device_limit])
-                self.server_devices['exchange_pair']['S1_S3'].exchange(volume = exchange_amount_final,rate = float(self.settings['exchange_speed_handle']())*1000)
+                self._pair(1).exchange(volume = exchange_amount_final,rate = float(self.settings['exchange_speed_handle']())*1000)
             else:#exchange pair of S2_S4
-                if not self.server_devices['client'].configuration['psd_widget']['prepressure_S1_ready']:
+                if not self._config_value('prepressure_S1_ready'):
                     self.times_prepresssure_S1 = 0
                     self.syn_server_and_gui_init(attrs={'times_prepresssure_S1':0})
-                    self.server_devices['exchange_pair']['S1_S3'].pushSyr.drain(rate = float(self.settings['refill_speed_handle']())*1000)
-                    self.server_devices['exchange_pair']['S1_S3'].pullSyr.fill(rate = float(self.settings['refill_speed_handle']())*1000)
+                    self._pair(1).pushSyr.drain(rate = float(self.settings['refill_speed_handle']())*1000)
+                    self._pair(1).pullSyr.fill(rate = float(self.settings['refill_speed_handle']())*1000)
                 to_exchange_amount = (self.total_exchange_amount - self.exchange_amount_already)*1000 #from mL to uL 
-                max_exchange_amount_from_device_limit = self.server_devices['exchange_pair']['S2_S4'].exchangeableVolume-float(self.settings['leftover_volume_handle']())*1000
+                max_exchange_amount_from_device_limit = self._pair(2).exchangeableVolume-float(self.settings['leftover_volume_handle']())*1000
                 exchange_amount_final = min([to_exchange_amount, max_exchange_amount_from_device_limit])
-                self.server_devices['exchange_pair']['S2_S4'].exchange(volume = exchange_amount_final,rate = float(self.settings['exchange_speed_handle']())*1000)
+                self._pair(2).exchange(volume = exchange_amount_final,rate = float(self.settings['exchange_speed_handle']())*1000)
         return True
 
     #this will be execuded once only in the lifetime of auto_exchange
@@ -902,22 +1103,22 @@ class advancedRefillingOperationMode(baseOperationMode):
         #valve pos of syringe_1 to syringe_4
         self.turn_valve(1,'left')
         setattr(self.psd_widget, 'filling_status_syringe_{}'.format(1), True)
-        self.settings['syringe{}_status'.format(1)] ='moving'
+        self.set_status(1,'moving')
         self.turn_valve(2,'right')
         setattr(self.psd_widget, 'filling_status_syringe_{}'.format(2), False)
-        self.settings['syringe{}_status'.format(2)] ='moving'
+        self.set_status(2,'moving')
         self.turn_valve(3,'up')
         setattr(self.psd_widget, 'filling_status_syringe_{}'.format(3), False)
-        self.settings['syringe{}_status'.format(3)] ='moving'
+        self.set_status(3,'moving')
         self.turn_valve(4,'left')
         setattr(self.psd_widget, 'filling_status_syringe_{}'.format(4), True)
-        self.settings['syringe{}_status'.format(4)] ='moving'
+        self.set_status(4,'moving')
         #also ensure the exchange_operation from device is right
         if not self.demo:
-            if self.server_devices['exchange_pair']['S1_S3'].pushSyr.deviceId != 3: # S3--> 3
-                self.server_devices['exchange_pair']['S1_S3'].swap()
-            if self.server_devices['exchange_pair']['S2_S4'].pushSyr.deviceId != 2: # S2--> 2
-                self.server_devices['exchange_pair']['S2_S4'].swap()
+            if self._pair(1).pushSyr.deviceId != self.rig.device_id(3):
+                self._pair(1).swap()
+            if self._pair(2).pushSyr.deviceId != self.rig.device_id(2):
+                self._pair(2).swap()
 
         #set mvp channel
         if not self.mvp_detachment_status:
@@ -971,20 +1172,22 @@ class advancedRefillingOperationMode(baseOperationMode):
             setattr(self,'prepressure_S{}_ready'.format(syringe_no),True)
             self.syn_server_and_gui_init(attrs = {'prepressure_S{}_ready'.format(syringe_no):True})
             getattr(self,"timer_prepressure_S{}".format(syringe_no)).stop()
+            self.notify_event('prepressure_done')
             print('Turning valve {} to {} after prepressure step!'.format(syringe_no,getattr(self,"valve_pos_before_S{}".format(syringe_no))))
             self.turn_valve(syringe_no,getattr(self,"valve_pos_before_S{}".format(syringe_no)))#turn valve back to its original pos
             if not hasattr(self,'init_motion_stage'):
-                self.init_motion_stage = self.server_devices['client'].configuration['psd_widget']['init_motion_stage']
+                self.init_motion_stage = self._config_value('init_motion_stage')
             if self.init_motion_stage:#set status for exchange, done at the beginning for once
                 setattr(self.psd_widget, 'filling_status_syringe_{}'.format(syringe_no), False)#update the filling status to false (means connect to cell)
             else:#set status for refilling, done after every switching cycle
                 setattr(self.psd_widget, 'filling_status_syringe_{}'.format(syringe_no), True)#update the filling status to true (means connect to resevoir)
             if self.init_motion_stage:#only done once at the beginning of exchange
                 self.start_exchange_server_device()
-                time.sleep(0.5)
-                self.timer_motion.start(self.timeout)
+                #start the motion timer once the devices settled, without blocking the GUI thread
+                self.call_later(500, lambda:self.timer_motion.start(self.timeout))
                 self.init_motion_stage = False
                 self.syn_server_and_gui_init(attrs = {'init_motion_stage':False})
+                self._config_barrier()
             else:
                 pass
 
@@ -992,27 +1195,27 @@ class advancedRefillingOperationMode(baseOperationMode):
     def start_exchange_server_device(self):
         if not self.demo:
             self.set_status_to_moving()
-            self.server_devices['exchange_pair']['S1_S3'].exchange(volume = self.server_devices['exchange_pair']['S1_S3'].exchangeableVolume,rate = float(self.settings['refill_speed_handle']())*1000)
+            self._pair(1).exchange(volume = self._pair(1).exchangeableVolume,rate = float(self.settings['refill_speed_handle']())*1000)
             #compute the exchange amount for the next cycle
             to_exchange_amount = (self.total_exchange_amount - self.exchange_amount_already)*1000 #from mL to uL 
-            max_exchange_amount_from_device_limit = self.server_devices['exchange_pair']['S2_S4'].exchangeableVolume-float(self.settings['leftover_volume_handle']())*1000
+            max_exchange_amount_from_device_limit = self._pair(2).exchangeableVolume-float(self.settings['leftover_volume_handle']())*1000
             exchange_amount_final = min([to_exchange_amount, max_exchange_amount_from_device_limit])
-            self.server_devices['exchange_pair']['S2_S4'].exchange(volume = exchange_amount_final,rate = float(self.settings['exchange_speed_handle']())*1000)
-            self.syn_server_and_gui_init(attrs = {'S1_S3_pull_syringe_id':self.server_devices['exchange_pair']['S1_S3'].pullSyr.deviceId})
-            self.syn_server_and_gui_init(attrs = {'S2_S4_pull_syringe_id':self.server_devices['exchange_pair']['S2_S4'].pullSyr.deviceId})
+            self._pair(2).exchange(volume = exchange_amount_final,rate = float(self.settings['exchange_speed_handle']())*1000)
+            self.syn_server_and_gui_init(attrs = {self._pull_id_key(1):self._pair(1).pullSyr.deviceId,
+                                                  self._pull_id_key(2):self._pair(2).pullSyr.deviceId})
         else:
             #TODO: should be adapted accordingly
             self.set_status_to_moving()
-            #self.server_devices['exchange_pair']['S1_S3'].exchange(volume = self.server_devices['exchange_pair']['S1_S3'].exchangeableVolume,rate = float(self.settings['refill_speed_handle']())*1000)
+            #self._pair(1).exchange(volume = self._pair(1).exchangeableVolume,rate = float(self.settings['refill_speed_handle']())*1000)
             #compute the exchange amount for the next cycle
             '''
             self.settings['syringe_{}_min'.format(syringe_index)] = max([getattr(self.psd_widget,'volume_syringe_{}'.format(syringe_index)) - vol, 0])
             self.settings['syringe_{}_max'.format(syringe_index)] = min([getattr(self.psd_widget,'volume_syringe_{}'.format(syringe_index)) + vol, self.psd_widget.syringe_size])
             to_exchange_amount = (self.total_exchange_amount - self.exchange_amount_already)*1000 #from mL to uL 
-            max_exchange_amount_from_device_limit = self.server_devices['exchange_pair']['S2_S4'].exchangeableVolume-float(self.settings['leftover_volume_handle']())*1000
+            max_exchange_amount_from_device_limit = self._pair(2).exchangeableVolume-float(self.settings['leftover_volume_handle']())*1000
             exchange_amount_final = min([to_exchange_amount, max_exchange_amount_from_device_limit])
             '''
-            #self.server_devices['exchange_pair']['S2_S4'].exchange(volume = exchange_amount_final,rate = float(self.settings['exchange_speed_handle']())*1000)            
+            #self._pair(2).exchange(volume = exchange_amount_final,rate = float(self.settings['exchange_speed_handle']())*1000)            
 
     def update_widget_droplet_adjustment(self, syringe_no):
         self.single_syringe_motion(syringe_no, speed_tag = None, continual_exchange = False, demo = self.demo)
@@ -1025,10 +1228,10 @@ class advancedRefillingOperationMode(baseOperationMode):
     #handle to be called to start the advance_exchange operation
     def start_motion_timer(self, onetime = False):
         if not self.demo:
-            if self.server_devices['exchange_pair']['S1_S3'].pullSyr.deviceId!=self.server_devices['client'].configuration['psd_widget']['S1_S3_pull_syringe_id']:
-                self.server_devices['exchange_pair']['S1_S3'].swap()
-            if self.server_devices['exchange_pair']['S2_S4'].pullSyr.deviceId!=self.server_devices['client'].configuration['psd_widget']['S2_S4_pull_syringe_id']:
-                self.server_devices['exchange_pair']['S2_S4'].swap()
+            if self._pair(1).pullSyr.deviceId!=self._config_value(self._pull_id_key(1)):
+                self._pair(1).swap()
+            if self._pair(2).pullSyr.deviceId!=self._config_value(self._pull_id_key(2)):
+                self._pair(2).swap()
         
         if not self.resume:
             self.onetime = onetime
@@ -1052,6 +1255,7 @@ class advancedRefillingOperationMode(baseOperationMode):
                     self.server_devices['client'].stop()
                 self.timer_motion.stop()
                 self.settings['set_under_exchange_to_false']()
+                self.notify_event('exchange_done')
                 return
             if self.onetime:
                 if not self.demo:
@@ -1073,12 +1277,27 @@ class advancedRefillingOperationMode(baseOperationMode):
             else:
                 pass
                 #self.timer_motion.stop()
-            time.sleep(0.5)
-            self.switch_state_during_exchange(syringe_index_list = [1, 2, 3, 4])
-            self.set_status_to_moving()
-            self._syringe_motions(index = range(1,5), overshoot_amount = overshoot_amount)
+            #let the devices settle without blocking the GUI thread: the motion timer is paused
+            #and the switch-over continues in staged single-shot steps
+            self.timer_motion.stop()
+            self.call_later(500, lambda:self._switch_over(overshoot_amount))
         else:
-            self._syringe_motions(index = range(1,5), overshoot_amount = overshoot_amount)
+            self._syringe_motions(overshoot_amount = overshoot_amount)
+
+    def _switch_over(self, overshoot_amount = 0):
+        self.switch_state_during_exchange(syringe_index_list = self.syringe_indices, done = lambda:self._switched_over(overshoot_amount))
+
+    def _switched_over(self, overshoot_amount = 0):
+        self.notify_event('switch_over')
+        #state switch is a barrier: the server must know the new pair ids before the next cycle
+        self._config_barrier()
+        #give the devices 100 ms to start moving before their busy flags are read again
+        self.call_later(100, lambda:self._resume_after_switch_over(overshoot_amount))
+
+    def _resume_after_switch_over(self, overshoot_amount = 0):
+        self.set_status_to_moving()
+        self._syringe_motions(overshoot_amount = overshoot_amount)
+        self.timer_motion.start(self.timeout)
 
     def check_synchronization(self):
         gui_ready = False
@@ -1163,7 +1382,7 @@ class advancedRefillingOperationMode(baseOperationMode):
             #syringe 1 and syringe 3 are exchanging solution now
             #syringe 2 is refilling solution
             if not self.demo:
-                times_prepresssure_S2 = self.server_devices['client'].configuration['psd_widget']['times_prepresssure_S2']
+                times_prepresssure_S2 = self._config_value('times_prepresssure_S2')
             else:
                 times_prepresssure_S2 = self.times_prepresssure_S2
             #if refilling is completed and prepressure has not yet done then do prepressure now!
@@ -1176,7 +1395,7 @@ class advancedRefillingOperationMode(baseOperationMode):
             #syringe 2 and syringe 4 are exchanging solution now
             #syringe 1 is refilling solution
             if not self.demo:
-                times_prepresssure_S1 = self.server_devices['client'].configuration['psd_widget']['times_prepresssure_S1']
+                times_prepresssure_S1 = self._config_value('times_prepresssure_S1')
             else:
                 times_prepresssure_S1 = self.times_prepresssure_S1
             if self.settings['syringe{}_status'.format(1)]=='ready' and times_prepresssure_S1==0:
@@ -1194,14 +1413,20 @@ class advancedRefillingOperationMode(baseOperationMode):
 
     def check_server_devices_busy(self):
         #If any device is busy, then return True
-        for each in list(self.server_devices['syringe'].values()) + [self.server_devices['mvp_valve']]:
-            if each.busy:
+        for index in self.server_devices['syringe']:
+            if self._device_syringe_busy(index):
                 return True
-        return False
-
-    def switch_state_during_exchange(self, syringe_index_list):
+        return self._device_mvp_busy()
+
+    def switch_state_during_exchange(self, syringe_index_list, done = None):
+        #the pump diagram switches at once; the device commands (T valves, then the mvp, swaps and new motions)
+        #run as one sequence off the GUI thread, done() follows in the GUI thread once the devices have switched.
+        #Returns the Future of the device sequence, None in demo mode
+        #the T valve moves are independent, they run in parallel and are waited for together
+        valve_batch = CommandBatch()
+        mvp_channel = None
         for syringe_index in syringe_index_list:
-            self.turn_valve(syringe_index)
+            self.turn_valve(syringe_index, batch = valve_batch)
             setattr(self.psd_widget, 'filling_status_syringe_{}'.format(syringe_index), not getattr(self.psd_widget, 'filling_status_syringe_{}'.format(syringe_index)))
             if self.pump_settings['S{}_{}'.format(syringe_index, self.psd_widget.connect_valve_port[syringe_index])] == 'cell_inlet':
 
@@ -1209,38 +1434,76 @@ class advancedRefillingOperationMode(baseOperationMode):
                     print('switch mvp now!')
                     self.psd_widget.mvp_connected_valve = 'S{}_{}'.format(syringe_index, self.psd_widget.connect_valve_port[syringe_index])
                     self.psd_widget.mvp_channel = int(self.pump_settings['S{}_mvp'.format(syringe_index)].rsplit('_')[1])
-                    if not self.demo:  
-                        self.server_devices['mvp_valve'].moveValve(self.psd_widget.mvp_channel)
-                        self.server_devices['mvp_valve'].join()
-        if not self.demo:
+                    mvp_channel = self.psd_widget.mvp_channel
+        if self.demo:
+            if done != None:
+                done()
+            return None
+        #everything read from the GUI is taken here, the sequence only talks to the devices
+        pairs = {1: self._pair(1), 2: self._pair(2)}
+        pull_id_keys = {1: self._pull_id_key(1), 2: self._pull_id_key(2)}
+        if self.psd_widget.filling_status_syringe_1: #if pulling for S1, S2 is connected to cell for exchange
+            exchange_pair, refill_pair = pairs[2], pairs[1]
+        else:
+            exchange_pair, refill_pair = pairs[1], pairs[2]
+        to_exchange_amount = (self.total_exchange_amount - self.exchange_amount_already)*1000 #in mL 
+        leftover = float(self.settings['leftover_volume_handle']())*1000
+        exchange_rate = float(self.settings['exchange_speed_handle']())*1000
+        refill_rate = float(self.settings['refill_speed_handle']())*1000
+        mvp_valve = self.server_devices['mvp_valve']
+        def devices():
+            valve_batch.run_commands()
+            #safety ordering: the mvp only moves once the T valves are in their new position
+            if mvp_channel != None:
+                mvp_valve.moveValve(mvp_channel)
+                mvp_valve.join()
             #make sure the mvp vale is switched succesfully
-            self.server_devices['exchange_pair']['S1_S3'].swap()
-            self.server_devices['exchange_pair']['S2_S4'].swap()
-            self.syn_server_and_gui_init(attrs = {'S1_S3_pull_syringe_id':self.server_devices['exchange_pair']['S1_S3'].pullSyr.deviceId})
-            self.syn_server_and_gui_init(attrs = {'S2_S4_pull_syringe_id':self.server_devices['exchange_pair']['S2_S4'].pullSyr.deviceId})
-            if self.psd_widget.filling_status_syringe_1: #if pulling for S1, S2 is connected to cell for exchange
-                to_exchange_amount = (self.total_exchange_amount - self.exchange_amount_already)*1000 #in mL 
-                max_exchange_amount_from_device_limit = self.server_devices['exchange_pair']['S2_S4'].exchangeableVolume-float(self.settings['leftover_volume_handle']())*1000
-                exchange_amount_final = min([to_exchange_amount, max_exchange_amount_from_device_limit])
-                self.server_devices['exchange_pair']['S2_S4'].exchange(volume = exchange_amount_final,rate = float(self.settings['exchange_speed_handle']())*1000)
-                self.server_devices['exchange_pair']['S1_S3'].pushSyr.drain(rate = float(self.settings['refill_speed_handle']())*1000)
-                self.server_devices['exchange_pair']['S1_S3'].pullSyr.fill(rate = float(self.settings['refill_speed_handle']())*1000)
-            else:
-                to_exchange_amount = (self.total_exchange_amount - self.exchange_amount_already)*1000 #in mL 
-                max_exchange_amount_from_device_limit = self.server_devices['exchange_pair']['S1_S3'].exchangeableVolume-float(self.settings['leftover_volume_handle']())*1000
-                exchange_amount_final = min([to_exchange_amount, max_exchange_amount_from_device_limit])
-                self.server_devices['exchange_pair']['S1_S3'].exchange(volume = exchange_amount_final,rate = float(self.settings['exchange_speed_handle']())*1000)
-                self.server_devices['exchange_pair']['S2_S4'].pushSyr.drain(rate = float(self.settings['refill_speed_handle']())*1000)
-                self.server_devices['exchange_pair']['S2_S4'].pullSyr.fill(rate = float(self.settings['refill_speed_handle']())*1000)
-        time.sleep(0.1)
-        
+            swap_batch = CommandBatch()
+            swap_batch.add(pairs[1].swap)
+            swap_batch.add(pairs[2].swap)
+            swap_batch.run_commands()
+            pull_ids = {pull_id_keys[i]: pairs[i].pullSyr.deviceId for i in [1, 2]}
+            exchange_amount_final = min([to_exchange_amount, exchange_pair.exchangeableVolume - leftover])
+            #the exchanging pair and the two refilling syringes are independent devices
+            motion_batch = CommandBatch()
+            motion_batch.add(exchange_pair.exchange, volume = exchange_amount_final, rate = exchange_rate)
+            motion_batch.add(refill_pair.pushSyr.drain, rate = refill_rate)
+            motion_batch.add(refill_pair.pullSyr.fill, rate = refill_rate)
+            motion_batch.run_commands()
+            return pull_ids
+        generation = self._generation
+        def switched(pull_ids):
+            valve_batch.run_callbacks()
+            self.syn_server_and_gui_init(attrs = pull_ids)
+            #all motions were stopped meanwhile (cancel_pending), the exchange does not go on
+            if done != None and generation == self._generation:
+                done()
+        return run_in_background(devices, switched, self._switch_over_failed)
+
+    def _switch_over_failed(self, error):
+        #a device command of the switch-over failed: stop the exchange rather than go on with unknown device states
+        self.cancel_pending()
+        self.timer_motion.stop()
+        try:
+            self.server_devices['client'].stop()
+        except Exception as e:
+            print('Fail to stop the devices after the failed switch-over: {}'.format(e))
+        self.set_status_to_ready()
+        self.settings['set_under_exchange_to_false']()
+        error_pop_up('Error: the switch-over failed, the exchange is stopped!\n{}'.format(error))
+
     def _pair_key(self):
-        for syringe_index in [1,2,3,4]:
+        for syringe_index in self.syringe_indices:
             if self.pump_settings['S{}_{}'.format(syringe_index, self.psd_widget.connect_valve_port[syringe_index])] == 'cell_inlet':
-                if syringe_index in [1,3]:
-                    return 'S1_S3'
-                else:
-                    return 'S2_S4'
+                return self.rig.pair_of(syringe_index)
+
+    def _pair(self, syringe_index):
+        #the protocol alternates the exchange pair of S1 (S1_S3 on the legacy rig) and the one of S2
+        return self.server_devices['exchange_pair'][self.rig.pair_of(syringe_index)]
+
+    def _pull_id_key(self, syringe_index):
+        #psd_widget configuration entry holding the pulling device of the pair, eg S1_S3_pull_syringe_id
+        return '{}_pull_syringe_id'.format(self.rig.pair_of(syringe_index))
 
     def _volume(self):
         #return self.settings['total_exchange_amount_handle']()*1000
@@ -1250,20 +1513,30 @@ class advancedRefillingOperationMode(baseOperationMode):
         #return self.settings['exchange_speed_handle']()*1000
         return self.settings['extra_amount_speed_handle']()
 
-    def _syringe_motions(self, index = [1,2,3,4],overshoot_amount = 0):
-        for i in index:
-            if i in self.psd_widget.get_refill_syringes_advance_exchange_mode():
-                self.single_syringe_motion(i, speed_tag = 'refill_speed_handle', continual_exchange = True, demo = self.demo)
-            else:
-                self.single_syringe_motion(i, speed_tag = 'exchange_speed_handle', continual_exchange = True, demo = self.demo)
+    def _syringe_motions(self, index = None,overshoot_amount = 0):
+        if index == None:
+            index = self.syringe_indices
+        refill_syringes = self.psd_widget.get_refill_syringes_advance_exchange_mode()
+        speed_tags = [['exchange_speed_handle','refill_speed_handle'][int(i in refill_syringes)] for i in index]
+        self.multi_syringe_motion(list(index), speed_tags = speed_tags, continual_exchange = True, demo = self.demo)
 
     def check_device_status(self):
-        syringes_codes = [self.server_devices['syringe'][i].status['syringe'].statuscode for i in [1,2,3,4]]
-        valves_codes = [self.server_devices['syringe'][i].status['valve'].statuscode for i in [1,2,3,4]]
+        if self._cache_ready():
+            snapshot = self.device_cache.latest()
+            syringes_codes = [snapshot['syringe'][i]['syringe_status_code'] for i in self.syringe_indices]
+            valves_codes = [snapshot['syringe'][i]['valve_status_code'] for i in self.syringe_indices]
+            if sum(syringes_codes)+sum(valves_codes)+snapshot['mvp']['valve_status_code']!=0:
+                for i in self.syringe_indices:
+                    self.psd_widget.connect_status[i] = snapshot['syringe'][i]['syringe_status']
+                self.psd_widget.update()
+                return 'error'
+            return 'no error'
+        syringes_codes = [self.server_devices['syringe'][i].status['syringe'].statuscode for i in self.syringe_indices]
+        valves_codes = [self.server_devices['syringe'][i].status['valve'].statuscode for i in self.syringe_indices]
         mvp_valve_code = self.server_devices['mvp_valve'].status['valve'].statuscode
         if sum(syringes_codes)+sum(valves_codes)+mvp_valve_code!=0:
             #if error then show the error source on GUI widget
-            for i in [1,2,3,4]:
+            for i in self.syringe_indices:
                 self.psd_widget.connect_status[i] = self.server_devices['syringe'][i].status['syringe'].__str__()
             self.psd_widget.update()
             return 'error'
@@ -1305,7 +1578,7 @@ class cleanOperationMode(baseOperationMode):
 
         #append info in settings
         self.settings['speed'] = self.settings['refill_speed_handle']()/(1000/self.timeout)
-        self.settings['syringe{}_status'.format(syringe)] ='moving'
+        self.set_status(syringe,'moving')
         self.settings['syringe_{}_min'.format(syringe)] =  0
         self.settings['syringe_{}_max'.format(syringe)] = self.psd_widget.syringe_size
         self.settings['possible_connection_valves_syringe_{}'.format(syringe)] = [self.settings['inlet_port_handle'](),self.settings['outlet_port_handle']()]
@@ -1331,7 +1604,7 @@ class cleanOperationMode(baseOperationMode):
         #switch filling status
         setattr(self.psd_widget,'filling_status_syringe_{}'.format(self.syringe_index),not getattr(self.psd_widget,'filling_status_syringe_{}'.format(self.syringe_index)))
         #switch motion state
-        self.settings['syringe'+str(self.syringe_index)+'_status'] = 'moving'
+        self.set_status(self.syringe_index,'moving')
         if not self.demo:
             if getattr(self.psd_widget,'filling_status_syringe_{}'.format(self.syringe_index)):
                 self.server_devices['syringe'][self.syringe_index].fill(rate = self.settings['speed']*10*1000)
@@ -1397,7 +1670,7 @@ class fillCellOperationMode(baseOperationMode):
         self.settings['waste_speed'] = self.settings['waste_disposal_speed_handle']()/(1000/self.timeout)
         self.settings['vol_to_waste'] = self.settings['waste_disposal_vol_handle']()#in ml
         self.settings['vol_to_cell'] = self.settings['cell_dispense_vol_handle']()#in ml
-        self.settings['syringe{}_status'.format(syringe)] ='moving'
+        self.set_status(syringe,'moving')
         self.settings['syringe_{}_max'.format(syringe)] =  eval('self.psd_widget.volume_syringe_{}'.format(syringe))
         self.settings['syringe_{}_min'.format(syringe)] = max([0,eval('self.psd_widget.volume_syringe_{}'.format(syringe))-self.settings['vol_to_waste']])
         self.settings['possible_connection_valves_syringe_{}'.format(syringe)] = ['up','right']
@@ -1435,7 +1708,7 @@ class fillCellOperationMode(baseOperationMode):
             self.settings['syringe_{}_min'.format(self.syringe_index)] = max([0,eval('self.psd_widget.volume_syringe_{}'.format(self.syringe_index))-self.settings['vol_to_cell']])
 
         #switch motion state
-        self.settings['syringe'+str(self.syringe_index)+'_status'] = 'moving'
+        self.set_status(self.syringe_index,'moving')
         #switch to the right mvp channel 
         if self.pump_settings['S{}_{}'.format(self.syringe_index, self.psd_widget.connect_valve_port[self.syringe_index])] == 'cell_inlet':
             #print('switch mvp now!')
@@ -1527,10 +1800,10 @@ class normalOperationMode(baseOperationMode):
                     self.server_devices['syringe'][syringe_index].dispense(volume= vol*1000, rate = speed*10*1000)
                 except ValueError:
                     self.server_devices['syringe'][syringe_index].drain(rate = speed*10*1000)
-            self.settings['syringe{}_status'.format(syringe_index)] ='moving'
+            self.set_status(syringe_index,'moving')
             self.psd_widget.connect_status[syringe_index] = 'moving'
         else:
-            self.settings['syringe{}_status'.format(syringe_index)] ='moving'
+            self.set_status(syringe_index,'moving')
             self.psd_widget.connect_status[syringe_index] = 'moving'
 
         self.psd_widget.update()
@@ -1600,7 +1873,7 @@ class initOperationMode(baseOperationMode):
                 index = self.psd_widget.actived_pulling_syringe_init_mode
                 self.server_devices['syringe'][index].pickup(volume= vol*1000, rate = speed*10*1000)
             if index != None:
-                self.settings['syringe{}_status'.format(index)] ='moving'
+                self.set_status(index,'moving')
                 self.psd_widget.connect_status[index] = 'moving'
             #set mvp channel
             if not self.mvp_detachment_status:
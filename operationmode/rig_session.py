@@ -0,0 +1,121 @@
+"""Devices, operation modes and timers of one rig driven by the main window.
+
+MyMainWindow keeps one RigSession per rig it has shown. The modes of every session are built
+once and all their timers come from the window's TimerScheduler, so the rigs run in parallel
+on one master QTimer. One session at a time is shown (attached): its modes draw into the main
+window widget, read the parameter panel and use the device poller cache. A detached session
+keeps running on its own pump diagram state (a syringe_state) with direct device reads and
+the panel values of the last time it was shown; its display handles (exchange time/volume
+labels, valve combo boxes, time-lapse events) are skipped until it is shown again.
+"""
+from syringe_widget import syringe_state
+
+#settings handles showing the progress in the main window rather than returning a parameter
+DISPLAY_HANDLES = ['time_record_handle', 'volume_record_handle', 'valve_handle', 'event_handle']
+
+class RigSession(object):
+    def __init__(self, rig, scheduler, pump_settings, shown = False):
+        self.rig = rig
+        self.scheduler = scheduler
+        self.server_devices = None
+        #attribute name in the main window -> operation mode / timer
+        self.modes = {}
+        self.timers = {}
+        #pump diagram of the rig while it is not shown, a fresh one until it is detached once
+        self.state = syringe_state()
+        self.state.init_state()
+        self.state.pump_settings = pump_settings
+        self.state.set_resevoir_volumes()
+        self.state.syringe_indices = rig.syringe_indices
+        self.attached = shown
+        self.under_exchange = False
+        #re-read the parameter handles, called when the session is detached
+        self._refreshers = []
+
+    def timer(self, name):
+        if name not in self.timers:
+            self.timers[name] = self.scheduler.timer()
+        return self.timers[name]
+
+    def reset(self):
+        #the modes are about to be built again, the timers of the old modes stay connected to them
+        self.stop()
+        self.timers = {name: self.scheduler.timer() for name in self.timers}
+        self.modes = {}
+        self._refreshers = []
+
+    def running(self):
+        return any([timer.isActive() for timer in self.timers.values()])
+
+    def stop(self):
+        for mode in self.modes.values():
+            mode.cancel_pending()
+        for timer in self.timers.values():
+            timer.stop()
+
+    def bind(self, settings):
+        #settings of a mode of this rig: handles follow the main window only while the rig is shown
+        bound = dict(settings)
+        for key, handle in settings.items():
+            if not callable(handle):
+                continue
+            if key in DISPLAY_HANDLES:
+                bound[key] = self._display(handle)
+            elif key == 'set_under_exchange_to_false':
+                bound[key] = self._exchange_finished(handle)
+            elif key.endswith('_handle'):
+                bound[key] = self._parameter(handle)
+        return bound
+
+    def _display(self, handle):
+        def show(*args, **kwargs):
+            if self.attached:
+                return handle(*args, **kwargs)
+        return show
+
+    def _exchange_finished(self, handle):
+        def finished():
+            self.under_exchange = False
+            if self.attached:
+                handle()
+        return finished
+
+    def _parameter(self, handle):
+        #arguments (eg the syringe index of the normal mode handles) -> value read last
+        values = {}
+        def read(*args):
+            if self.attached or args not in values:
+                values[args] = handle(*args)
+            return values[args]
+        def refresh():
+            #only the values a mode has read already, the others may not be set on the panel
+            for args in list(values):
+                try:
+                    values[args] = handle(*args)
+                except Exception as e:
+                    #a panel entry not valid for this rig, the value read last is kept
+                    print('Rig {}: keep the last value of a parameter: {}'.format(self.rig.name, e))
+        self._refreshers.append(refresh)
+        return read
+
+    def detach(self, widget):
+        #the rig is no longer shown: freeze its panel values and move its modes to self.state
+        for refresh in self._refreshers:
+            refresh()
+        self.state.copy_state(widget)
+        self._retarget(self.state, None)
+        self.attached = False
+
+    def attach(self, widget, device_cache):
+        #the rig is shown in widget, its modes draw there again
+        widget.copy_state(self.state)
+        self._retarget(widget, device_cache)
+        self.attached = True
+        widget.repaint_all()
+
+    def _retarget(self, psd_widget, device_cache):
+        if self.server_devices != None:
+            self.server_devices['device_cache'] = device_cache
+        for mode in self.modes.values():
+            mode.psd_widget = psd_widget
+            mode.device_cache = device_cache
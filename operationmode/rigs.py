@@ -0,0 +1,215 @@
+"""Rig registry: which pump devices belong to which electrochemical cell.
+
+A rig is one cell with its syringes (GUI index -> hardware address of the syringe pump), its
+MVP valve(s) and its exchange pairs (pair label -> ExchangePair operation of the pump server).
+Pair labels are 'S<i>_S<j>' of the two GUI indices, lower index first. The rigs are read from
+the optional rigs: section of the pump configuration file (nodb_configuration.yml):
+
+    rigs:
+      cell_A:
+        syringes: {1: 4, 2: 2, 3: 3, 4: 1}
+        mvp: [5]
+        pairs:
+          S1_S3: Exchanger 2
+          S2_S4: Exchanger 1
+        valve positions: {left: 1, up: 2, right: 3}    #optional, T valve position names
+        max rate: 5000                                 #optional, fastest syringe rate in uL/s
+
+Without the section the file describes the single four syringe rig the GUI was built for
+(LEGACY_RIG).
+
+The rigs of one pump server share its client. The first rig keeps the psd_widget section of
+client.configuration for its exchange state, the others use psd_widget_<name>. With more than
+one rig, server_devices['client'] is a RigClient whose stop() only stops the rig's own devices.
+pooled_devices() gives the same entries as PooledDevice proxies on the queues of a ClientPool,
+one queue per syringe, MVP valve and exchange pair, and one for the client itself.
+"""
+from collections import OrderedDict
+from operationmode.client_pool import PooledDevice
+
+#valve position name (GUI) -> T valve position number (server)
+VALVE_POSITION_T = {'left':1,'up':2, 'right':3}
+#fastest syringe rate in uL/s, as far as the speed boxes of the GUI go
+MAX_RATE = 5000
+
+#the hardware set up without a rigs: section: GUI S1..S4 -> addresses 4, 2, 3, 1, MVP at 5
+LEGACY_RIG = {'syringes': {1:4, 2:2, 3:3, 4:1},
+              'mvp': [5],
+              'pairs': {'S1_S3':'Exchanger 2', 'S2_S4':'Exchanger 1'}}
+
+def pair_label(index_a, index_b):
+    return 'S{}_S{}'.format(*sorted([int(index_a), int(index_b)]))
+
+def pair_indices(label):
+    #'S1_S3' -> (1, 3)
+    first, second = label.split('_')
+    return int(first[1:]), int(second[1:])
+
+class RigClient(object):
+    #pump client seen by the operation modes of one rig when other rigs share the client
+    def __init__(self, client, rig):
+        self._client = client
+        self._rig = rig
+
+    def stop(self):
+        #client.stop() would stop the motions of every rig on the server
+        for address in self._rig.syringes.values():
+            self._client.getSyringe(address).stop()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+class Rig(object):
+    def __init__(self, name, syringes, mvp = [], pairs = {}, valve_positions = VALVE_POSITION_T, max_rate = MAX_RATE):
+        self.name = name
+        #client.configuration section of the exchange state, set by RigRegistry
+        self.config_section = 'psd_widget'
+        #True if other rigs share the pump client
+        self.shared_client = False
+        self.syringes = {int(index): int(address) for index, address in syringes.items()}
+        self.mvp = [int(each) for each in ([mvp] if isinstance(mvp, int) else mvp)]
+        self.pairs = {}
+        for label, operation in pairs.items():
+            indices = pair_indices(label)
+            if not set(indices).issubset(self.syringes):
+                raise ValueError('rig {}: pair {} uses a syringe not in the rig'.format(name, label))
+            self.pairs[pair_label(*indices)] = operation
+        self.valve_positions = dict(valve_positions)
+        self.max_rate = float(max_rate)
+
+    def clamp_rate(self, rate):
+        #syringe rate in uL/s within what the syringes of the rig can run
+        return max(0., min(self.max_rate, rate))
+
+    @property
+    def syringe_indices(self):
+        return sorted(self.syringes)
+
+    def device_id(self, index):
+        #hardware address of the syringe with GUI index
+        return self.syringes[index]
+
+    def index_of(self, device_id):
+        for index, address in self.syringes.items():
+            if address == device_id:
+                return index
+        return None
+
+    def pair_of(self, index):
+        #label of the exchange pair of a syringe, None if it is not part of one
+        for label in self.pairs:
+            if index in pair_indices(label):
+                return label
+        return None
+
+    def addresses(self):
+        return list(self.syringes.values()) + self.mvp
+
+    def demo_devices(self, simulator = None):
+        #server_devices without devices, for demo mode
+        return {'syringe': {index:None for index in self.syringe_indices},
+                'T_valve': {index:None for index in self.syringe_indices},
+                'mvp_valve': None,
+                'mvp_valves': {address:None for address in self.mvp},
+                'exchange_pair': {label:None for label in self.pairs},
+                'server': None,
+                'simulator': simulator,
+                'rig': self}
+
+    def server_devices(self, client):
+        #server_devices entries of the rig from one pump client session
+        syringes = {index: client.getSyringe(address) for index, address in self.syringes.items()}
+        mvp_valves = {address: client.getValve(address) for address in self.mvp}
+        return {'syringe': syringes,
+                'T_valve': dict(syringes),
+                #first MVP, the one the operation modes switch
+                'mvp_valve': mvp_valves[self.mvp[0]] if len(self.mvp)!=0 else None,
+                'mvp_valves': mvp_valves,
+                'exchange_pair': {label: client.operations[operation] for label, operation in self.pairs.items()},
+                'client': RigClient(client, self) if self.shared_client else client,
+                'rig': self}
+
+    def pooled_devices(self, pool, role = 'motion', setup_syringe = None):
+        #server_devices entries of the rig, every device call runs on its queue in the session of role
+        def pooled(name, resolve, setup = None):
+            return PooledDevice(pool, role, name, resolve, setup)
+        syringes = {index: pooled('syringe {}'.format(address), lambda client, address = address: client.getSyringe(address), setup_syringe)
+                    for index, address in self.syringes.items()}
+        def pooled_syringe(device):
+            #the syringe proxy of a device of an exchange pair, its commands run on the queue of the syringe
+            return syringes[self.index_of(device.deviceId)]
+        pair_syringes = {'pushSyr': pooled_syringe, 'pullSyr': pooled_syringe}
+        mvp_valves = {address: pooled('valve {}'.format(address), lambda client, address = address: client.getValve(address)) for address in self.mvp}
+        if self.shared_client:
+            client = pooled('client', lambda client: RigClient(client, self))
+        else:
+            client = pooled('client', lambda client: client)
+        return {'syringe': syringes,
+                'T_valve': dict(syringes),
+                'mvp_valve': mvp_valves[self.mvp[0]] if len(self.mvp)!=0 else None,
+                'mvp_valves': mvp_valves,
+                'exchange_pair': {label: PooledDevice(pool, role, operation, lambda client, operation = operation: client.operations[operation],
+                                                      devices = pair_syringes)
+                                  for label, operation in self.pairs.items()},
+                'client': client,
+                'rig': self}
+
+class RigRegistry(object):
+    """Rigs by name, in configuration order; the first one is the default rig."""
+    def __init__(self, rigs):
+        if len(rigs)==0:
+            raise ValueError('no rig configured')
+        self.rigs = OrderedDict([(rig.name, rig) for rig in rigs])
+        for number, rig in enumerate(self.rigs.values()):
+            rig.config_section = 'psd_widget' if number == 0 else 'psd_widget_{}'.format(rig.name)
+            rig.shared_client = len(self.rigs) > 1
+
+    @classmethod
+    def legacy(cls):
+        return cls([Rig('rig1', **LEGACY_RIG)])
+
+    @classmethod
+    def from_configuration(cls, config):
+        #config: parsed pump configuration file, checked against its devices: and operations: sections
+        if config.get('rigs', None) == None:
+            return cls.legacy()
+        devices = config.get('devices', None) or {}
+        operations = (config.get('operations', None) or {}).get('ExchangePair', None) or {}
+        rigs = []
+        owner = {}
+        for name, spec in config['rigs'].items():
+            rig = Rig(str(name), spec['syringes'], spec.get('mvp', []), spec.get('pairs', {}), spec.get('valve positions', VALVE_POSITION_T),
+                      spec.get('max rate', MAX_RATE))
+            for address, kind in [(each, 'PSD') for each in rig.syringes.values()] + [(each, 'MVP') for each in rig.mvp]:
+                if len(devices)!=0 and devices.get(address, {}).get('type', None) != kind:
+                    raise ValueError('rig {}: no {} device at address {}'.format(name, kind, address))
+                if address in owner:
+                    raise ValueError('rig {}: address {} is already used by rig {}'.format(name, address, owner[address]))
+                owner[address] = name
+            for label, operation in rig.pairs.items():
+                if len(operations)!=0 and operation not in operations:
+                    raise ValueError('rig {}: pair {} refers to the unknown ExchangePair {}'.format(name, label, operation))
+            rigs.append(rig)
+        return cls(rigs)
+
+    @classmethod
+    def from_file(cls, config_file):
+        import yaml
+        with open(config_file, 'r') as f:
+            return cls.from_configuration(yaml.safe_load(f) or {})
+
+    @property
+    def default(self):
+        return next(iter(self.rigs.values()))
+
+    def names(self):
+        return list(self.rigs)
+
+    def __getitem__(self, name):
+        return self.rigs[name]
+
+    def __iter__(self):
+        return iter(self.rigs.values())
+
+    def __len__(self):
+        return len(self.rigs)
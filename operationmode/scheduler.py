@@ -0,0 +1,145 @@
+import heapq
+import itertools
+import logging
+import math
+import time
+from PyQt5 import QtCore
+from operationmode.virtual_clock import VirtualSignal
+
+class ScheduledTimer(object):
+    """Duck-typed QTimer driven by a TimerScheduler instead of its own Qt timer.
+
+    Supports the same subset of the QTimer API as VirtualTimer: timeout.connect, start([msec]),
+    stop(), isActive(), setInterval(), interval(), remainingTime() and setSingleShot().
+    """
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.timeout = VirtualSignal()
+        self._interval = 0
+        self._single_shot = False
+        self._active = False
+        #monotonic time (s) of the next timeout
+        self.next_fire = None
+        #bumped at every (re)start and stop, older heap entries of this timer are ignored
+        self._generation = 0
+
+    def start(self, msec = None):
+        if msec != None:
+            self._interval = msec
+        self._active = True
+        self.scheduler._schedule(self, time.monotonic() + self._interval/1000.)
+
+    def stop(self):
+        self._active = False
+        self.next_fire = None
+        self._generation += 1
+
+    def isActive(self):
+        return self._active
+
+    def setInterval(self, msec):
+        #like QTimer, an active timer is restarted with the new interval
+        self._interval = msec
+        if self._active:
+            self.start()
+
+    def interval(self):
+        return self._interval
+
+    def remainingTime(self):
+        if not self._active:
+            return -1
+        return max(0, int((self.next_fire - time.monotonic())*1000))
+
+    def setSingleShot(self, single_shot):
+        self._single_shot = single_shot
+
+    def isSingleShot(self):
+        return self._single_shot
+
+    def _fire(self, now):
+        if self._single_shot:
+            self.stop()
+        else:
+            self.scheduler._schedule(self, now + max(self._interval, 1)/1000.)
+        self.timeout.emit()
+
+class TimerScheduler(QtCore.QObject):
+    """One master QTimer driving any number of ScheduledTimers and delayed calls.
+
+    The timers of all syringes, pairs and rigs of the process are kept in one heap ordered by
+    their next timeout; the master timer is armed for the earliest one only, so the cost per
+    timeout is O(log n) and nothing is woken up while no timer is due. Stopped and restarted
+    timers leave stale heap entries behind, they are dropped when they reach the top.
+    """
+    def __init__(self, parent = None):
+        super(TimerScheduler, self).__init__(parent)
+        self._master = QtCore.QTimer(self)
+        self._master.setSingleShot(True)
+        self._master.setTimerType(QtCore.Qt.PreciseTimer)
+        self._master.timeout.connect(self._dispatch)
+        #(monotonic deadline, seq, generation, timer or callback)
+        self._heap = []
+        self._counter = itertools.count()
+        #deadline the master timer is armed for
+        self._armed = None
+        self.dispatched = 0
+        #slots that raised, reported and skipped
+        self.failures = 0
+
+    def timer(self):
+        return ScheduledTimer(self)
+
+    def call_later(self, msec, callback):
+        #drop-in for QTimer.singleShot(msec, callback)
+        heapq.heappush(self._heap, (time.monotonic() + msec/1000., next(self._counter), None, callback))
+        self._rearm()
+
+    def pending(self):
+        #number of live heap entries (active timers and delayed calls)
+        return len([entry for entry in self._heap if not self._stale(entry)])
+
+    def _schedule(self, timer, deadline):
+        timer._generation += 1
+        timer.next_fire = deadline
+        heapq.heappush(self._heap, (deadline, next(self._counter), timer._generation, timer))
+        self._rearm()
+
+    def _stale(self, entry):
+        _, _, generation, target = entry
+        return generation != None and (not target._active or generation != target._generation)
+
+    def _rearm(self):
+        while len(self._heap)!=0 and self._stale(self._heap[0]):
+            heapq.heappop(self._heap)
+        if len(self._heap)==0:
+            self._master.stop()
+            self._armed = None
+            return
+        deadline = self._heap[0][0]
+        if self._armed != None and self._armed <= deadline and self._master.isActive():
+            return
+        self._armed = deadline
+        self._master.start(max(0, int(math.ceil((deadline - time.monotonic())*1000))))
+
+    def _dispatch(self):
+        self._armed = None
+        now = time.monotonic()
+        try:
+            #everything due by now, in deadline order; slots may start or stop other timers meanwhile
+            while len(self._heap)!=0 and self._heap[0][0] <= now + 0.0005:
+                entry = heapq.heappop(self._heap)
+                if self._stale(entry):
+                    continue
+                self.dispatched += 1
+                try:
+                    if entry[2] == None:
+                        entry[3]()
+                    else:
+                        entry[3]._fire(now)
+                except Exception:
+                    #one failing slot must not hold back the timers of the other syringes and rigs
+                    self.failures += 1
+                    logging.getLogger().exception('Error in a scheduled timer slot:')
+        finally:
+            self._rearm()
@@ -0,0 +1,157 @@
+import numpy as np
+
+#connection codes of the part a syringe is connected to through its T valve
+NOT_USED, RESEVOIR, WASTE, CELL_INLET, CELL_OUTLET = 0, 1, 2, 3, 4
+CONNECTION_CODES = {'not_used':NOT_USED, 'resevoir':RESEVOIR, 'waste':WASTE, 'cell_inlet':CELL_INLET, 'cell_outlet':CELL_OUTLET}
+
+#tolerance used for limit checking, in mL
+EPS = 1e-7
+
+class SyringeSimulator(object):
+    """Vectorized volume bookkeeping of num_rigs x num_syringes simulated syringes.
+
+    Syringe volumes live in (num_rigs, num_syringes) arrays, the resevoir volume is tracked
+    per syringe (like resevoir_volumn_S1..S4 in the widget) and waste/cell per rig. All units
+    are in mL, speeds in mL per tick (same as the GUI speed in demo mode).
+    step() moves every active syringe at once: the syringe volumes are clamped to their
+    [vmin, vmax] window, then the flows into waste/cell and out of cell/resevoir are scaled
+    down proportionally wherever a container would over- or underflow.
+    """
+    def __init__(self, num_rigs = 1, num_syringes = 4, syringe_size = 12.5, resevoir_total = 250, waste_total = 250, cell_total = 2):
+        self.num_rigs = num_rigs
+        self.num_syringes = num_syringes
+        shape = (num_rigs, num_syringes)
+        self.volume = np.zeros(shape)
+        self.vmin = np.zeros(shape)
+        self.vmax = np.full(shape, float(syringe_size))
+        #mL per tick, always positive, direction holds the sign (1: filling, -1: dispensing)
+        self.speed = np.zeros(shape)
+        self.direction = np.ones(shape)
+        self.connection = np.zeros(shape, dtype = int)
+        self.active = np.zeros(shape, dtype = bool)
+        self.resevoir = np.full(shape, float(resevoir_total))
+        self.waste = np.zeros(num_rigs)
+        self.cell = np.zeros(num_rigs)
+        self.resevoir_total = np.full(num_rigs, float(resevoir_total))
+        self.waste_total = np.full(num_rigs, float(waste_total))
+        self.cell_total = np.full(num_rigs, float(cell_total))
+        #True for the syringes whose motion was cut by a full/empty container in the last step
+        self.container_limited = np.zeros(shape, dtype = bool)
+        self.ticks = 0
+
+    def set_motion(self, rig, syringe, speed, direction, connection, vmin = None, vmax = None):
+        #syringe: 0 based column index
+        self.speed[rig, syringe] = abs(speed)
+        self.direction[rig, syringe] = direction
+        self.connection[rig, syringe] = CONNECTION_CODES[connection] if type(connection)==str else connection
+        if vmin != None:
+            self.vmin[rig, syringe] = vmin
+        if vmax != None:
+            self.vmax[rig, syringe] = vmax
+        self.active[rig, syringe] = True
+
+    def stop(self, rig = None):
+        if rig == None:
+            self.active[:] = False
+        else:
+            self.active[rig] = False
+
+    def invalid_connections(self):
+        #dispensing is only allowed to waste/cell_inlet, filling only from resevoir/cell_outlet/not_used
+        dispense_ok = np.isin(self.connection, [WASTE, CELL_INLET])
+        fill_ok = np.isin(self.connection, [RESEVOIR, CELL_OUTLET, NOT_USED])
+        return self.active & np.where(self.direction < 0, ~dispense_ok, ~fill_ok)
+
+    def at_limit(self):
+        #syringes that can not move any further in their current direction
+        return np.where(self.direction > 0, self.volume >= self.vmax - EPS, self.volume <= self.vmin + EPS)
+
+    def ticks_to_next_event(self):
+        #number of whole ticks until the first active syringe reaches its limit, None if nothing moves
+        moving = self.active & (self.speed > 0)
+        if not moving.any():
+            return None
+        room = np.where(self.direction > 0, self.vmax - self.volume, self.volume - self.vmin)
+        ticks = np.ceil(np.maximum(room[moving], 0)/self.speed[moving] - EPS)
+        return max(int(ticks.min()), 1)
+
+    def _scale(self, amount, room):
+        #proportional scaling factor so that amount does not exceed room
+        scale = np.ones_like(amount)
+        over = amount > room + EPS
+        scale[over] = np.maximum(room[over], 0)/amount[over]
+        return scale
+
+    def _advance(self, ticks):
+        moving = self.active & ~self.invalid_connections()
+        delta = np.where(moving, self.speed*self.direction*ticks, 0)
+        #syringe travel limits
+        delta = np.clip(self.volume + delta, self.vmin, self.vmax) - self.volume
+        dispensed = np.maximum(-delta, 0)
+        filled = np.maximum(delta, 0)
+        conn = self.connection
+        to_waste = np.where(conn == WASTE, dispensed, 0)
+        to_cell = np.where(conn == CELL_INLET, dispensed, 0)
+        from_cell = np.where(conn == CELL_OUTLET, filled, 0)
+        from_resevoir = np.where(conn == RESEVOIR, filled, 0)
+        scale = np.ones_like(delta)
+        #waste overflow
+        waste_scale = self._scale(to_waste.sum(axis = 1), self.waste_total - self.waste)
+        scale = np.where(conn == WASTE, scale*waste_scale[:, None], scale)
+        #cell overflow (net inflow too large) or underflow (net outflow too large)
+        cell_in, cell_out = to_cell.sum(axis = 1), from_cell.sum(axis = 1)
+        inlet_scale = self._scale(cell_in, self.cell_total - self.cell + cell_out)
+        outlet_scale = self._scale(cell_out, self.cell + cell_in)
+        scale = np.where(conn == CELL_INLET, scale*inlet_scale[:, None], scale)
+        scale = np.where(conn == CELL_OUTLET, scale*outlet_scale[:, None], scale)
+        #empty resevoir, per syringe
+        scale = np.where(conn == RESEVOIR, scale*self._scale(from_resevoir, self.resevoir), scale)
+        self.container_limited = moving & (scale < 1 - EPS)
+        delta = delta*scale
+        self.volume += delta
+        exchanged = (to_cell*scale).sum(axis = 1)
+        self.waste += (to_waste*scale).sum(axis = 1)
+        self.cell += exchanged - (from_cell*scale).sum(axis = 1)
+        self.resevoir -= from_resevoir*scale
+        #syringes stop at their limit or when the container cut their motion
+        self.active &= ~(self.at_limit() | self.container_limited)
+        self.ticks += ticks
+        return exchanged
+
+    def step(self, ticks = 1):
+        #advance ticks timer ticks, return the volume pushed into the cell per rig
+        #between two events the motion is linear, so it is integrated in one shot up to the next event
+        exchanged = np.zeros(self.num_rigs)
+        remaining = ticks
+        while remaining > 0:
+            next_event = self.ticks_to_next_event()
+            if next_event == None:
+                break
+            n = min(remaining, next_event)
+            exchanged += self._advance(n)
+            remaining -= n
+            if self.container_limited.any():
+                break
+        return exchanged
+
+    def load_from_widget(self, widget, rig = 0):
+        #copy the container and syringe volumes of a psd widget into the given rig
+        for i in range(self.num_syringes):
+            self.volume[rig, i] = getattr(widget, 'volume_syringe_{}'.format(i+1))
+            self.resevoir[rig, i] = getattr(widget, 'resevoir_volumn_S{}'.format(i+1))
+            self.vmax[rig, i] = widget.syringe_size
+        self.waste[rig] = widget.waste_volumn
+        self.cell[rig] = widget.volume_of_electrolyte_in_cell
+        self.resevoir_total[rig] = widget.resevoir_volumn_total
+        self.waste_total[rig] = widget.waste_volumn_total
+        self.cell_total[rig] = widget.cell_volume_in_total
+
+    def store_to_widget(self, widget, rig = 0, index_list = None):
+        #copy the volumes back, index_list (1 based) limits the syringes written
+        if index_list == None:
+            index_list = range(1, self.num_syringes+1)
+        for i in index_list:
+            setattr(widget, 'volume_syringe_{}'.format(i), float(self.volume[rig, i-1]))
+            setattr(widget, 'resevoir_volumn_S{}'.format(i), float(self.resevoir[rig, i-1]))
+        widget.waste_volumn = float(self.waste[rig])
+        widget.volume_of_electrolyte_in_cell = float(self.cell[rig])
@@ -0,0 +1,442 @@
+"""Device transport interface of the pump system and an in-process simulated implementation.
+
+The operation modes and the main window only use the part of the psdrive client API listed in
+the interface classes below (duck typed, the psdrive objects do not derive from them; a backend
+deriving from them must implement every method, or it cannot be created):
+
+    PumpClientTransport    psd.fromFile / psd.connect result: getSyringe, getValve, operations, configuration
+    SyringeTransport       client.getSyringe(id): volume, busy, valve, status, pickup/dispense/fill/drain
+    ValveTransport         client.getValve(id), the MVP valve: moveValve, busy, status
+    ExchangePairTransport  client.operations['Exchanger N']: pushSyr/pullSyr, swap, exchangeableVolume, exchange
+
+Volumes are in uL and rates in uL/s, as on the devices. SimulatedPumpClient implements the
+interface with a linear motion model in wall time and a configurable round trip latency (with
+random jitter) on every device access, so the real (demo = False) code paths, the device poller
+and the command batches can be run and benchmarked without Tango or a serial port:
+
+    client = SimulatedPumpClient(latency = 0.005, jitter = 0.002)
+    syringe = client.getSyringe(1)
+    syringe.valve = 'left'
+    syringe.pickup(500, 200)
+"""
+import copy
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+
+#a broken link to the pump server: socket and serial port errors (ConnectionError, TimeoutError and
+#serial.SerialException are all OSError), see connection_errors() for the Tango ones
+CONNECTION_ERRORS = (OSError,)
+
+def connection_errors():
+    #exception types of a lost pump client session, with the Tango errors when PyTango (psdrive) is installed
+    try:
+        import tango
+    except ImportError:
+        return CONNECTION_ERRORS
+    return CONNECTION_ERRORS + (tango.ConnectionFailed, tango.CommunicationFailed)
+
+#ms between two busy flag polls of the device poller, for a pump client without a busy_interval of its own
+BUSY_INTERVAL = 50
+
+def busy_interval(client):
+    #busy flag polling interval in ms the pump client (server link) is meant to take
+    return getattr(client, 'busy_interval', BUSY_INTERVAL)
+
+class DeviceStatusItem(object):
+    #entry of a device status dict, statuscode 0 means no error
+    def __init__(self, statuscode = 0, text = 'ready'):
+        self.statuscode = statuscode
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+class SyringeTransport(ABC):
+    """Syringe pump with its T valve. volume in uL, valve is the position name set with
+    setValvePosName, status is {'syringe': DeviceStatusItem, 'valve': DeviceStatusItem}."""
+    deviceId = None
+
+    @property
+    @abstractmethod
+    def volume(self):
+        """volume in the syringe, uL"""
+
+    @property
+    @abstractmethod
+    def busy(self):
+        """True while the plunger or the T valve moves"""
+
+    @property
+    @abstractmethod
+    def valve(self):
+        """position name of the T valve"""
+
+    @valve.setter
+    @abstractmethod
+    def valve(self, position):
+        """turn the T valve to a position name"""
+
+    @property
+    @abstractmethod
+    def status(self):
+        """{'syringe': DeviceStatusItem, 'valve': DeviceStatusItem}"""
+
+    @abstractmethod
+    def setValvePosName(self, position, name):
+        """name the T valve position number position"""
+
+    @abstractmethod
+    def initSyringe(self, valve, rate):
+        """empty the syringe through valve position valve"""
+
+    @abstractmethod
+    def fill(self, rate):
+        """pick up to the full syringe size"""
+
+    @abstractmethod
+    def drain(self, rate):
+        """dispense everything"""
+
+    @abstractmethod
+    def pickup(self, volume, rate):
+        """pick up volume uL at rate uL/s"""
+
+    @abstractmethod
+    def dispense(self, volume, rate):
+        """dispense volume uL at rate uL/s"""
+
+    @abstractmethod
+    def stop(self):
+        """stop the running motion"""
+
+    @abstractmethod
+    def join(self):
+        """return when the running motion has finished"""
+
+    def onMotionFinished(self, callback):
+        """optional completion event: call callback() (from any thread) whenever a motion finishes or
+        is stopped, return False if the backend has none (busy has to be polled then)"""
+        return False
+
+class ValveTransport(ABC):
+    """Multi port (MVP) valve, status is {'valve': DeviceStatusItem}."""
+    @property
+    @abstractmethod
+    def busy(self):
+        """True while the valve turns"""
+
+    @property
+    @abstractmethod
+    def status(self):
+        """{'valve': DeviceStatusItem}"""
+
+    @abstractmethod
+    def initValve(self):
+        """move to channel 1"""
+
+    @abstractmethod
+    def moveValve(self, channel):
+        """start turning to channel"""
+
+    @abstractmethod
+    def join(self):
+        """return when the valve has reached its channel"""
+
+    def onMotionFinished(self, callback):
+        """optional completion event, as SyringeTransport.onMotionFinished"""
+        return False
+
+class ExchangePairTransport(ABC):
+    """Two syringes exchanging the cell volume, pushSyr dispenses to the cell while pullSyr picks up."""
+    pushSyr = None
+    pullSyr = None
+
+    @property
+    @abstractmethod
+    def exchangeableVolume(self):
+        """volume in uL the pair can exchange before one syringe is empty or full"""
+
+    @abstractmethod
+    def swap(self):
+        """exchange the roles of pushSyr and pullSyr"""
+
+    @abstractmethod
+    def exchange(self, volume, rate):
+        """push and pull volume uL at rate uL/s at the same time"""
+
+class PumpClientTransport(ABC):
+    """Entry point to the pump devices, operations maps 'Exchanger N' to ExchangePairTransport."""
+    operations = {}
+    #ms between two busy flag polls of the device poller
+    busy_interval = BUSY_INTERVAL
+
+    @property
+    @abstractmethod
+    def configuration(self):
+        """configuration dict of the pump server, a copy"""
+
+    @configuration.setter
+    @abstractmethod
+    def configuration(self, config):
+        """replace the configuration dict of the pump server"""
+
+    @abstractmethod
+    def readConfigfile(self, config_file):
+        """load the device configuration file"""
+
+    @abstractmethod
+    def getSyringe(self, device_id):
+        """SyringeTransport at address device_id"""
+
+    @abstractmethod
+    def getValve(self, device_id):
+        """ValveTransport at address device_id"""
+
+    @abstractmethod
+    def stop(self):
+        """stop all devices"""
+
+class Latency(object):
+    #simulated round trip to the pump server, in s
+    def __init__(self, latency = 0.0, jitter = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+
+    def wait(self):
+        self.calls += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+class SimulatedSyringe(SyringeTransport):
+    """Syringe/T valve with a linear motion model in wall time. Volumes in uL, rates in uL/s."""
+    def __init__(self, device_id, latency, size = 12500, volume = 0):
+        self.deviceId = device_id
+        self._latency = latency
+        self.size = size
+        self._volume = volume
+        self._target = volume
+        self._rate = 0
+        self._t0 = time.time()
+        self._valve = 2
+        #valve position number <-> name, set by setValvePosName
+        self._valve_names = {}
+        #the device poller thread and the GUI thread read and move the same syringe
+        self._lock = threading.RLock()
+        #completion event: callbacks and the timer of the running motion
+        self._finished_callbacks = []
+        self._finish_timer = None
+
+    def _now_volume(self):
+        elapsed = time.time() - self._t0
+        if self._target >= self._volume:
+            return min(self._target, self._volume + self._rate*elapsed)
+        return max(self._target, self._volume - self._rate*elapsed)
+
+    def _move_to(self, target, rate):
+        with self._lock:
+            self._volume = self._now_volume()
+            self._target = max(0, min(self.size, target))
+            self._rate = abs(rate)
+            self._t0 = time.time()
+            interrupted = self._finish_timer != None and self._finish_timer.is_alive()
+            if self._finish_timer != None:
+                self._finish_timer.cancel()
+                self._finish_timer = None
+            if self._rate > 0 and abs(self._target - self._volume) > 1e-6:
+                self._finish_timer = threading.Timer(abs(self._target - self._volume)/self._rate, self._finished)
+                self._finish_timer.daemon = True
+                self._finish_timer.start()
+            elif interrupted:
+                #stopped before the end of the motion
+                self._finished()
+
+    def _finished(self):
+        for callback in list(self._finished_callbacks):
+            callback()
+
+    def onMotionFinished(self, callback):
+        self._finished_callbacks.append(callback)
+        return True
+
+    def _moving(self):
+        return abs(self._now_volume() - self._target) > 1e-6
+
+    @property
+    def volume(self):
+        self._latency.wait()
+        return self._now_volume()
+
+    @property
+    def busy(self):
+        self._latency.wait()
+        return self._moving()
+
+    @property
+    def valve(self):
+        self._latency.wait()
+        return self._valve_names.get(self._valve, self._valve)
+
+    @valve.setter
+    def valve(self, position):
+        self._latency.wait()
+        for number, name in self._valve_names.items():
+            if name == position:
+                position = number
+        self._valve = position
+
+    @property
+    def status(self):
+        self._latency.wait()
+        return {'syringe': DeviceStatusItem(0, ['ready', 'moving'][int(self._moving())]), 'valve': DeviceStatusItem(0, 'ready')}
+
+    def setValvePosName(self, position, name):
+        self._valve_names[position] = name
+
+    def initSyringe(self, valve, rate):
+        #empty the syringe through valve position valve
+        self._latency.wait()
+        self._valve = valve
+        self._move_to(0, rate)
+
+    def fill(self, rate):
+        self._latency.wait()
+        self._move_to(self.size, rate)
+
+    def drain(self, rate):
+        self._latency.wait()
+        self._move_to(0, rate)
+
+    def pickup(self, volume, rate):
+        self._latency.wait()
+        self._move_to(self._now_volume() + volume, rate)
+
+    def dispense(self, volume, rate):
+        self._latency.wait()
+        self._move_to(self._now_volume() - volume, rate)
+
+    def stop(self):
+        self._latency.wait()
+        self._move_to(self._now_volume(), 0)
+
+    def join(self):
+        self._latency.wait()
+        while self._moving():
+            time.sleep(min(0.01, abs(self._target - self._now_volume())/max(self._rate, 1e-9)))
+
+class SimulatedValve(ValveTransport):
+    """MVP valve taking move_time s per channel move, busy until the move has finished."""
+    def __init__(self, latency, channel = 1, move_time = 0.2):
+        self._latency = latency
+        self.channel = channel
+        self.move_time = move_time
+        #time.time() when the running move finishes
+        self._done = 0
+        self._finished_callbacks = []
+
+    def _move(self, channel):
+        if channel != self.channel:
+            self._done = time.time() + self.move_time
+            timer = threading.Timer(self.move_time, self._finished)
+            timer.daemon = True
+            timer.start()
+        self.channel = channel
+
+    def _finished(self):
+        if not self._moving():
+            for callback in list(self._finished_callbacks):
+                callback()
+
+    def onMotionFinished(self, callback):
+        self._finished_callbacks.append(callback)
+        return True
+
+    def _moving(self):
+        return time.time() < self._done
+
+    def initValve(self):
+        self._latency.wait()
+        self._move(1)
+
+    def moveValve(self, channel):
+        self._latency.wait()
+        self._move(channel)
+
+    def join(self):
+        self._latency.wait()
+        time.sleep(max(0, self._done - time.time()))
+
+    @property
+    def busy(self):
+        self._latency.wait()
+        return self._moving()
+
+    @property
+    def status(self):
+        self._latency.wait()
+        return {'valve': DeviceStatusItem(0, ['ready', 'moving'][int(self._moving())])}
+
+class SimulatedExchangePair(ExchangePairTransport):
+    def __init__(self, push_syringe, pull_syringe, latency):
+        self.pushSyr = push_syringe
+        self.pullSyr = pull_syringe
+        self._latency = latency
+
+    def swap(self):
+        self._latency.wait()
+        self.pushSyr, self.pullSyr = self.pullSyr, self.pushSyr
+
+    @property
+    def exchangeableVolume(self):
+        self._latency.wait()
+        return min(self.pushSyr._now_volume(), self.pullSyr.size - self.pullSyr._now_volume())
+
+    def exchange(self, volume, rate):
+        self._latency.wait()
+        self.pushSyr._move_to(self.pushSyr._now_volume() - volume, rate)
+        self.pullSyr._move_to(self.pullSyr._now_volume() + volume, rate)
+
+class SimulatedPumpClient(PumpClientTransport):
+    """In-process stand-in for the psdrive client.
+
+    Device ids follow the hardware set up used by MyMainWindow.init_server_devices: syringes
+    1 to 4, the MVP valve 5, 'Exchanger 1' pairs syringes 2 and 1 (S2/S4 in the GUI) and
+    'Exchanger 2' pairs syringes 4 and 3 (S1/S3 in the GUI). volumes maps device id to the
+    initial syringe volume in uL.
+    """
+    def __init__(self, latency = 0.0, jitter = 0.0, syringe_size = 12500, volumes = None, mvp_id = 5, busy_interval = BUSY_INTERVAL):
+        self.latency = Latency(latency, jitter)
+        self.busy_interval = busy_interval
+        volumes = volumes or {}
+        self._syringes = {i: SimulatedSyringe(i, self.latency, size = syringe_size, volume = volumes.get(i, 0)) for i in [1,2,3,4]}
+        self._valves = {mvp_id: SimulatedValve(self.latency)}
+        self.operations = {'Exchanger 1': SimulatedExchangePair(self._syringes[2], self._syringes[1], self.latency),
+                           'Exchanger 2': SimulatedExchangePair(self._syringes[4], self._syringes[3], self.latency)}
+        self._configuration = {'psd_widget': {}}
+
+    @property
+    def configuration(self):
+        self.latency.wait()
+        return copy.deepcopy(self._configuration)
+
+    @configuration.setter
+    def configuration(self, config):
+        self.latency.wait()
+        self._configuration = copy.deepcopy(config)
+
+    def readConfigfile(self, config_file):
+        pass
+
+    def getSyringe(self, device_id):
+        return self._syringes[device_id]
+
+    def getValve(self, device_id):
+        return self._valves[device_id]
+
+    def stop(self):
+        self.latency.wait()
+        for syringe in self._syringes.values():
+            syringe._move_to(syringe._now_volume(), 0)
@@ -0,0 +1,176 @@
+import heapq
+import itertools
+
+class VirtualSignal(object):
+    #minimal stand-in for a pyqtSignal: connect/disconnect/emit, shared by VirtualTimer and ScheduledTimer
+    def __init__(self):
+        self._slots = []
+
+    def connect(self, slot):
+        self._slots.append(slot)
+
+    def disconnect(self, slot = None):
+        if slot == None:
+            self._slots = []
+        else:
+            self._slots.remove(slot)
+
+    def emit(self, *args):
+        for slot in list(self._slots):
+            slot(*args)
+
+class VirtualTimer(object):
+    """Duck-typed QTimer running on a VirtualClock instead of the Qt event loop.
+
+    Supports the subset of the QTimer API used by the operation modes: timeout.connect,
+    start([msec]), stop(), isActive(), setInterval(), interval() and setSingleShot().
+    """
+    def __init__(self, clock, parent = None):
+        self.clock = clock
+        self.timeout = VirtualSignal()
+        self._interval = 0
+        self._single_shot = False
+        self._active = False
+        #time (ms) of the next timeout
+        self.next_fire = None
+        clock.register(self)
+
+    def start(self, msec = None):
+        if msec != None:
+            self._interval = msec
+        self._active = True
+        self.next_fire = self.clock.now + self._interval
+
+    def stop(self):
+        self._active = False
+        self.next_fire = None
+
+    def isActive(self):
+        return self._active
+
+    def setInterval(self, msec):
+        self._interval = msec
+
+    def interval(self):
+        return self._interval
+
+    def setSingleShot(self, single_shot):
+        self._single_shot = single_shot
+
+    def isSingleShot(self):
+        return self._single_shot
+
+    def _fire(self):
+        if self._single_shot:
+            self.stop()
+        else:
+            self.next_fire = self.clock.now + max(self._interval, 1)
+        self.timeout.emit()
+
+class VirtualClock(object):
+    """Discrete-event scheduler for running the operation modes without a Qt event loop.
+
+    Time is kept in ms. run() jumps from one timer timeout or call_later event to the next
+    instead of waiting for it. When exactly one periodic timer is active and a fast-forward
+    hook is registered, the hook is asked how many timeouts can be skipped (eg. up to the
+    next syringe reaching its limit) and those are integrated in one call.
+    """
+    def __init__(self):
+        self.now = 0
+        self.timers = []
+        self._events = []
+        self._counter = itertools.count()
+        #(horizon, advance): horizon() -> number of timeouts that can be skipped, advance(n) skips them
+        self._fast_forward = None
+        self.fired = 0
+        self.skipped = 0
+
+    def register(self, timer):
+        self.timers.append(timer)
+
+    def timer(self):
+        return VirtualTimer(self)
+
+    def time(self):
+        #seconds, drop-in for time.time
+        return self.now/1000.
+
+    def call_later(self, msec, callback):
+        heapq.heappush(self._events, (self.now + msec, next(self._counter), callback))
+
+    def set_fast_forward(self, horizon, advance):
+        self._fast_forward = (horizon, advance)
+
+    def clear_fast_forward(self):
+        self._fast_forward = None
+
+    def active_timers(self):
+        return [each for each in self.timers if each.isActive()]
+
+    def _next(self):
+        #earliest pending (time, kind, item), kind is 'timer' or 'event'
+        candidates = []
+        active = self.active_timers()
+        if len(active)!=0:
+            timer = min(active, key = lambda each: each.next_fire)
+            candidates.append((timer.next_fire, 'timer', timer))
+        if len(self._events)!=0:
+            candidates.append((self._events[0][0], 'event', None))
+        if len(candidates)==0:
+            return None
+        return min(candidates, key = lambda each: (each[0], each[1]=='timer'))
+
+    def _try_fast_forward(self, timer):
+        if self._fast_forward == None or timer.isSingleShot():
+            return
+        if len(self.active_timers())!=1:
+            return
+        horizon, advance = self._fast_forward
+        skip = horizon()
+        if skip == None or skip < 1:
+            return
+        if len(self._events)!=0:
+            #never jump over a pending call_later event
+            skip = min(skip, int((self._events[0][0] - timer.next_fire)//max(timer.interval(), 1)))
+            if skip < 1:
+                return
+        advance(skip)
+        self.now = timer.next_fire + (skip - 1)*max(timer.interval(), 1)
+        timer.next_fire = self.now + max(timer.interval(), 1)
+        self.skipped += skip
+
+    def step(self):
+        #process one event, return False if nothing is left to do
+        item = self._next()
+        if item == None:
+            return False
+        when, kind, timer = item
+        if kind == 'event':
+            when, _, callback = heapq.heappop(self._events)
+            self.now = max(self.now, when)
+            callback()
+        else:
+            self._try_fast_forward(timer)
+            self.now = max(self.now, timer.next_fire)
+            timer._fire()
+            self.fired += 1
+        return True
+
+    def run(self, duration = None, until = None, max_events = None):
+        #duration in ms of simulated time, until: callable returning True to stop
+        end = None if duration == None else self.now + duration
+        count = 0
+        while True:
+            if until != None and until():
+                break
+            if max_events != None and count >= max_events:
+                break
+            item = self._next()
+            if item == None:
+                break
+            if end != None and item[0] > end:
+                self.now = end
+                break
+            self.step()
+            count += 1
+        return count
@@ -0,0 +1,117 @@
+import json
+import queue
+import struct
+import threading
+import time
+import numpy as np
+
+#file layout: MAGIC, uint32 header length, JSON header, then fixed size records (RECORD_DTYPE) appended chunk by chunk
+MAGIC = b'PSDLOG1\n'
+FILE_EXTENSION = '.psdlog'
+
+VALVE_CODES = {'left':0, 'up':1, 'right':2}
+#any other status string (eg. an error message from the device) is stored as 'error'
+STATUS_CODES = {'ready':0, 'moving':1, 'disconnected':2, 'error':3}
+MODE_CODES = {'not_ready_mode':0, 'init_mode':1, 'normal_mode':2, 'simple_exchange_mode':3, 'pre_auto_refilling':4,
+              'auto_refilling':5, 'autorefilling_mode':6, 'fill_cell_mode':7, 'clean_mode':8, 'other':9}
+
+RECORD_DTYPE = np.dtype([('t', '<f8'),
+                         ('volume_syringe_1', '<f4'), ('volume_syringe_2', '<f4'), ('volume_syringe_3', '<f4'), ('volume_syringe_4', '<f4'),
+                         ('cell', '<f4'), ('waste', '<f4'), ('resevoir', '<f4'),
+                         ('resevoir_S1', '<f4'), ('resevoir_S2', '<f4'), ('resevoir_S3', '<f4'), ('resevoir_S4', '<f4'),
+                         ('exchange_amount', '<f4'),
+                         ('valve_1', 'i1'), ('valve_2', 'i1'), ('valve_3', 'i1'), ('valve_4', 'i1'),
+                         ('status_1', 'i1'), ('status_2', 'i1'), ('status_3', 'i1'), ('status_4', 'i1'), ('status_mvp', 'i1'),
+                         ('mvp_channel', 'i1'), ('operation_mode', 'i1')])
+
+def _status_code(status):
+    return STATUS_CODES.get(status, STATUS_CODES['error'])
+
+def write_header(f, meta = None):
+    header = {'dtype': RECORD_DTYPE.descr,
+              'valve_codes': VALVE_CODES,
+              'status_codes': STATUS_CODES,
+              'mode_codes': MODE_CODES,
+              'created': time.time(),
+              'meta': meta or {}}
+    payload = json.dumps(header).encode('utf-8')
+    f.write(MAGIC)
+    f.write(struct.pack('<I', len(payload)))
+    f.write(payload)
+
+class VolumeRecorder(object):
+    """Sample the pump diagram state every tick and stream it to an append-only .psdlog file.
+
+    Samples go into a preallocated chunk of chunk_size records. A full chunk is handed to a
+    writer thread and the next free chunk is taken from a small pool, so sample() never waits
+    for the disk. The file is a JSON header followed by raw fixed size records, it is only ever
+    appended to and can be memory mapped for reading (see recording.replay).
+    """
+    def __init__(self, path, chunk_size = 4096, num_chunks = 2, meta = None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._file = open(path, 'wb')
+        write_header(self._file, meta)
+        self._file.flush()
+        self._free = queue.Queue()
+        for i in range(num_chunks):
+            self._free.put(np.zeros(chunk_size, dtype = RECORD_DTYPE))
+        self._pending = queue.Queue()
+        self._chunk = self._free.get()
+        self._n = 0
+        self.samples = 0
+        self.dropped_chunks = 0
+        self._writer = threading.Thread(target = self._write_loop, name = 'psd_recorder', daemon = True)
+        self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            if item == None:
+                break
+            chunk, n = item
+            self._file.write(chunk[:n].tobytes())
+            self._file.flush()
+            self._free.put(chunk)
+
+    def _next_chunk(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            #the writer lags behind, grow the pool rather than blocking the caller
+            self.dropped_chunks += 1
+            return np.zeros(self.chunk_size, dtype = RECORD_DTYPE)
+
+    def sample(self, widget, exchange_amount = 0, t = None):
+        row = self._chunk[self._n]
+        row['t'] = time.time() if t == None else t
+        for i in [1,2,3,4]:
+            row['volume_syringe_{}'.format(i)] = getattr(widget, 'volume_syringe_{}'.format(i))
+            row['resevoir_S{}'.format(i)] = getattr(widget, 'resevoir_volumn_S{}'.format(i), 0)
+            row['valve_{}'.format(i)] = VALVE_CODES.get(widget.connect_valve_port[i], -1)
+            row['status_{}'.format(i)] = _status_code(widget.connect_status[i])
+        row['cell'] = widget.volume_of_electrolyte_in_cell
+        row['waste'] = widget.waste_volumn
+        row['resevoir'] = widget.resevoir_volumn
+        row['exchange_amount'] = exchange_amount
+        row['status_mvp'] = _status_code(widget.connect_status['mvp'])
+        row['mvp_channel'] = widget.mvp_channel
+        row['operation_mode'] = MODE_CODES.get(widget.operation_mode, MODE_CODES['other'])
+        self._n += 1
+        self.samples += 1
+        if self._n == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        #hand the current (possibly partial) chunk to the writer thread
+        if self._n == 0:
+            return
+        self._pending.put((self._chunk, self._n))
+        self._chunk = self._next_chunk()
+        self._n = 0
+
+    def close(self):
+        self.flush()
+        self._pending.put(None)
+        self._writer.join()
+        self._file.close()
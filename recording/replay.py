@@ -0,0 +1,164 @@
+import json
+import struct
+import os
+import numpy as np
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QSlider, QLabel, QPushButton, QComboBox
+from PyQt5.QtCore import Qt, QTimer
+from datetime import datetime
+from recording.recorder import MAGIC, RECORD_DTYPE
+from syringe_widget import syringe_widget
+
+class PsdLog(object):
+    """Read-only view of a .psdlog file written by VolumeRecorder.
+
+    The records are memory mapped, so opening a multi-day log only parses the header; pages are
+    read from disk when a frame is accessed. Timestamps are monotonic, seeking is a binary search
+    on the t column (index_at) instead of a scan. A trailing partial record (file still being
+    written) is ignored, call reload() to pick up records appended since opening.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError('{} is not a psd log file'.format(path))
+            length = struct.unpack('<I', f.read(4))[0]
+            self.header = json.loads(f.read(length).decode('utf-8'))
+        self.offset = len(MAGIC) + 4 + length
+        self.dtype = np.dtype([tuple(each) for each in self.header['dtype']])
+        if self.dtype != RECORD_DTYPE:
+            raise ValueError('unsupported record layout in {}'.format(path))
+        self.meta = self.header.get('meta', {})
+        #inverse code tables to turn the stored codes back into the widget strings
+        self.valve_names = {v:k for k, v in self.header['valve_codes'].items()}
+        self.status_names = {v:k for k, v in self.header['status_codes'].items()}
+        self.mode_names = {v:k for k, v in self.header['mode_codes'].items()}
+        self.records = None
+        self.reload()
+
+    def reload(self):
+        num_records = (os.path.getsize(self.path) - self.offset)//self.dtype.itemsize
+        if num_records<=0:
+            self.records = np.zeros(0, dtype = self.dtype)
+        else:
+            self.records = np.memmap(self.path, dtype = self.dtype, mode = 'r', offset = self.offset, shape = (num_records,))
+        self.t = self.records['t']
+        return len(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def time_range(self):
+        if len(self)==0:
+            return (0, 0)
+        return (float(self.t[0]), float(self.t[-1]))
+
+    def index_at(self, t):
+        #index of the last record taken at or before t
+        if len(self)==0:
+            return None
+        return int(max(0, min(len(self)-1, np.searchsorted(self.t, t, side = 'right')-1)))
+
+    def frame(self, index):
+        return self.records[index]
+
+    def apply_to_widget(self, widget, index):
+        #write the recorded state of frame index into a syringe_widget (or syringe_state)
+        row = self.records[index]
+        for i in [1,2,3,4]:
+            setattr(widget, 'volume_syringe_{}'.format(i), float(row['volume_syringe_{}'.format(i)]))
+            setattr(widget, 'resevoir_volumn_S{}'.format(i), float(row['resevoir_S{}'.format(i)]))
+            widget.connect_valve_port[i] = self.valve_names.get(int(row['valve_{}'.format(i)]), 'up')
+            widget.connect_status[i] = self.status_names.get(int(row['status_{}'.format(i)]), 'error')
+        widget.connect_status['mvp'] = self.status_names.get(int(row['status_mvp']), 'error')
+        widget.volume_of_electrolyte_in_cell = float(row['cell'])
+        widget.waste_volumn = float(row['waste'])
+        widget.resevoir_volumn = float(row['resevoir'])
+        widget.mvp_channel = int(row['mvp_channel'])
+        mode = self.mode_names.get(int(row['operation_mode']), 'other')
+        #modes without their own drawing rules are shown with all tube lines
+        widget.operation_mode = mode if mode!='other' else 'auto_refilling'
+        widget.update()
+        return row
+
+class ReplayDialog(QDialog):
+    """Scrub through a recorded run in a syringe_widget.
+
+    The slider position is a time (in 0.1 s steps from the first record), each move looks up the
+    frame with PsdLog.index_at and repaints the widget with the recorded state. Play advances the
+    time at the selected speed factor.
+    """
+    SPEEDS = [1, 10, 60, 600, 3600]
+
+    def __init__(self, path, parent = None, pump_settings = None, max_fps = 15):
+        super().__init__(parent)
+        self.log = PsdLog(path)
+        self.setWindowTitle('Replay {}'.format(os.path.basename(path)))
+        self.resize(900, 700)
+        self.widget_psd = syringe_widget(self)
+        self.widget_psd.set_max_fps(max_fps)
+        self.widget_psd.pump_settings = pump_settings if pump_settings!=None else self.log.meta['pump_settings']
+        self.widget_psd.set_resevoir_volumes()
+        self.slider = QSlider(Qt.Horizontal, self)
+        self.label_time = QLabel(self)
+        self.label_info = QLabel(self)
+        self.pushButton_play = QPushButton('Play', self)
+        self.comboBox_speed = QComboBox(self)
+        self.comboBox_speed.addItems(['x{}'.format(each) for each in self.SPEEDS])
+        self.pushButton_reload = QPushButton('Reload', self)
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.pushButton_play)
+        controls.addWidget(self.comboBox_speed)
+        controls.addWidget(self.slider, 1)
+        controls.addWidget(self.label_time)
+        controls.addWidget(self.pushButton_reload)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.widget_psd, 1)
+        layout.addLayout(controls)
+        layout.addWidget(self.label_info)
+
+        self.timer_play = QTimer(self)
+        self.timer_play.timeout.connect(self.play_step)
+        self.play_interval = 100
+        self.slider.valueChanged.connect(self.show_time)
+        self.pushButton_play.clicked.connect(self.toggle_play)
+        self.pushButton_reload.clicked.connect(self.reload)
+        self.reload()
+
+    def reload(self):
+        self.log.reload()
+        t0, t1 = self.log.time_range()
+        self.t0 = t0
+        self.slider.setRange(0, int((t1 - t0)*10))
+        self.show_time(self.slider.value())
+
+    def show_time(self, value):
+        if len(self.log)==0:
+            self.label_info.setText('empty log')
+            return
+        t = self.t0 + value/10.
+        index = self.log.index_at(t)
+        row = self.log.apply_to_widget(self.widget_psd, index)
+        self.label_time.setText(datetime.fromtimestamp(float(row['t'])).strftime('%Y-%m-%d %H:%M:%S'))
+        self.label_info.setText('frame {}/{}, mode: {}, exchanged: {:.3f} ml'.format(index+1, len(self.log), self.widget_psd.operation_mode, float(row['exchange_amount'])))
+
+    def toggle_play(self):
+        if self.timer_play.isActive():
+            self.timer_play.stop()
+            self.pushButton_play.setText('Play')
+        else:
+            self.timer_play.start(self.play_interval)
+            self.pushButton_play.setText('Pause')
+
+    def play_step(self):
+        speed = self.SPEEDS[self.comboBox_speed.currentIndex()]
+        value = self.slider.value() + int(round(self.play_interval/100.*speed))
+        if value >= self.slider.maximum():
+            value = self.slider.maximum()
+            self.toggle_play()
+        self.slider.setValue(value)
+
+    def closeEvent(self, event):
+        self.timer_play.stop()
+        event.accept()
@@ -1,15 +1,23 @@
 from PyQt5.QtWidgets import QWidget, QApplication
-from PyQt5.QtGui import QPainter, QPainterPath, QColor, QBrush, QFont, QPen
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QPainter, QPainterPath, QColor, QBrush, QFont, QPen, QPixmap
+from PyQt5.QtCore import Qt, QTimer, QRect
 import sys
+import copy
 import numpy as np
 import time
 
 font_size = 10.5
+#fill color of each syringe
+SYRINGE_COLORS = {1:[250,0,0], 2:[100,100,0], 3:[0,200,0], 4:[0,100,250]}
 
-class syringe_widget(QWidget):
-    def __init__(self,parent=None):
-        super().__init__(parent)
+class syringe_state(object):
+    """Pump diagram state (volumes, valve positions, statuses, mode) without any drawing.
+
+    syringe_widget paints this state; headless runs of the operation modes use it directly.
+    """
+    def init_state(self):
+        #GUI indices of the syringes of the rig shown, one diagram position each (at most 4)
+        self.syringe_indices = [1,2,3,4]
         self.global_offset_h = 0
         self.global_offset_v = 0
         self.mvp_detachment_status = False
@@ -105,6 +113,15 @@ class syringe_widget(QWidget):
         #the height in the drawing of resevior/waste bottle
         self.bottom_height_total = 150
 
+    def copy_state(self, source):
+        #take over the pump diagram state of another syringe_state, the drawing caches are kept
+        probe = syringe_state()
+        probe.init_state()
+        names = list(probe.__dict__) + [name for name in source.__dict__ if name.startswith('resevoir_volumn_S')]
+        for name in names:
+            if hasattr(source, name):
+                setattr(self, name, copy.deepcopy(getattr(source, name)))
+
     def attach_mvp(self):
         self.mvp_detachment_status = False
         self.global_offset_h = 0
@@ -145,7 +162,7 @@ class syringe_widget(QWidget):
         return None
 
     def get_syringe_mvp_cell_inlet_channel(self):
-        line_index = [1,2,3,4]
+        line_index = list(self.syringe_indices)
         if self.operation_mode == 'simple_exchange_mode':
             line_index = [self.actived_left_syringe_simple_exchange_mode,self.actived_right_syringe_simple_exchange_mode]
         elif self.operation_mode == 'init_mode':
@@ -174,7 +191,7 @@ class syringe_widget(QWidget):
         self.resevoir_volumn = self.resevoir_volumn_S1
 
     def set_resevoir_volumes(self):
-        for tag in ['S1','S2','S3','S4']:
+        for tag in ['S{}'.format(i) for i in self.syringe_indices]:
             vol = self.pump_settings['{}_volume'.format(tag)]
             if vol == None:
                 vol = 0
@@ -184,11 +201,6 @@ class syringe_widget(QWidget):
     def get_syringe_index_mvp_connection(self):
         return int(''.join(self.mvp_connected_valve.rsplit('_')[0][1:]))
 
-    def initUI(self):
-        self.setGeometry(300, 300, 350, 400)
-        self.setWindowTitle('Colours')
-        self.show()
-
     def _get_directions(self, part = 'cell_inlet'):
         mapping = {'cell_inlet': 'left',
                    'cell_outlet': 'right',
@@ -196,78 +208,219 @@ class syringe_widget(QWidget):
                    'waste': 'up'}
         return mapping[part]
 
+    def update(self):
+        #nothing to repaint without a widget, syringe_widget schedules a frame
+        pass
+
+    def set_max_fps(self, max_fps):
+        self.max_fps = max_fps
+
+class syringe_widget(QWidget, syringe_state):
+    def __init__(self,parent=None):
+        super().__init__(parent)
+        self.init_state()
+        #cached layers of the pump diagram, see paintEvent
+        self._static_key = None
+        self._static_layer = None
+        self._overlay_layer = None
+        self._layout = {}
+        #update() only schedules a frame, the frame timer coalesces all requests of one frame
+        #and invalidates the regions whose state changed (see _flush_frame)
+        self._frame_timer = QTimer(self)
+        self._frame_timer.setSingleShot(True)
+        self._frame_timer.timeout.connect(self._flush_frame)
+        self._last_frame = 0
+        self._last_full_frame = 0
+        self._painted_state = None
+        #the dashed flow lines toggle their style on every full repaint to show the motion
+        self.line_animation_interval = 0.5
+        self.set_max_fps(30)
+
+    def set_max_fps(self, max_fps):
+        #upper limit of repaints per second, lower it for remote or replay viewers
+        self.max_fps = max_fps
+        self.frame_interval = 1./max_fps
+
+    def update(self, *args):
+        if len(args)!=0:
+            QWidget.update(self, *args)
+            return
+        if not self._frame_timer.isActive():
+            wait = self.frame_interval - (time.time() - self._last_frame)
+            self._frame_timer.start(max(0, int(wait*1000)))
+
+    def repaint_all(self):
+        #invalidate the whole widget at the next frame
+        self._painted_state = None
+        self.update()
+
+    def _region_states(self):
+        states = {'syringe_{}'.format(i):(getattr(self, 'volume_syringe_{}'.format(i)), self.connect_status[i]) for i in self.syringe_indices}
+        states['resevoir'] = (self.resevoir_volumn,) + tuple([getattr(self, 'resevoir_volumn_S{}'.format(i), 0) for i in self.syringe_indices])
+        states['waste'] = self.waste_volumn
+        states['cell'] = (self.volume_of_electrolyte_in_cell, self.mvp_channel, self.connect_status['mvp'])
+        #anything that moves the flow lines needs a full repaint
+        states['lines'] = (tuple(self.connect_valve_port.items()), self.operation_mode, self.mvp_detachment_status,
+                           self.actived_left_syringe_simple_exchange_mode, self.actived_right_syringe_simple_exchange_mode,
+                           self.actived_pulling_syringe_init_mode, self.actived_pushing_syringe_init_mode,
+                           self.actived_syringe_normal_mode, self.actived_syringe_fill_cell_mode)
+        return states
+
+    def _flush_frame(self):
+        now = time.time()
+        self._last_frame = now
+        states = self._region_states()
+        previous, self._painted_state = self._painted_state, states
+        moving = 'moving' in [self.connect_status[i] for i in self.syringe_indices]
+        if previous == None or len(self._layout)==0 or self._static_layer_key() != self._static_key \
+           or states['lines'] != previous['lines'] or (moving and now - self._last_full_frame > self.line_animation_interval):
+            self._last_full_frame = now
+            QWidget.update(self)
+            return
+        for name, state in states.items():
+            if state != previous[name]:
+                QWidget.update(self, self._layout['regions'][name])
+
+    def initUI(self):
+        self.setGeometry(300, 300, 350, 400)
+        self.setWindowTitle('Colours')
+        self.show()
+
     def paintEvent(self, e):
+        bounds = self._left_bounds()
+        if self.mvp_detachment_status:
+            self.global_offset_h = self.ref_unit*(bounds['resevoir'] - (bounds['rects_2'] + bounds['rects_3'])/2)
+            self.resevoir_volumn =  getattr(self, f'resevoir_volumn_S{self.mvp_channel}')
+            self.label_resevoir = self.pump_settings['S{}_solution'.format(self.mvp_channel)]
+        key = self._static_layer_key()
+        if key != self._static_key:
+            self._build_static_layers(bounds)
+            self._static_key = key
         qp = QPainter()
         qp.begin(self)
-        # self.draw_syringe(qp)
-        inter_syringe_width = self.width()/self.ref_unit/6 * 0.8
-        left_bound_rects_1 = 6
-        left_bound_rects_2 = left_bound_rects_1 + inter_syringe_width
-        left_bound_rects_4 = self.width()/self.ref_unit - 18
-        left_bound_rects_3 = left_bound_rects_4 - inter_syringe_width
-        left_bound_cell = (left_bound_rects_3 +left_bound_rects_2)/2 + 3
-        left_bound_resevoir = 1
-        left_bound_waste = left_bound_rects_4 + 10
-        if self.mvp_detachment_status:
-            self.global_offset_h = self.ref_unit*(left_bound_resevoir - (left_bound_rects_2 + left_bound_rects_3)/2)
+        #static layer: outlines, valve bodies and labels
+        qp.drawPixmap(0, 0, self._static_layer)
+        #dynamic layer: fill levels, valve positions, status and flow lines
+        self.draw_dynamic_layer(qp, bounds)
+        #overlay: markers, cell and mvp body on top of the flow lines
+        qp.drawPixmap(0, 0, self._overlay_layer)
+        self.draw_dynamic_overlay(qp)
+        qp.end()
+        #partial repaints keep the line style, otherwise the dashes would not match across regions
+        if e.rect().contains(self.rect()):
+            self.line_style=self.line_style*-1
 
-        line_styles = [Qt.DashDotDotLine,Qt.DashLine]
+    def _left_bounds(self):
+        #horizontal positions (in ref_unit) of the syringes, cell and bottles
+        inter_syringe_width = self.width()/self.ref_unit/6 * 0.8
+        bounds = {'rects_1':6}
+        bounds['rects_2'] = bounds['rects_1'] + inter_syringe_width
+        bounds['rects_4'] = self.width()/self.ref_unit - 18
+        bounds['rects_3'] = bounds['rects_4'] - inter_syringe_width
+        bounds['cell'] = (bounds['rects_3'] + bounds['rects_2'])/2 + 3
+        bounds['resevoir'] = 1
+        bounds['waste'] = bounds['rects_4'] + 10
+        return bounds
+
+    def _syringe_labels(self):
         if not self.mvp_detachment_status:
-            rects_1 = self.draw_syringe(qp,'volume_syringe_1',[6*0 + left_bound_rects_1,5+2],[250,0,0],label =['S1', self.pump_settings['S1_solution']],volume = self.syringe_size)
-            rects_2 = self.draw_syringe(qp,'volume_syringe_2',[12*0 + left_bound_rects_2,5+2],[100,100,0],label = ['S2', self.pump_settings['S2_solution']], volume = self.syringe_size)
-            rects_3 = self.draw_syringe(qp,'volume_syringe_3',[20*0 + left_bound_rects_3,5+2],[0,200,0], label = ['S3', self.pump_settings['S3_solution']], volume = self.syringe_size)
-            rects_4 = self.draw_syringe(qp,'volume_syringe_4',[26*0 + left_bound_rects_4,5+2],[0,100,250],label=['S4', self.pump_settings['S4_solution']],volume = self.syringe_size)
-        else:
-            tag_ = 'S{}_solution'.format(self.mvp_channel)
-            rects_1 = self.draw_syringe(qp,'volume_syringe_1',[6*0 + left_bound_rects_1,5+2],[250,0,0],label =['S1', self.pump_settings[tag_]],volume = self.syringe_size)
-            rects_2 = self.draw_syringe(qp,'volume_syringe_2',[12*0 + left_bound_rects_2,5+2],[100,100,0],label = ['S2', self.pump_settings[tag_]], volume = self.syringe_size)
-            rects_3 = self.draw_syringe(qp,'volume_syringe_3',[20*0 + left_bound_rects_3,5+2],[0,200,0], label = ['S3', 'waste'], volume = self.syringe_size)
-            rects_4 = self.draw_syringe(qp,'volume_syringe_4',[26*0 + left_bound_rects_4,5+2],[0,100,250],label=['S4', 'waste'],volume = self.syringe_size)
-            self.resevoir_volumn =  getattr(self, f'resevoir_volumn_S{self.mvp_channel}')
-            self.label_resevoir = self.pump_settings[tag_]
-        self.draw_valve(qp,rects_1[1],connect_port=self.connect_valve_port[1])
-        self.draw_valve(qp,rects_2[1],connect_port=self.connect_valve_port[2])
-        self.draw_valve(qp,rects_3[1],connect_port=self.connect_valve_port[3])
-        self.draw_valve(qp,rects_4[1],connect_port=self.connect_valve_port[4])
+            return {i:self.pump_settings['S{}_solution'.format(i)] for i in self.syringe_indices}
+        solution = self.pump_settings['S{}_solution'.format(self.mvp_channel)]
+        return {1:solution, 2:solution, 3:'waste', 4:'waste'}
+
+    def _static_layer_key(self):
+        #everything the cached layers depend on, they are rebuilt when any of these change
+        detached_channel = self.mvp_channel if self.mvp_detachment_status else None
+        return (self.width(), self.height(), self.devicePixelRatioF(), tuple(self.syringe_indices), tuple(sorted(self.pump_settings.items())),
+                self.mvp_detachment_status, detached_channel, self.operation_mode == 'clean_mode', self.label_resevoir,
+                self.global_offset_h, self.global_offset_v, self.number_of_channel_mvp, self.ref_unit,
+                self.resevoir_volumn_total, self.waste_volumn_total, self.bottom_height_total)
+
+    def _new_layer(self):
+        dpr = self.devicePixelRatioF()
+        pixmap = QPixmap(max(1, int(self.width()*dpr)), max(1, int(self.height()*dpr)))
+        pixmap.setDevicePixelRatio(dpr)
+        pixmap.fill(Qt.transparent)
+        return pixmap
+
+    def _build_static_layers(self, bounds):
+        labels = self._syringe_labels()
+        self._static_layer = self._new_layer()
+        self._overlay_layer = self._new_layer()
+        qp = QPainter()
+        qp.begin(self._static_layer)
+        syringe_rects = {}
+        for i in self.syringe_indices:
+            syringe_rects[i] = self.draw_syringe(qp,'volume_syringe_{}'.format(i),[bounds['rects_{}'.format(i)],5+2],SYRINGE_COLORS[i],label = ['S{}'.format(i), labels[i]],volume = self.syringe_size, layer = 'static')
+            self.draw_valve(qp,syringe_rects[i][1],layer = 'static')
+        rects_resevoir = self.draw_bottle(qp, offset = [bounds['resevoir'],8+2],volume=self.resevoir_volumn_total,label = self.label_resevoir, layer = 'static')
+        rects_waste = self.draw_bottle(qp, offset = [bounds['waste'],8+2], volume = self.waste_volumn_total,label = 'Waste', layer = 'static')
+        qp.end()
 
+        qp.begin(self._overlay_layer)
+        for i in self.syringe_indices:
+            self.draw_syringe(qp,'volume_syringe_{}'.format(i),[bounds['rects_{}'.format(i)],5+2],SYRINGE_COLORS[i],label = ['S{}'.format(i), labels[i]],volume = self.syringe_size, layer = 'overlay')
+        self.draw_bottle(qp, offset = [bounds['resevoir'],8+2],volume=self.resevoir_volumn_total,label = self.label_resevoir, layer = 'overlay')
+        self.draw_bottle(qp, offset = [bounds['waste'],8+2], volume = self.waste_volumn_total,label = 'Waste', layer = 'overlay')
+        #Not showing the cell in the clean_mode
+        self.draw_cell(qp,offset=[bounds['cell']*self.ref_unit,(1.3)*self.ref_unit], layer = ['static', None][int(self.operation_mode == 'clean_mode')])
+        self.draw_mvp_valve(qp,self._mvp_dim(), connected_channel = self.mvp_channel, layer = 'static')
+        qp.end()
+        self._layout = {'syringe_rects':syringe_rects,
+                        'resevoir':rects_resevoir[0],
+                        'waste':rects_waste[0],
+                        'mvp_spokes':self.mvp_spoke_coords(self._mvp_dim())}
+        #areas invalidated when only the state drawn inside them changed, with room for the text labels
+        regions = {}
+        for i in self.syringe_indices:
+            regions['syringe_{}'.format(i)] = self._bounding_rect(syringe_rects[i]).adjusted(-20, -5, 80, 130)
+        regions['resevoir'] = self._bounding_rect(rects_resevoir + [self._layout['resevoir'][:2] + [90, self.bottom_height_total + 30]]).adjusted(-5, -5, 60, 60)
+        regions['waste'] = self._bounding_rect(rects_waste + [self._layout['waste'][:2] + [90, self.bottom_height_total + 30]]).adjusted(-5, -5, 60, 60)
+        regions['cell'] = self._bounding_rect([self.cell_rect, self._mvp_dim()]).adjusted(-70, -60, 120, 40)
+        self._layout['regions'] = regions
+
+    def _bounding_rect(self, rects):
+        x0 = min([each[0] for each in rects])
+        y0 = min([each[1] for each in rects])
+        x1 = max([each[0]+each[2] for each in rects])
+        y1 = max([each[1]+each[3] for each in rects])
+        return QRect(int(x0), int(y0), int(x1-x0)+1, int(y1-y0)+1)
+
+    def _mvp_dim(self):
+        return [self.cell_rect[0] - (50 - self.cell_rect[2])/2 + self.global_offset_h, self.cell_rect[1]+20 + self.global_offset_v, 50, 50]
+
+    def draw_dynamic_layer(self, qp, bounds):
+        line_styles = [Qt.DashDotDotLine,Qt.DashLine]
+        syringe_rects = self._layout['syringe_rects']
+        labels = self._syringe_labels()
+        for i in self.syringe_indices:
+            self.draw_syringe(qp,'volume_syringe_{}'.format(i),[bounds['rects_{}'.format(i)],5+2],SYRINGE_COLORS[i],label = ['S{}'.format(i), labels[i]],volume = self.syringe_size, layer = 'dynamic')
+            self.draw_valve(qp,syringe_rects[i][1],connect_port=self.connect_valve_port[i], layer = 'dynamic')
         offset_ver = 70
         offset_hor = 11
-        self.draw_radio_signal(qp,[rects_1[8][0]-offset_hor,rects_1[8][1]+offset_ver],msg=self.connect_status[1])
-        self.draw_radio_signal(qp,[rects_2[8][0]-offset_hor,rects_2[8][1]+offset_ver],msg=self.connect_status[2])
-        self.draw_radio_signal(qp,[rects_3[8][0]-offset_hor,rects_3[8][1]+offset_ver],msg=self.connect_status[3])
-        self.draw_radio_signal(qp,[rects_4[8][0]-offset_hor,rects_4[8][1]+offset_ver],msg=self.connect_status[4])
-        # if self.operation_mode in ['auto_refilling','init_mode']:
-        #Not showing the cell in the clean_mode
-        if not self.operation_mode == 'clean_mode':
-            self.draw_cell(qp,offset=[(19.5*0 + left_bound_cell)*self.ref_unit,(1.3)*self.ref_unit])
-        rects_resevoir = self.draw_bottle(qp, fill_height = self.resevoir_volumn/self.resevoir_volumn_total*self.bottom_height_total, offset = [1*0+ left_bound_resevoir,8+2],volume=self.resevoir_volumn_total,label = self.label_resevoir)
-        rects_waste = self.draw_bottle(qp, fill_height = self.waste_volumn/self.waste_volumn_total*self.bottom_height_total, offset = [36*0 + left_bound_waste,8+2], volume = self.waste_volumn_total,label = 'Waste')
-        # self.draw_mvp_valve(qp,[rects_waste[0][0]+150, rects_waste[0][1]-150, 50, 50],connected_channel = self.mvp_channel)
+        for i in self.syringe_indices:
+            self.draw_radio_signal(qp,[syringe_rects[i][8][0]-offset_hor,syringe_rects[i][8][1]+offset_ver],msg=self.connect_status[i])
+        self.draw_bottle(qp, fill_height = self.resevoir_volumn/self.resevoir_volumn_total*self.bottom_height_total, offset = [bounds['resevoir'],8+2],volume=self.resevoir_volumn_total,label = self.label_resevoir, layer = 'dynamic')
+        self.draw_bottle(qp, fill_height = self.waste_volumn/self.waste_volumn_total*self.bottom_height_total, offset = [bounds['waste'],8+2], volume = self.waste_volumn_total,label = 'Waste', layer = 'dynamic')
+
+        spokes = self._layout['mvp_spokes']
+        #the cell side port sits 8 px above the mvp body
+        mvp_connect_coord_cell = [spokes[0][0], spokes[0][1]-8]
         if not self.mvp_detachment_status:
-            mvp_connect_coord_channel, mvp_connect_coord_cell = self.draw_mvp_valve(qp,[self.cell_rect[0] - (50 - self.cell_rect[2])/2, self.cell_rect[1]+20, 50, 50],connected_channel = self.mvp_channel, syringe_connected_channel = self.get_syringe_mvp_cell_inlet_channel())
+            mvp_connect_coord_channel = spokes[self.get_syringe_mvp_cell_inlet_channel()]
         else:
-            dim_ = [self.cell_rect[0] - (50 - self.cell_rect[2])/2 + self.global_offset_h, self.cell_rect[1]+20 + self.global_offset_v, 50, 50]
-            coord_center = [dim_[0]+dim_[2]/2,dim_[1]+dim_[3]/2]
-            rot_ang = np.pi*2/self.number_of_channel_mvp * 1
-            mvp_connect_coord_channel = list(np.array(coord_center) - np.array([dim_[2]/2*np.sin(rot_ang),dim_[2]/2*np.cos(rot_ang)]))
-            mvp_connect_coord_cell = list(np.array(coord_center) - np.array([dim_[2]/2*np.sin(0),dim_[2]/2*np.cos(0)]) - np.array([0,8]))
-        mvp_connect_rect_channel = list(mvp_connect_coord_channel- np.array([1,1])) + [2,2]
-        mvp_connect_rect_cell = list(mvp_connect_coord_cell- np.array([1,1])) + [2,2]
-        pen = QPen([Qt.red,Qt.blue][0], 2, line_styles[int(self.line_style==1)])
-        qp.setPen(pen)
+            mvp_connect_coord_channel = spokes[1]
+        mvp_connect_rect_channel = [mvp_connect_coord_channel[0]-1, mvp_connect_coord_channel[1]-1, 2, 2]
+        mvp_connect_rect_cell = [mvp_connect_coord_cell[0]-1, mvp_connect_coord_cell[1]-1, 2, 2]
         #rects map
-        rects_map = {#'cell_inlet':mvp_connect_rect_channel,
-                     'cell_inlet':self.cell_rect,
-                    #  'cell_outlet':mvp_connect_rect_cell,
+        rects_map = {'cell_inlet':self.cell_rect,
                      'cell_outlet':self.cell_rect,
-                    #  'resevoir':rects_resevoir[0],
                      'resevoir':mvp_connect_rect_cell,
-                     'waste':rects_waste[0],
+                     'waste':self._layout['waste'],
                      'left':2,
                      'up':0,
                      'right':3}
 
-
         height_map = {'waste':80,
                       'resevoir':30,
                       'cell_inlet':0,
@@ -280,11 +433,11 @@ class syringe_widget(QWidget):
         if not self.mvp_detachment_status:
             rects_map['cell_outlet'] = mvp_connect_rect_cell
             rects_map['cell_inlet'] = mvp_connect_rect_channel
-            rects_map['resevoir'] = rects_resevoir[0]
+            rects_map['resevoir'] = self._layout['resevoir']
             height_map['resevoir'] = 120
 
         lines = []
-        line_index = [1,2,3,4]
+        line_index = list(self.syringe_indices)
         if self.operation_mode == 'simple_exchange_mode':
             line_index = [self.actived_left_syringe_simple_exchange_mode,self.actived_right_syringe_simple_exchange_mode]
         elif self.operation_mode == 'init_mode':
@@ -302,7 +455,7 @@ class syringe_widget(QWidget):
             if connection in ['resevoir', 'waste', 'cell_inlet', 'cell_outlet']:
                 connection_direction = self._get_directions(connection)
                 connection_rect = rects_map[connection]
-                rect = eval('rects_{}[{}]'.format(i,rects_map[valve_pos]))
+                rect = syringe_rects[i][rects_map[valve_pos]]
                 rect_direction = valve_pos
                 height = height_map[connection]
                 if self.operation_mode == 'normal_mode' and connection == 'waste':
@@ -311,21 +464,18 @@ class syringe_widget(QWidget):
                 ext2 = extension_map[connection_direction]
                 lines.append(self.cal_line_coords(rect, connection_rect,rect_direction, connection_direction, ext1, ext2, height))
         if self.mvp_detachment_status:
-            lines.append(self.cal_line_coords(rects_resevoir[0], mvp_connect_rect_channel,'up', 'up', 0, 0, 10))
+            lines.append(self.cal_line_coords(self._layout['resevoir'], mvp_connect_rect_channel,'up', 'up', 0, 0, 10))
         pen = QPen([Qt.red,Qt.blue][0], 2, line_styles[int(self.line_style==1)])
         qp.setPen(pen)
-        for i in range(len(lines)):
-            each_line = lines[i]
+        for each_line in lines:
             for ii in range(len(each_line)-1):
                 qp.drawLine(*(each_line[ii]+each_line[ii+1]))
-        self.line_style=self.line_style*-1
-        
+
+    def draw_dynamic_overlay(self, qp):
         #Not showing the cell in the clean_mode
-        #redraw cell and mvp valve to make crossed lines shown underneath
         if not self.operation_mode == 'clean_mode':
-            self.draw_cell(qp,offset=[(19.5*0 + left_bound_cell)*self.ref_unit,(1.3)*self.ref_unit])
-        mvp_connect_coord_channel, mvp_connect_coord_cell = self.draw_mvp_valve(qp,[self.cell_rect[0] - (50 - self.cell_rect[2])/2, self.cell_rect[1]+20, 50, 50],connected_channel = self.mvp_channel, syringe_connected_channel = self.get_syringe_mvp_cell_inlet_channel())
-        qp.end()
+            self.draw_cell(qp, layer = 'dynamic')
+        self.draw_mvp_valve(qp,self._mvp_dim(),connected_channel = self.mvp_channel, layer = 'dynamic')
 
     def cal_ref_pos(self,width,hight,x_ref,y_ref,width_ref,hight_ref,align = 'left',offset = 0):
         if align == 'left':
@@ -462,22 +612,27 @@ class syringe_widget(QWidget):
             top_right_pos = [end_pos_next[0],ref_height]
             return [start_pos,start_pos_next,top_left_pos,top_right_pos,end_pos_next,end_pos]
 
-    def draw_cell(self,qp,l1=80,l2=20,offset = [0,0]):
-        path = QPainterPath()
-        x,y = offset
-        path.moveTo(*offset)
-        path.lineTo(x+l1,y)
-        path.lineTo(x+l1-(l1-l2)/2,y+(l1-l2)/2)
-        path.lineTo(x+l1-(l1-l2)/2-l2,y+(l1-l2)/2)
-        path.lineTo(x,y)
-        path.addRect(x+l1-(l1-l2)/2-l2,y+(l1-l2)/2,l2,l2)
+    def draw_cell(self,qp,l1=80,l2=20,offset = [0,0], layer = 'all'):
+        #layer: 'static' draws the cell body, 'dynamic' the volume text, 'all' both, None only updates cell_rect
+        if layer != 'dynamic':
+            x,y = offset
+            self.cell_rect = [x+l1-(l1-l2)/2-l2,y+(l1-l2)/2,l2,l2]
         qp.setPen(QPen(QColor(79, 106, 25), 1, Qt.SolidLine,
                             Qt.FlatCap, Qt.MiterJoin))
-        qp.setBrush(QColor(122, 163, 39))
-        qp.drawPath(path)
-        self.cell_rect = [x+l1-(l1-l2)/2-l2,y+(l1-l2)/2,l2,l2]
-        qp.drawText(self.cell_rect[0]-15-18,self.cell_rect[1]-35,"cell vol:{:7.1f} ul".format(self.volume_of_electrolyte_in_cell*1000))
-        return [x+l1-(l1-l2)/2-l2,y+(l1-l2)/2,l2,l2]
+        if layer in ['all', 'static']:
+            path = QPainterPath()
+            path.moveTo(*offset)
+            path.lineTo(x+l1,y)
+            path.lineTo(x+l1-(l1-l2)/2,y+(l1-l2)/2)
+            path.lineTo(x+l1-(l1-l2)/2-l2,y+(l1-l2)/2)
+            path.lineTo(x,y)
+            path.addRect(x+l1-(l1-l2)/2-l2,y+(l1-l2)/2,l2,l2)
+            qp.setBrush(QColor(122, 163, 39))
+            qp.drawPath(path)
+        if layer in ['all', 'dynamic']:
+            qp.setFont(QFont('Decorative', font_size))
+            qp.drawText(self.cell_rect[0]-15-18,self.cell_rect[1]-35,"cell vol:{:7.1f} ul".format(self.volume_of_electrolyte_in_cell*1000))
+        return self.cell_rect
 
     def draw_radio_signal(self,qp,pos,dim=[40,40],start_angle=50,num_arcs = 4,vertical_spacing =10, msg='error'):
         color = 'white'
@@ -508,7 +663,8 @@ class syringe_widget(QWidget):
         offset = [2,-15][int(msg=='disconnected')]
         qp.drawText(pos[0]+offset,pos[1]+vertical_spacing*num_arcs,msg)
 
-    def draw_bottle(self,qp,top_width = 80,top_height = 4, bottom_width = 90, fill_height =20, offset = [0,0],color = [0,0,250],label='resevoir',volume=250):
+    def draw_bottle(self,qp,top_width = 80,top_height = 4, bottom_width = 90, fill_height =20, offset = [0,0],color = [0,0,250],label='resevoir',volume=250, layer = 'all'):
+        #layer: 'static' bottle neck and name, 'dynamic' fill level and volume text, 'overlay' markers, 'all' everything
         bottom_height_total = self.bottom_height_total
         rec1_pos = [self.ref_unit*offset[0],self.ref_unit*offset[1]]
         rec1_dim = [bottom_width,top_height*4]
@@ -525,88 +681,96 @@ class syringe_widget(QWidget):
 
         qp.setBrush(QColor(250, 250, 250))
         qp.setPen(QPen(QColor(100, 100, 100), 1, Qt.SolidLine, Qt.FlatCap, Qt.MiterJoin))
-        qp.drawRect(*(rec1_pos+rec1_dim))
-        qp.drawRect(*(rec2_pos+rec2_dim))
-        qp.drawRect(*(rec3_pos+rec3_dim))
-        qp.drawRect(*(rec4_pos+rec4_dim))
-        qp.drawRect(*(rec5_pos+rec5_dim))
-        # qp.setBrush(QColor(0, 0, 250))
-        qp.setBrush(QColor(*color))
-        qp.drawRect(*(rec6_pos+rec6_dim))
-        qp.setBrush(QColor(250, 250, 250))
+        if layer in ['all', 'static']:
+            qp.drawRect(*(rec1_pos+rec1_dim))
+            qp.drawRect(*(rec2_pos+rec2_dim))
+            qp.drawRect(*(rec3_pos+rec3_dim))
+            qp.drawRect(*(rec4_pos+rec4_dim))
+        if layer in ['all', 'dynamic']:
+            qp.drawRect(*(rec5_pos+rec5_dim))
+            # qp.setBrush(QColor(0, 0, 250))
+            qp.setBrush(QColor(*color))
+            qp.drawRect(*(rec6_pos+rec6_dim))
+            qp.setBrush(QColor(250, 250, 250))
         # qp.drawRect(*(rec10_pos+rec10_dim))
         qp.setPen(QPen(QColor(200, 200, 200), 1, Qt.SolidLine, Qt.FlatCap, Qt.MiterJoin))
         qp.setFont(QFont('Decorative', font_size))
-        qp.drawText(rec6_pos[0],rec6_pos[1]+rec6_dim[1]+50,"{}:{:6.2f} ml".format(label,volume/bottom_height_total*fill_height))
-        if label!='Waste':
+        if layer in ['all', 'dynamic']:
+            qp.drawText(rec6_pos[0],rec6_pos[1]+rec6_dim[1]+50,"{}:{:6.2f} ml".format(label,volume/bottom_height_total*fill_height))
+        if label!='Waste' and layer in ['all', 'static']:
             qp.drawText(rec6_pos[0],rec6_pos[1]+rec6_dim[1]+30,"Resevoir")
-        rects = []
-        for i in range(1,6):
-            rect_pos = eval('rec{}_pos'.format(i))
-            rect_dim = eval('rec{}_dim'.format(i))
-            rects.append(rect_pos+rect_dim)
-        qp.setPen(QPen(QColor(10, 10, 10), 1, Qt.SolidLine, Qt.FlatCap, Qt.MiterJoin))
-        # self.draw_markers(qp,rec5_pos+[bottom_width,bottom_height_total],'left',volume,[50,100,150,200],False)
-        markers = [int(volume/5)*(i+1) for i in range(4)]
-        self.draw_markers(qp,rec5_pos+[bottom_width,bottom_height_total],'left',volume,markers,False)
+        rects = [rec1_pos+rec1_dim, rec2_pos+rec2_dim, rec3_pos+rec3_dim, rec4_pos+rec4_dim, rec5_pos+rec5_dim]
+        if layer in ['all', 'overlay']:
+            qp.setPen(QPen(QColor(10, 10, 10), 1, Qt.SolidLine, Qt.FlatCap, Qt.MiterJoin))
+            # self.draw_markers(qp,rec5_pos+[bottom_width,bottom_height_total],'left',volume,[50,100,150,200],False)
+            markers = [int(volume/5)*(i+1) for i in range(4)]
+            self.draw_markers(qp,rec5_pos+[bottom_width,bottom_height_total],'left',volume,markers,False)
         return rects
 
-    def draw_valve(self,qp, dim, connect_port = 'left'):
+    def draw_valve(self,qp, dim, connect_port = 'left', layer = 'all'):
+        #layer: 'static' valve body, 'dynamic' the connected port, 'all' both
         coord_left = [dim[0],dim[1]+dim[3]/2]
         coord_right =[dim[0]+dim[2],dim[1]+dim[3]/2] 
         coord_top = [dim[0]+dim[2]/2,dim[1]]
         coord_bottom = [dim[0]+dim[2]/2,dim[1]+dim[3]]
         coord_center = [dim[0]+dim[2]/2,dim[1]+dim[3]/2]
-        qp.setPen(QPen(Qt.green,  4, Qt.SolidLine))
-        qp.drawEllipse(*dim)
-        qp.setPen(QPen(Qt.red,  4, Qt.SolidLine))
-        if connect_port == 'left':
-            qp.drawLine(*(coord_left+coord_center))
-        elif connect_port == 'right':
-            qp.drawLine(*(coord_right+coord_center))
-        elif connect_port == 'up':
-            qp.drawLine(*(coord_top+coord_center))
-        qp.drawLine(*(coord_bottom+coord_center))
-
-    def draw_mvp_valve(self,qp, dim, connected_channel = 3, syringe_connected_channel =3):
-        dim[0] = dim[0] + self.global_offset_h
-        dim[1] = dim[1] + self.global_offset_v
+        if layer in ['all', 'static']:
+            qp.setPen(QPen(Qt.green,  4, Qt.SolidLine))
+            qp.drawEllipse(*dim)
+        if layer in ['all', 'dynamic']:
+            qp.setPen(QPen(Qt.red,  4, Qt.SolidLine))
+            if connect_port == 'left':
+                qp.drawLine(*(coord_left+coord_center))
+            elif connect_port == 'right':
+                qp.drawLine(*(coord_right+coord_center))
+            elif connect_port == 'up':
+                qp.drawLine(*(coord_top+coord_center))
+            qp.drawLine(*(coord_bottom+coord_center))
+
+    def mvp_spoke_coords(self, dim):
+        #outer end of each mvp channel spoke, channel 0 goes to the cell
+        coord_center = [dim[0]+dim[2]/2,dim[1]+dim[3]/2]
+        coords = []
+        for i in range(self.number_of_channel_mvp):
+            rot_ang = np.pi*2/self.number_of_channel_mvp*i
+            coords.append([coord_center[0] - dim[2]/2*np.sin(rot_ang), coord_center[1] - dim[2]/2*np.cos(rot_ang)])
+        return coords
 
+    def draw_mvp_valve(self,qp, dim, connected_channel = 3, syringe_connected_channel =3, layer = 'all'):
+        #dim includes the global offset (see _mvp_dim)
+        #layer: 'static' valve body and idle channels, 'dynamic' the connected channel and label, 'all' everything
         coord_center = [dim[0]+dim[2]/2,dim[1]+dim[3]/2]
-        qp.setPen(QPen(Qt.blue,  2, Qt.SolidLine))
-        # qp.drawRect(*dim)
+        spokes = self.mvp_spoke_coords(dim)
+        spokes[0] = [spokes[0][0], spokes[0][1]-8]
+        return_coord_cell = spokes[0]
         return_coord_channel = None
-        return_coord_cell = None
-        if self.operation_mode !='clean_mode':
+        if 0<=syringe_connected_channel<len(spokes):
+            return_coord_channel = spokes[syringe_connected_channel]
+        if self.operation_mode =='clean_mode':
+            return return_coord_channel, return_coord_cell
+
+        if layer in ['all', 'static']:
+            qp.setPen(QPen(Qt.blue,  2, Qt.SolidLine))
+            qp.drawEllipse(*dim)
             if not self.mvp_detachment_status:
-                qp.drawEllipse(*dim)
-                qp.setPen(QPen(Qt.blue,  2, Qt.SolidLine))
                 qp.drawEllipse(*(coord_center+[2,2]))
             else:
-                qp.drawEllipse(*dim)
-                # qp.setPen(QPen(Qt.blue,  1, Qt.SolidLine))
-                # qp.drawEllipse(*(coord_center+[2,2]))
                 qp.setPen(QPen(Qt.red,  2, Qt.SolidLine))
                 qp.drawArc(*(list(dim)+[int((360/self.number_of_channel_mvp*1 + 90)*16), int((360/self.number_of_channel_mvp*(self.mvp_channel-1))*16)]))
-
-        qp.setPen(QPen(Qt.blue,  4, Qt.SolidLine))
-        for i in range(self.number_of_channel_mvp):
-            if i in [0, connected_channel]:
-                qp.setPen(QPen(Qt.red, 2, Qt.SolidLine))
-            else:
-                qp.setPen(QPen(Qt.black, 2, Qt.DotLine))
-            rot_ang = np.pi*2/self.number_of_channel_mvp*i
-            coord_tmp = list(np.array(coord_center) - np.array([dim[2]/2*np.sin(rot_ang),dim[2]/2*np.cos(rot_ang)]))
-            if i == 0:
-                coord_tmp = list(coord_tmp - np.array([0,8]))
-                return_coord_cell = coord_tmp
-            if i == syringe_connected_channel:
-                return_coord_channel = coord_tmp
-            if self.operation_mode !='clean_mode':
-                qp.drawLine(*(coord_tmp+coord_center))
-        qp.setFont(QFont('Decorative', font_size))
-        qp.setPen(QPen(Qt.red,  4, Qt.SolidLine))
-        if self.operation_mode !='clean_mode':
+            #the connected channel is drawn by the dynamic layer
+            red_channels = [0, connected_channel] if layer == 'all' else [0]
+            for i in range(self.number_of_channel_mvp):
+                if i in red_channels:
+                    qp.setPen(QPen(Qt.red, 2, Qt.SolidLine))
+                else:
+                    qp.setPen(QPen(Qt.black, 2, Qt.DotLine))
+                qp.drawLine(*(spokes[i]+coord_center))
+        if layer == 'dynamic' and 0<=connected_channel<len(spokes):
+            qp.setPen(QPen(Qt.red, 2, Qt.SolidLine))
+            qp.drawLine(*(spokes[connected_channel]+coord_center))
+        if layer in ['all', 'dynamic']:
+            qp.setFont(QFont('Decorative', font_size))
+            qp.setPen(QPen(Qt.red,  4, Qt.SolidLine))
             # qp.drawText(dim[0],dim[1]+80,"{}-->MVP".format(self.mvp_connected_valve))
             if not self.mvp_detachment_status:
                 qp.drawText(dim[0],dim[1]+80,"S{}-->MVP".format(self.mvp_channel))
@@ -630,7 +794,8 @@ class syringe_widget(QWidget):
             qp.drawLine(*each)
             qp.drawText(each[2],each[3],"{} ml".format(marker_pos_in_ml[marker_pos_in_pix.index(each)]))
 
-    def draw_syringe(self,qp,vol_tag = 'volume',origin_offset = [0,0],color = [0,0,250],label = 'S1',volume = 12.5):
+    def draw_syringe(self,qp,vol_tag = 'volume',origin_offset = [0,0],color = [0,0,250],label = 'S1',volume = 12.5, layer = 'all'):
+        #layer: 'static' syringe body and solution, 'dynamic' fill level, plunger and volume text, 'overlay' markers, 'all' everything
         ref_unit = self.ref_unit
         col = QColor(0, 0, 0)
         col.setNamedColor('#d4d4d4')
@@ -666,34 +831,36 @@ class syringe_widget(QWidget):
         rec_tube = rec6_pos+[ref_unit*4,ref_unit*8]
 
         # print(rec7_pos+rec7_dim)
-        qp.drawRect(*(rec1_pos+rec1_dim))
-        qp.drawRect(*(rec2_pos+rec2_dim))
-        qp.drawRect(*(rec3_pos+rec3_dim))
-        qp.drawRect(*(rec4_pos+rec4_dim))
-        qp.drawRect(*(rec5_pos+rec5_dim))
-        # qp.setBrush(QColor(0, 0, 250))
-        qp.setBrush(QColor(*color))
-        qp.drawRect(*(rec6_pos+rec6_dim))
-        qp.setBrush(QColor(250, 250, 250))
-        qp.drawRect(*(rec7_pos+rec7_dim))
-        qp.setBrush(QColor(150, 150, 150))
-        qp.drawRect(*(rec8_pos+rec8_dim))
-        qp.setBrush(QColor(50, 50, 50))
-        qp.drawRect(*(rec9_pos+rec9_dim))
+        if layer in ['all', 'static']:
+            qp.drawRect(*(rec1_pos+rec1_dim))
+            qp.drawRect(*(rec2_pos+rec2_dim))
+            qp.drawRect(*(rec3_pos+rec3_dim))
+            qp.drawRect(*(rec4_pos+rec4_dim))
+            qp.drawRect(*(rec5_pos+rec5_dim))
+        if layer in ['all', 'dynamic']:
+            # qp.setBrush(QColor(0, 0, 250))
+            qp.setBrush(QColor(*color))
+            qp.drawRect(*(rec6_pos+rec6_dim))
+            qp.setBrush(QColor(250, 250, 250))
+            qp.drawRect(*(rec7_pos+rec7_dim))
+            qp.setBrush(QColor(150, 150, 150))
+            qp.drawRect(*(rec8_pos+rec8_dim))
+        if layer in ['all', 'static']:
+            qp.setBrush(QColor(50, 50, 50))
+            qp.drawRect(*(rec9_pos+rec9_dim))
         # qp.drawRect(*(rec10_pos+rec10_dim))
         qp.setFont(QFont("Arial", font_size))
         qp.setPen(QPen(QColor(250, 250, 250), 1, Qt.SolidLine, Qt.FlatCap, Qt.MiterJoin))
-        qp.drawText(rec8_pos[0],rec9_pos[1]+40,label[1])
-        # qp.drawText(rec8_pos[0],rec9_pos[1]+60,"{}:{:6.2f} ml".format(label[0],getattr(self,vol_tag)))
-        qp.drawText(rec8_pos[0],rec9_pos[1]+60,"{}:{:7.1f} ul".format(label[0],getattr(self,vol_tag)*1000))
-        rects = []
-        for i in range(1,10):
-            rect_pos = eval('rec{}_pos'.format(i))
-            rect_dim = eval('rec{}_dim'.format(i))
-            rects.append(rect_pos+rect_dim)
-        qp.setPen(QPen(QColor(0, 0, 0), 1, Qt.SolidLine, Qt.FlatCap, Qt.MiterJoin))
-        qp.setFont(QFont("Arial", font_size))
-        self.draw_markers(qp,rec_tube)
+        if layer in ['all', 'static']:
+            qp.drawText(rec8_pos[0],rec9_pos[1]+40,label[1])
+        if layer in ['all', 'dynamic']:
+            # qp.drawText(rec8_pos[0],rec9_pos[1]+60,"{}:{:6.2f} ml".format(label[0],getattr(self,vol_tag)))
+            qp.drawText(rec8_pos[0],rec9_pos[1]+60,"{}:{:7.1f} ul".format(label[0],getattr(self,vol_tag)*1000))
+        rects = [rec1_pos+rec1_dim, rec2_pos+rec2_dim, rec3_pos+rec3_dim, rec4_pos+rec4_dim, rec5_pos+rec5_dim,
+                 rec6_pos+rec6_dim, rec7_pos+rec7_dim, rec8_pos+rec8_dim, rec9_pos+rec9_dim]
+        if layer in ['all', 'overlay']:
+            qp.setPen(QPen(QColor(0, 0, 0), 1, Qt.SolidLine, Qt.FlatCap, Qt.MiterJoin))
+            self.draw_markers(qp,rec_tube)
         qp.setFont(QFont("Arial", font_size, QFont.Bold))
         return rects
 
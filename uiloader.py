@@ -0,0 +1,74 @@
+"""Load Qt designer .ui files from cached, precompiled Python modules.
+
+uic.loadUi parses the XML and builds the widgets through the uic runtime loader on every start.
+load_ui compiles the .ui file once with uic.compileUi into __uicache__/<name>_ui.py next to the
+.ui file and afterwards only imports that module (and its .pyc). The first line of the cached
+module holds the sha1 of the .ui content it was made from, a changed .ui file is compiled again.
+If the cache can not be written or imported (eg. read-only install) the .ui is loaded with
+uic.loadUi as before.
+"""
+import os
+import io
+import hashlib
+import importlib.util
+
+CACHE_DIR = '__uicache__'
+HEADER = '# ui-sha1: {}\n'
+
+def ui_digest(ui_path):
+    with open(ui_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def cached_module_path(ui_path):
+    folder, name = os.path.split(os.path.abspath(ui_path))
+    return os.path.join(folder, CACHE_DIR, os.path.splitext(name)[0] + '_ui.py')
+
+def compile_ui(ui_path, force = False):
+    #(re)generate the cached module if missing or made from another .ui content, return its path
+    target = cached_module_path(ui_path)
+    header = HEADER.format(ui_digest(ui_path))
+    if not force and os.path.isfile(target):
+        with open(target) as f:
+            if f.readline() == header:
+                return target
+    #the compiler is only imported when a .ui file changed
+    from PyQt5 import uic
+    code = io.StringIO()
+    uic.compileUi(ui_path, code)
+    os.makedirs(os.path.dirname(target), exist_ok = True)
+    #write to a temp file first, a second instance starting at the same time never sees half a module
+    temp = '{}.{}.tmp'.format(target, os.getpid())
+    with open(temp, 'w') as f:
+        f.write(header + code.getvalue())
+    os.replace(temp, target)
+    return target
+
+#ui path -> Ui_* class, each module is imported once per process
+_ui_classes = {}
+
+def ui_class(ui_path):
+    ui_path = os.path.abspath(ui_path)
+    if ui_path not in _ui_classes:
+        target = compile_ui(ui_path)
+        spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(target))[0], target)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        classes = [value for name, value in vars(module).items() if name.startswith('Ui_')]
+        if len(classes) == 0:
+            raise ImportError('no Ui_ class in {}'.format(target))
+        _ui_classes[ui_path] = classes[0]
+    return _ui_classes[ui_path]
+
+def load_ui(ui_path, instance):
+    #same result as uic.loadUi(ui_path, instance): the child widgets become attributes of instance
+    try:
+        cls = ui_class(ui_path)
+    except Exception as e:
+        print('Fail to use the compiled ui module for {}, load the .ui file instead: {}'.format(ui_path, e))
+        from PyQt5 import uic
+        return uic.loadUi(ui_path, instance)
+    ui = cls()
+    ui.setupUi(instance)
+    for name, value in vars(ui).items():
+        setattr(instance, name, value)
+    return instance
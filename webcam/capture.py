@@ -0,0 +1,109 @@
+import threading
+import time
+import cv2
+from PyQt5 import QtCore
+from PyQt5.QtGui import QImage
+
+class LatestFrameBuffer(object):
+    """Single slot frame buffer shared between the capture thread and its readers.
+
+    put() replaces the slot, so a reader that falls behind only ever gets the newest frame and
+    the stale ones are dropped instead of queued. Every frame gets an increasing sequence number,
+    get(since) returns None when nothing newer than since has arrived.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._item = None
+        self._seq = 0
+        self._taken = 0
+        self.dropped = 0
+
+    def put(self, frame, timestamp = None):
+        with self._lock:
+            if self._seq > self._taken:
+                self.dropped += 1
+            self._seq += 1
+            self._item = (self._seq, time.time() if timestamp == None else timestamp, frame)
+
+    def get(self, since = 0):
+        #return (seq, timestamp, frame) of the latest frame if newer than since
+        with self._lock:
+            if self._item == None or self._item[0] <= since:
+                return None
+            self._taken = self._item[0]
+            return self._item
+
+    def latest(self):
+        #peek at the latest frame without marking it as taken
+        with self._lock:
+            return self._item
+
+    def clear(self):
+        with self._lock:
+            self._item = None
+
+class CameraWorker(QtCore.QObject):
+    """Grab frames from an OpenCV camera off the GUI thread.
+
+    Move the worker to a QThread and connect QThread.started to run(). The blocking
+    VideoCapture.read() paces the loop at the camera frame rate. Each raw BGR frame goes to
+    raw_frames (snapshots, recording), and a copy scaled to preview_size and converted to an
+    RGB QImage goes to preview_frames. The GUI picks up preview frames at its own rate. QImage
+    is safe to build outside the GUI thread, only the QPixmap is made by the reader.
+    """
+    open_failed = QtCore.pyqtSignal(str)
+    read_failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, camera_index = 0, camera_fps = None, preview_size = None):
+        super(CameraWorker, self).__init__()
+        self.camera_index = camera_index
+        #requested camera frame rate, None keeps the driver default
+        self.camera_fps = camera_fps
+        #(width, height) of the preview, None keeps the camera size
+        self.preview_size = preview_size
+        self.raw_frames = LatestFrameBuffer()
+        self.preview_frames = LatestFrameBuffer()
+        self.frames_captured = 0
+        self.running = False
+        self.cap = None
+
+    def set_preview_size(self, width, height):
+        #called from the GUI thread, a tuple assignment is atomic
+        self.preview_size = (max(1, int(width)), max(1, int(height)))
+
+    def _to_preview(self, frame):
+        size = self.preview_size
+        if size != None and (frame.shape[1], frame.shape[0]) != size:
+            #scale first, so the color conversion and the QImage copy only touch the preview pixels
+            interpolation = cv2.INTER_AREA if size[0] < frame.shape[1] else cv2.INTER_LINEAR
+            frame = cv2.resize(frame, size, interpolation = interpolation)
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        height, width, channel = image.shape
+        #copy() detaches the QImage from the numpy buffer
+        return QImage(image.data, width, height, channel*width, QImage.Format_RGB888).copy()
+
+    def run(self):
+        self.cap = cv2.VideoCapture(self.camera_index)
+        if not self.cap.isOpened():
+            self.cap.release()
+            self.cap = None
+            self.open_failed.emit('OpenCV: camera failed to properly initialize! \nOpenCV: out device of bound: {}'.format(self.camera_index))
+            return
+        if self.camera_fps != None:
+            self.cap.set(cv2.CAP_PROP_FPS, self.camera_fps)
+        self.running = True
+        while self.running:
+            ret, frame = self.cap.read()
+            if not ret:
+                self.read_failed.emit('OpenCV: failed to read a frame from camera {}'.format(self.camera_index))
+                time.sleep(0.1)
+                continue
+            timestamp = time.time()
+            self.frames_captured += 1
+            self.raw_frames.put(frame, timestamp)
+            self.preview_frames.put(self._to_preview(frame), timestamp)
+        self.cap.release()
+        self.cap = None
+
+    def stop(self):
+        self.running = False
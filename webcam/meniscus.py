@@ -0,0 +1,176 @@
+"""Meniscus (droplet) size estimation from camera frames and a closed-loop rate trim.
+
+MeniscusEstimator measures the droplet area in pixels from one BGR frame, MeniscusWorker runs it
+on the latest camera frames in a background thread and MeniscusController turns the measured
+area into a push/pull rate imbalance for the exchange pair.
+
+The estimator can be checked against frames saved by webcam.recorder:
+    python -m webcam.meniscus cam_frames --roi 100,80,200,150
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import cv2
+from PyQt5 import QtCore
+
+class MeniscusEstimator(object):
+    """Droplet area from a BGR frame: ROI crop, grayscale, blur, threshold, largest contour.
+
+    roi is (x, y, width, height) in frame pixels, None uses the whole frame. threshold None picks
+    the level with Otsu's method on each frame. The droplet is taken as dark on a bright
+    background (backlit capillary), set invert to False for the opposite.
+    """
+    def __init__(self, roi = None, threshold = None, invert = True, blur = 5, min_area = 20):
+        self.roi = roi
+        self.threshold = threshold
+        self.invert = invert
+        self.blur = blur
+        self.min_area = min_area
+
+    def crop(self, frame):
+        if self.roi == None:
+            return frame
+        x, y, w, h = self.roi
+        return frame[y:y+h, x:x+w]
+
+    def mask(self, frame):
+        image = self.crop(frame)
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if self.blur > 1:
+            image = cv2.GaussianBlur(image, (self.blur, self.blur), 0)
+        mode = cv2.THRESH_BINARY_INV if self.invert else cv2.THRESH_BINARY
+        if self.threshold == None:
+            _, mask = cv2.threshold(image, 0, 255, mode + cv2.THRESH_OTSU)
+        else:
+            _, mask = cv2.threshold(image, self.threshold, 255, mode)
+        #remove speckles before looking for contours
+        return cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+
+    def estimate(self, frame):
+        #return {'area': px, 'bbox': [x, y, w, h] in frame pixels, 'ok': bool}
+        contours = cv2.findContours(self.mask(frame), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        if len(contours) == 0:
+            return {'area':0., 'bbox':None, 'ok':False}
+        areas = np.array([cv2.contourArea(each) for each in contours])
+        largest = int(np.argmax(areas))
+        if areas[largest] < self.min_area:
+            return {'area':float(areas[largest]), 'bbox':None, 'ok':False}
+        x, y, w, h = cv2.boundingRect(contours[largest])
+        if self.roi != None:
+            x, y = x + self.roi[0], y + self.roi[1]
+        return {'area':float(areas[largest]), 'bbox':[int(x), int(y), int(w), int(h)], 'ok':True}
+
+class MeniscusController(object):
+    """PI controller from droplet area to a push/pull rate imbalance.
+
+    The error is relative to the setpoint area, so the gains do not depend on the camera zoom;
+    a controller output of 1 is a trim of max_trim. A positive trim means the droplet is too
+    big: the pull syringe should run faster than the push syringe by trim (same units as the
+    exchange rate). The trim is clamped to max_trim and the integral stops growing while
+    clamped (anti-windup). Errors inside deadband are ignored.
+    """
+    def __init__(self, setpoint = None, kp = 1.0, ki = 0.1, max_trim = 10, deadband = 0.02, smoothing = 0.5):
+        #area in px, None takes the first measurement (hold the current droplet size)
+        self.setpoint = setpoint
+        self.kp = kp
+        self.ki = ki
+        self.max_trim = max_trim
+        self.deadband = deadband
+        #weight of the newest area in the exponential average
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.
+        self.area = None
+        self.trim = 0.
+        self._t = None
+
+    def update(self, area, t = None):
+        t = time.time() if t == None else t
+        if self.setpoint == None:
+            self.setpoint = area
+        if self.area == None:
+            self.area = area
+        else:
+            self.area = self.smoothing*area + (1 - self.smoothing)*self.area
+        dt = 0. if self._t == None else max(0., t - self._t)
+        self._t = t
+        error = (self.area - self.setpoint)/max(self.setpoint, 1.)
+        if abs(error) < self.deadband:
+            error = 0.
+        output = self.kp*error + self.ki*(self.integral + error*dt)
+        if abs(output) < 1:
+            self.integral += error*dt
+        self.trim = float(np.clip(output, -1, 1)*self.max_trim)
+        return self.trim
+
+class MeniscusWorker(QtCore.QObject):
+    """Estimate the droplet area on the latest camera frames off the GUI thread.
+
+    Move the worker to a QThread and connect QThread.started to run(). Only the newest raw frame
+    is analysed every interval seconds, frames arriving in between are skipped.
+    """
+    measured = QtCore.pyqtSignal(object)
+
+    def __init__(self, frames, estimator, interval = 0.2):
+        super(MeniscusWorker, self).__init__()
+        #LatestFrameBuffer with the raw camera frames
+        self.frames = frames
+        self.estimator = estimator
+        self.interval = interval
+        self.running = False
+        self._seq = 0
+
+    def run(self):
+        self.running = True
+        while self.running:
+            t0 = time.time()
+            item = self.frames.latest()
+            if item != None and item[0] > self._seq:
+                self._seq, timestamp, frame = item
+                try:
+                    result = self.estimator.estimate(frame)
+                except Exception as e:
+                    result = {'area':0., 'bbox':None, 'ok':False, 'error':str(e)}
+                result['t'] = timestamp
+                self.measured.emit(result)
+            time.sleep(max(0, self.interval - (time.time() - t0)))
+
+    def stop(self):
+        self.running = False
+
+def analyse_recording(directory, estimator, kinds = ['image']):
+    #run the estimator on the frames listed in frames.jsonl of a FrameRecorder directory
+    results = []
+    with open(os.path.join(directory, 'frames.jsonl')) as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry['kind'] not in kinds:
+                continue
+            frame = cv2.imread(os.path.join(directory, entry['file']))
+            if frame is None:
+                continue
+            result = estimator.estimate(frame)
+            result.update({'t':entry['t'], 'file':entry['file'], 'event':entry['event'],
+                           'exchange_amount':entry['info'].get('exchange_amount', None)})
+            results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Estimate the meniscus area on recorded camera frames')
+    parser.add_argument('directory', help = 'directory with frames.jsonl written by the frame recorder')
+    parser.add_argument('--roi', default = None, help = 'x,y,width,height in pixels')
+    parser.add_argument('--threshold', type = int, default = None, help = 'fixed threshold, Otsu if not given')
+    parser.add_argument('--bright', action = 'store_true', help = 'droplet is brighter than the background')
+    args = parser.parse_args()
+    roi = None if args.roi == None else [int(each) for each in args.roi.split(',')]
+    estimator = MeniscusEstimator(roi = roi, threshold = args.threshold, invert = not args.bright)
+    json.dump(analyse_recording(args.directory, estimator), sys.stdout, indent = 1)
+
+if __name__ == '__main__':
+    main()
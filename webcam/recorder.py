@@ -0,0 +1,157 @@
+import os
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+import cv2
+from PyQt5 import QtCore
+
+INDEX_FILE = 'frames.jsonl'
+
+class FrameRecorder(object):
+    """Write camera snapshots and time-lapse video off the GUI thread.
+
+    snapshot() and video_frame() only put the frame on a bounded queue and return at once; a
+    writer thread encodes the images (cv2.imwrite) and the video segments. When the queue is
+    full the frame is dropped and counted, the caller (a pump timer slot) never waits for the
+    disk. Every written frame is appended to frames.jsonl in the output directory, linking the
+    file (or video segment and frame number) to the pump state passed in info, eg the exchanged
+    volume at capture time.
+
+    Video is encoded with the software MJPG codec into .avi segments, a new segment is started
+    every segment_seconds so a crash only loses the open segment.
+    """
+    def __init__(self, directory, max_queue = 32, image_ext = '.png', video_fps = 10, segment_seconds = 600):
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+        self.image_ext = image_ext
+        self.video_fps = video_fps
+        self.segment_seconds = segment_seconds
+        self._queue = queue.Queue(maxsize = max_queue)
+        self._index = open(os.path.join(directory, INDEX_FILE), 'a')
+        self._video = None
+        self._segment = None
+        self._segment_t0 = 0
+        self._segment_frames = 0
+        self._video_size = None
+        self.frames_written = 0
+        self.dropped = 0
+        self._writer = threading.Thread(target = self._write_loop, name = 'psd_frame_writer', daemon = True)
+        self._writer.start()
+
+    def _put(self, kind, frame, info, event, timestamp):
+        #frame must not be modified by the caller afterwards (camera frames are new arrays for each read)
+        try:
+            self._queue.put_nowait((kind, frame, dict(info or {}), event, time.time() if timestamp == None else timestamp))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def snapshot(self, frame, info = None, event = None, timestamp = None):
+        return self._put('image', frame, info, event, timestamp)
+
+    def video_frame(self, frame, info = None, event = None, timestamp = None):
+        return self._put('video', frame, info, event, timestamp)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item == None:
+                break
+            kind, frame, info, event, timestamp = item
+            try:
+                if kind == 'image':
+                    entry = self._write_image(frame, timestamp, event)
+                else:
+                    entry = self._write_video(frame, timestamp)
+            except Exception as e:
+                print('Fail to write camera frame: {}'.format(e))
+                continue
+            entry.update({'t':timestamp, 'kind':kind, 'event':event, 'info':info})
+            self._index.write(json.dumps(entry) + '\n')
+            self._index.flush()
+            self.frames_written += 1
+        self._close_segment()
+        self._index.close()
+
+    def _stamp(self, timestamp):
+        return datetime.fromtimestamp(timestamp).strftime('%Y%m%d_%H%M%S_%f')[:-3]
+
+    def _write_image(self, frame, timestamp, event):
+        name = 'cam_{}{}{}'.format(self._stamp(timestamp), '' if event == None else '_'+event, self.image_ext)
+        cv2.imwrite(os.path.join(self.directory, name), frame)
+        return {'file':name}
+
+    def _close_segment(self):
+        if self._video != None:
+            self._video.release()
+            self._video = None
+
+    def _write_video(self, frame, timestamp):
+        height, width = frame.shape[:2]
+        if self._video == None or timestamp - self._segment_t0 >= self.segment_seconds or self._video_size != (width, height):
+            self._close_segment()
+            self._segment = 'cam_{}.avi'.format(self._stamp(timestamp))
+            self._video = cv2.VideoWriter(os.path.join(self.directory, self._segment), cv2.VideoWriter_fourcc(*'MJPG'), self.video_fps, (width, height))
+            self._video_size = (width, height)
+            self._segment_t0 = timestamp
+            self._segment_frames = 0
+        self._video.write(frame)
+        self._segment_frames += 1
+        return {'file':self._segment, 'frame':self._segment_frames - 1}
+
+    def close(self):
+        #write everything still queued, then stop the writer thread
+        self._queue.put(None)
+        self._writer.join()
+
+class TimeLapse(QtCore.QObject):
+    """Periodic and event triggered capture of the latest camera frame.
+
+    Every interval seconds (and on capture(event)) the latest raw frame of the camera buffer is
+    passed to the FrameRecorder as snapshot and/or video frame together with info_handle(), a
+    dict describing the pump state. Runs in the GUI thread, a capture costs one queue put.
+    """
+    def __init__(self, frames, recorder, info_handle, interval = 10, images = True, video = False):
+        super(TimeLapse, self).__init__()
+        #LatestFrameBuffer with the raw camera frames
+        self.frames = frames
+        self.recorder = recorder
+        self.info_handle = info_handle
+        self.images = images
+        self.video = video
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.capture)
+        self.set_interval(interval)
+
+    def set_interval(self, interval):
+        self.interval = interval
+        self.timer.setInterval(int(interval*1000))
+
+    def start(self):
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def isActive(self):
+        return self.timer.isActive()
+
+    def capture(self, event = None):
+        item = self.frames.latest()
+        if item == None:
+            return False
+        _, timestamp, frame = item
+        info = self.info_handle()
+        ok = True
+        #event frames are always kept as images, periodic ones follow the images/video switches
+        if self.images or event != None:
+            ok = self.recorder.snapshot(frame, info, event, timestamp) and ok
+        if self.video:
+            ok = self.recorder.video_frame(frame, info, event, timestamp) and ok
+        return ok